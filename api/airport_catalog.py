@@ -0,0 +1,191 @@
+import threading
+import time
+
+# Intervallo di refresh del catalogo e attesa minima prima di riprovare dopo un download fallito
+CATALOG_TTL = 6 * 3600
+RETRY_AFTER = 60
+
+def _format_airport(a: dict) -> dict:
+    return {
+        "code": a["iataCode"],
+        "name": a["name"],
+        "city": a.get("city", {}).get("name", a["name"]),
+        "country": a.get("country", {}).get("name", ""),
+    }
+
+def _ngrams(text: str, n: int) -> set[str]:
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+class AirportCatalog:
+    """
+    Catalogo aeroporti di processo, scaricato una volta e aggiornato dopo `ttl` secondi.
+    Il refresh di un catalogo già caricato avviene in background: le richieste continuano
+    a usare i dati correnti e non attendono mai l'upstream.
+
+    La ricerca usa un indice a n-grammi (1, 2 e 3 caratteri) su nome, città, codice e
+    paese: una query corta è un lookup diretto, una lunga interseca i trigrammi e verifica
+    solo i candidati. I risultati sono ordinati per rilevanza (codice, città, nome, paese).
+    """
+
+    def __init__(self, loader, ttl: float = CATALOG_TTL):
+        self._loader = loader
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._loaded_at = 0.0
+        self._attempted_at = 0.0
+        self._raw: list[dict] = []
+        self._airports: list[dict] = []
+        self._by_name: list[dict] = []
+        self._city_lookup: dict[str, str] = {}
+        self._search_text: list[str] = []
+        self._grams: dict[str, set[int]] = {}
+
+    def _build(self, raw: list[dict]):
+        airports = [_format_airport(a) for a in raw if "iataCode" in a and "name" in a]
+        search_text = [
+            "\x00".join((a["code"], a["city"], a["name"], a["country"])).lower()
+            for a in airports
+        ]
+        grams: dict[str, set[int]] = {}
+        for idx, text in enumerate(search_text):
+            for n in (1, 2, 3):
+                for gram in _ngrams(text, n):
+                    grams.setdefault(gram, set()).add(idx)
+        city_lookup = {
+            a["iataCode"]: a.get("city", {}).get("name", a["name"])
+            for a in raw if "iataCode" in a
+        }
+        by_name = sorted(airports, key=lambda x: x["name"])
+        # Assegnazione in blocco: i lettori vedono sempre un indice coerente
+        self._raw, self._airports, self._by_name, self._search_text, self._grams, self._city_lookup = (
+            raw, airports, by_name, search_text, grams, city_lookup
+        )
+
+    def _load(self):
+        try:
+            raw = self._loader() or []
+        except Exception:
+            raw = []
+        if raw:
+            self._build(raw)
+            self._loaded_at = time.time()
+        else:
+            # Solo i tentativi falliti sospendono i download per RETRY_AFTER secondi
+            self._attempted_at = time.time()
+
+    def _refresh_in_background(self):
+        try:
+            self._load()
+        finally:
+            self._refreshing = False
+
+    def ensure_loaded(self):
+        """
+        Carica il catalogo al primo uso; se scaduto avvia un refresh in background.
+        Le chiamate concorrenti al primo caricamento attendono quello in corso invece
+        di proseguire con un catalogo vuoto.
+        """
+        now = time.time()
+        if self._airports and now - self._loaded_at < self.ttl:
+            return
+        if now - self._attempted_at < RETRY_AFTER:
+            return  # download fallito di recente: niente upstream
+        with self._lock:
+            if self._airports:
+                if time.time() - self._loaded_at >= self.ttl and not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh_in_background, name="airport-catalog-refresh", daemon=True).start()
+            elif time.time() - self._attempted_at >= RETRY_AFTER:
+                self._load()
+
+    def warm_up(self):
+        """Avvia il caricamento (o il refresh) in un thread senza attenderlo; no-op se già in corso."""
+        if self._airports and time.time() - self._loaded_at < self.ttl:
+            return
+        if self._lock.locked():
+            return
+        threading.Thread(target=self.ensure_loaded, name="airport-catalog-warmup", daemon=True).start()
+
+    @property
+    def loaded_at(self) -> float:
+        return self._loaded_at
+
+    @property
+    def load_failed(self) -> bool:
+        """True se il catalogo non è mai stato caricato e l'ultimo download è fallito."""
+        return not self._airports and self._attempted_at > 0
+
+    def current(self) -> list[dict]:
+        """Aeroporti già caricati (formato API Ryanair) senza avviare download: vuota se non disponibili."""
+        return self._raw
+
+    def raw(self) -> list[dict]:
+        """Lista aeroporti nel formato originale dell'API Ryanair."""
+        self.ensure_loaded()
+        return self._raw
+
+    def airports(self) -> list[dict]:
+        """Aeroporti formattati {code, name, city, country}."""
+        self.ensure_loaded()
+        return self._airports
+
+    def city_lookup(self) -> dict[str, str]:
+        """IATA → nome città, usato da RyanairProvider per valorizzare i FlightLeg."""
+        self.ensure_loaded()
+        return self._city_lookup
+
+    def popular(self, limit: int = 30) -> list[dict]:
+        """Primi `limit` aeroporti in ordine alfabetico (dropdown senza query)."""
+        self.ensure_loaded()
+        return [dict(a) for a in self._by_name[:limit]]
+
+    def search(self, query: str, limit: int = None) -> list[dict]:
+        """Aeroporti il cui nome, città, codice o paese contiene `query`, ordinati per rilevanza."""
+        self.ensure_loaded()
+        q = query.strip().lower()
+        if not q:
+            return []
+        airports, search_text, grams = self._airports, self._search_text, self._grams
+        if len(q) <= 3:
+            candidates = grams.get(q, set())
+        else:
+            postings = sorted((grams.get(g, set()) for g in _ngrams(q, 3)), key=len)
+            candidates = set.intersection(*postings) if postings else set()
+            candidates = {idx for idx in candidates if q in search_text[idx]}
+
+        def rank(idx: int) -> tuple:
+            a = airports[idx]
+            code, city, name = a["code"].lower(), a["city"].lower(), a["name"].lower()
+            if code == q:
+                score = 0
+            elif city.startswith(q):
+                score = 1
+            elif name.startswith(q):
+                score = 2
+            elif any(word.startswith(q) for word in f"{city} {name}".split()):
+                score = 3
+            elif code.startswith(q):
+                score = 4
+            else:
+                score = 5
+            return (score, a["name"])
+
+        ranked = sorted(candidates, key=rank)
+        if limit is not None:
+            ranked = ranked[:limit]
+        # Copie: read_airports aggiunge chiavi (es. parent_group) ai risultati
+        return [dict(airports[idx]) for idx in ranked]
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_airport_catalog() -> AirportCatalog:
+    """Catalogo condiviso di processo (Ryanair), usato da API, status e provider."""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                from api.providers.ryanair import get_airports
+                _catalog = AirportCatalog(get_airports)
+    return _catalog
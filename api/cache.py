@@ -0,0 +1,143 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from api.metrics import record_cache_lookup
+
+# TTL predefiniti (secondi): le rotte cambiano raramente, le tariffe molto più spesso
+ROUTES_TTL = int(os.getenv("FLIGHT_CACHE_ROUTES_TTL", 24 * 3600))
+FARES_TTL = int(os.getenv("FLIGHT_CACHE_FARES_TTL", 30 * 60))
+
+class SQLiteCache:
+    """
+    Cache persistente chiave/valore su file SQLite, condivisa tra richieste e worker uvicorn.
+
+    - Modalità WAL: letture concorrenti da più processi mentre un worker scrive.
+    - TTL per voce: ogni valore ha una scadenza assoluta, le voci scadute sono ignorate
+      in lettura e rimosse al flush.
+    - Write-behind: set() accoda in memoria e un thread in background scrive a blocchi,
+      così le chiamate dei provider non aspettano il disco.
+    - Contatori hit/miss per namespace, per tarare i TTL.
+
+    I valori devono essere serializzabili in JSON.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending: dict[tuple, tuple] = {}
+        self._stats: dict[str, dict[str, int]] = {}
+        self._flush_event = threading.Event()
+        self._closed = False
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires_at)")
+        conn.commit()
+
+        self._writer = threading.Thread(target=self._write_loop, name="sqlite-cache-writer", daemon=True)
+        self._writer.start()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 non condivide le connessioni tra thread: una per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, namespace: str, outcome: str):
+        with self._lock:
+            counters = self._stats.setdefault(namespace, {"hits": 0, "misses": 0})
+            counters[outcome] += 1
+        record_cache_lookup(f"persistent_{namespace}", outcome == "hits")
+
+    def get(self, namespace: str, key: str):
+        """Restituisce il valore se presente e non scaduto, altrimenti None."""
+        now = time.time()
+        with self._lock:
+            pending = self._pending.get((namespace, key))
+        if pending is not None:
+            value, expires_at = pending
+            if expires_at > now:
+                self._count(namespace, "hits")
+                return value
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (namespace, key),
+        ).fetchone()
+        if row is None or row[1] <= now:
+            self._count(namespace, "misses")
+            return None
+        self._count(namespace, "hits")
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value, ttl: float):
+        """Accoda la scrittura; il thread di background la rende persistente."""
+        with self._lock:
+            self._pending[(namespace, key)] = (value, time.time() + ttl)
+        self._flush_event.set()
+
+    def flush(self):
+        """Scrive su disco le voci in coda e rimuove quelle scadute."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        conn = self._connection()
+        if pending:
+            conn.executemany(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                [(ns, key, json.dumps(value), expires_at) for (ns, key), (value, expires_at) in pending.items()],
+            )
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        conn.commit()
+
+    def _write_loop(self):
+        while not self._closed:
+            self._flush_event.wait()
+            self._flush_event.clear()
+            time.sleep(self.flush_interval)  # raggruppa le scritture ravvicinate
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"[SQLiteCache] Errore scrittura cache {self.path}: {e}")
+
+    def close(self):
+        self._closed = True
+        self._flush_event.set()
+        self.flush()
+
+    def stats(self) -> dict:
+        """Contatori hit/miss per namespace, es. {"routes": {"hits": 10, "misses": 2}}."""
+        with self._lock:
+            return {ns: dict(counters) for ns, counters in self._stats.items()}
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_shared_cache() -> SQLiteCache | None:
+    """
+    Cache persistente di processo, abilitata impostando FLIGHT_CACHE_PATH
+    (es. /tmp/flight_cache.sqlite su Vercel). Senza variabile restituisce None.
+    """
+    global _shared_cache
+    path = os.getenv("FLIGHT_CACHE_PATH")
+    if not path:
+        return None
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                _shared_cache = SQLiteCache(path)
+    return _shared_cache
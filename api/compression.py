@@ -0,0 +1,57 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli è opzionale: senza, lo stream è compresso in gzip
+    brotli = None
+
+def negotiate_encoding(accept_encoding: str | None) -> str | None:
+    """Codifica da usare per la risposta in base ad Accept-Encoding: "br", "gzip" o None."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        q = params.strip().lower()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+class StreamCompressor:
+    """
+    Compressore incrementale per stream NDJSON: ogni chunk viene compresso e
+    scaricato subito (sync flush), così gli eventi di progresso arrivano al client
+    senza attendere la fine della risposta, mantenendo il dizionario tra i chunk.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor()
+        elif encoding == "gzip":
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            raise ValueError(f"Codifica non supportata: {encoding}")
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+async def compress_stream(chunks, encoding: str):
+    """Comprime un async iterator di chunk (str o bytes) chunk per chunk."""
+    compressor = StreamCompressor(encoding)
+    async for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        if chunk:
+            yield compressor.compress(chunk)
+    yield compressor.finish()
@@ -0,0 +1,158 @@
+import csv
+import io
+import tempfile
+from openpyxl import Workbook
+from api.models import Connection
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow è opzionale: senza, l'export Parquet non è disponibile
+    pa = None
+    pq = None
+
+# Colonne del file esportato, nell'ordine del foglio Excel storico
+EXPORT_COLUMNS = (
+    "Connection",
+    "First Leg Departure", "First Leg Arrival", "First Leg Carrier", "First Leg Flight Number",
+    "Second Leg Departure", "Second Leg Arrival", "Second Leg Carrier", "Second Leg Flight Number",
+    "Third Leg Departure", "Third Leg Arrival", "Third Leg Carrier", "Third Leg Flight Number",
+    "Layover (h)", "Total Duration (h)", "Total Price (€)",
+)
+_NUMERIC_COLUMNS = frozenset({"Layover (h)", "Total Duration (h)", "Total Price (€)"})
+
+SHEET_NAME = "Connessioni Voli"
+CHUNK_SIZE = 64 * 1024
+BATCH_ROWS = 2000
+
+# formato → (media type, estensione del file)
+EXPORT_FORMATS = {
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+def parquet_available() -> bool:
+    return pq is not None
+
+def export_row(record: dict) -> tuple:
+    """Riga di export da un record nel formato di Connection.to_dict(): "-" e 0 per i campi assenti."""
+    return (
+        record.get("Connection"),
+        record.get("First Leg Departure") or "-",
+        record.get("First Leg Arrival") or "-",
+        record.get("First Leg Carrier") or "-",
+        record.get("First Leg Flight Number") or "-",
+        record.get("Second Leg Departure") or "-",
+        record.get("Second Leg Arrival") or "-",
+        record.get("Second Leg Carrier") or "-",
+        record.get("Second Leg Flight Number") or "-",
+        record.get("Third Leg Departure") or "-",
+        record.get("Third Leg Arrival") or "-",
+        record.get("Third Leg Carrier") or "-",
+        record.get("Third Leg Flight Number") or "-",
+        record.get("Layover (h)") or 0,
+        record.get("Total Duration (h)") or 0,
+        record.get("Total Price (€)"),
+    )
+
+def _leg_cells(leg) -> tuple:
+    if leg is None:
+        return ("-", "-", "-", "-")
+    return (leg.departure_str, leg.arrival_str, leg.carrier, leg.flight_number)
+
+def connection_row(conn: Connection) -> tuple:
+    """Riga di export direttamente da una Connection, senza passare dal dict del frontend."""
+    third = conn.extra_legs[0] if conn.extra_legs else None
+    return (
+        conn.connection_label,
+        *_leg_cells(conn.first_leg), *_leg_cells(conn.second_leg), *_leg_cells(third),
+        conn.layover_h, conn.total_duration_h, conn.total_price,
+    )
+
+def filter_connections(connections: list[Connection], carriers: set[str] = None, max_price: float = None,
+                       max_duration_h: float = None, max_stops: int = None):
+    """
+    Filtri dell'export lato server. `carriers` ha la semantica del filtro compagnie del
+    frontend: una connessione resta solo se tutte le sue tratte sono di carrier ammessi.
+    """
+    for conn in connections:
+        if max_price is not None and conn.total_price > max_price:
+            continue
+        if max_duration_h is not None and conn.total_duration_h > max_duration_h:
+            continue
+        legs = conn.legs
+        if max_stops is not None and len(legs) - 1 > max_stops:
+            continue
+        if carriers is not None and any(leg.carrier not in carriers for leg in legs):
+            continue
+        yield conn
+
+def _batches(rows, size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _iter_file(file, chunk_size: int = CHUNK_SIZE):
+    file.seek(0)
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def iter_xlsx(rows):
+    """
+    XLSX con il workbook write-only di openpyxl: le righe sono scritte una alla volta
+    su file temporaneo (memoria costante) e il file compresso è inviato a chunk.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(SHEET_NAME)
+    sheet.append(EXPORT_COLUMNS)
+    for row in rows:
+        sheet.append(row)
+    with tempfile.TemporaryFile() as file:
+        workbook.save(file)
+        yield from _iter_file(file)
+
+def iter_csv(rows):
+    """CSV inviato a blocchi di righe man mano che vengono prodotte."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in _batches(rows, BATCH_ROWS):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def iter_parquet(rows):
+    """Parquet scritto a row group di BATCH_ROWS righe su file temporaneo, poi inviato a chunk."""
+    if pq is None:
+        raise RuntimeError("Export Parquet non disponibile: installare pyarrow")
+    schema = pa.schema([
+        (name, pa.float64() if name in _NUMERIC_COLUMNS else pa.string())
+        for name in EXPORT_COLUMNS
+    ])
+    with tempfile.TemporaryFile() as file:
+        with pq.ParquetWriter(file, schema) as writer:
+            for batch in _batches(rows, BATCH_ROWS):
+                columns = list(zip(*batch))
+                writer.write_batch(pa.record_batch(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema,
+                ))
+        yield from _iter_file(file)
+
+_WRITERS = {"xlsx": iter_xlsx, "csv": iter_csv, "parquet": iter_parquet}
+
+def stream_export(rows, fmt: str = "xlsx"):
+    """Iteratore di bytes del file esportato nel formato richiesto (xlsx, csv, parquet)."""
+    return _WRITERS[fmt](rows)
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import time
+from api.airport_catalog import get_airport_catalog
+from api.http_client import get_async_http_client
+from api.singleflight import SingleFlight
+
+# Età massima dello stato servito senza ricontrollare gli upstream, e deadline di ogni probe
+STATUS_TTL = float(os.getenv("STATUS_CACHE_TTL", 30))
+PROBE_TIMEOUT = float(os.getenv("STATUS_PROBE_TIMEOUT", 3))
+# Con 0 lo stato scaduto viene ricalcolato nella richiesta (es. ambienti serverless senza task in background)
+BACKGROUND_REFRESH = os.getenv("STATUS_BACKGROUND_REFRESH", "1") != "0"
+
+# Hub interrogato per misurare la latenza reale dell'upstream Ryanair (risposta piccola)
+RYANAIR_PROBE_AIRPORT = "DUB"
+
+async def probe_ryanair() -> dict:
+    """
+    Rotte di un hub per la latenza dell'upstream; il numero di aeroporti dallo stato
+    corrente del catalogo di processo. Il download del catalogo non rientra nella
+    deadline del probe: se manca viene avviato in background.
+    """
+    response = await get_async_http_client("ryanair").get(
+        f"https://www.ryanair.com/api/views/locate/searchWidget/routes/en/airport/{RYANAIR_PROBE_AIRPORT}"
+    )
+    if response.status_code != 200:
+        return {"status": "error", "message": f"Errore API Ryanair (Stato {response.status_code})"}
+    catalog = get_airport_catalog()
+    airports = catalog.current()
+    if not airports:
+        catalog.warm_up()
+        if catalog.load_failed:
+            return {"status": "error", "message": "Nessun dato restituito dall'API Ryanair"}
+        return {"status": "active", "message": "Connesso con successo (catalogo aeroporti in caricamento)"}
+    return {"status": "active", "message": f"Connesso con successo ({len(airports)} aeroporti attivi)"}
+
+def _duffel_mode(token: str) -> str:
+    if token.startswith("duffel_live_"):
+        return "live"
+    if token.startswith("duffel_test_"):
+        return "sandbox"
+    return "custom"
+
+def duffel_details() -> dict:
+    """Modalità del token Duffel: non dipende dall'upstream, resta nota anche se il probe fallisce."""
+    token = os.getenv("DUFFEL_ACCESS_TOKEN")
+    return {"mode": _duffel_mode(token) if token else "none"}
+
+async def probe_duffel() -> dict:
+    token = os.getenv("DUFFEL_ACCESS_TOKEN")
+    if not token:
+        return {"status": "inactive", "message": "Nessun token Duffel configurato nel file .env", "mode": "none"}
+    result = duffel_details()
+    response = await get_async_http_client("duffel").get(
+        "https://api.duffel.com/air/airlines",
+        params={"limit": 1},
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Duffel-Version": "v2",
+            "Accept": "application/json"
+        },
+    )
+    if response.status_code == 200:
+        result.update(status="active", message="Token valido e connessione a Duffel attiva")
+    elif response.status_code == 401:
+        result.update(status="error", message="Token non valido o scaduto (401 Unauthorized)")
+    elif response.status_code == 403:
+        result.update(status="error", message="Permessi insufficienti (403 Forbidden). Verifica che sia Read-Write")
+    else:
+        result.update(status="error", message=f"Errore API Duffel (Stato {response.status_code})")
+    return result
+
+class HealthMonitor:
+    """
+    Stato degli upstream per /api/status.
+
+    I probe girano in parallelo, ciascuno con una deadline di `timeout` secondi; l'ultimo
+    esito resta valido per `ttl` secondi. Scaduto, viene servito comunque mentre un
+    refresh in background lo aggiorna, così le richieste di stato non attendono gli
+    upstream (solo la prima, senza esiti, attende al massimo la deadline). Ogni esito
+    riporta la latenza del probe (`latency_ms`) e l'istante del controllo (`checked_at`).
+
+    `details` associa a un probe una funzione sincrona con i campi descrittivi che non
+    richiedono l'upstream (es. la modalità Duffel): inclusi anche negli esiti di timeout o errore.
+    """
+
+    def __init__(self, probes: dict, ttl: float = STATUS_TTL, timeout: float = PROBE_TIMEOUT,
+                 background: bool = BACKGROUND_REFRESH, details: dict = None):
+        self.probes = probes
+        self.details = details or {}
+        self.ttl = ttl
+        self.timeout = timeout
+        self.background = background
+        self._results: dict[str, dict] = {}
+        self._checked_at = 0.0
+        self._refresh_calls = SingleFlight()
+        self._tasks: set = set()
+
+    async def _run_probe(self, name: str) -> dict:
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self.probes[name](), self.timeout)
+        except asyncio.TimeoutError:
+            result = {"status": "error", "message": f"Nessuna risposta entro {self.timeout:g}s"}
+        except Exception as e:
+            result = {"status": "error", "message": f"Errore di connessione: {str(e)}"}
+        if name in self.details:
+            result = {**self.details[name](), **result}
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        result["checked_at"] = time.time()
+        return result
+
+    async def _probe_all(self) -> dict:
+        names = list(self.probes)
+        results = await asyncio.gather(*(self._run_probe(name) for name in names))
+        self._results = dict(zip(names, results))
+        self._checked_at = time.monotonic()
+        return self._results
+
+    async def refresh(self) -> dict:
+        """Esegue tutti i probe; le richieste concorrenti condividono lo stesso giro."""
+        return await self._refresh_calls.ado("status", self._probe_all)
+
+    async def status(self) -> dict:
+        if not self._results:
+            return await self.refresh()
+        if time.monotonic() - self._checked_at >= self.ttl:
+            if not self.background:
+                return await self.refresh()
+            if not self._tasks:
+                task = asyncio.create_task(self.refresh())
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        return self._results
+
+_monitor = None
+
+def get_health_monitor() -> HealthMonitor:
+    """Monitor di processo con i probe Ryanair e Duffel."""
+    global _monitor
+    if _monitor is None:
+        _monitor = HealthMonitor({"ryanair": probe_ryanair, "duffel": probe_duffel},
+                                 details={"duffel": duffel_details})
+    return _monitor
@@ -0,0 +1,164 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from api.metrics import record_upstream_request
+from api.tracing import span
+
+DEFAULT_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 15))
+DEFAULT_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 16))
+DEFAULT_RETRIES = int(os.getenv("HTTP_RETRIES", 2))
+# Il client asincrono non occupa un thread per richiesta: pool più ampio
+DEFAULT_ASYNC_POOL_MAXSIZE = int(os.getenv("HTTP_ASYNC_POOL_MAXSIZE", 64))
+
+class HttpClient:
+    """
+    Client HTTP con sessione requests condivisa: connessioni keep-alive riutilizzate
+    (niente handshake TCP+TLS per ogni chiamata), pool limitato per host, timeout di
+    default e retry automatici su errori di connessione e 502/503/504.
+
+    I retry si applicano solo ai metodi idempotenti (GET/HEAD): le POST a Duffel
+    mantengono la propria gestione dei 429 nel provider.
+
+    Ogni richiesta è registrata nelle metriche dell'upstream `name` (stato e latenza).
+    """
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT, pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                 retries: int = DEFAULT_RETRIES, verify: bool = True, headers: dict = None, name: str = "default"):
+        self.name = name
+        self.timeout = timeout
+        # Configurazione condivisa con i client asincroni derivati (async_client)
+        self._options = dict(timeout=timeout, retries=retries, verify=verify, headers=headers, name=name)
+        self._async_clients = weakref.WeakKeyDictionary()
+        self.session = requests.Session()
+        self.session.verify = verify
+        if headers:
+            self.session.headers.update(headers)
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            raise_on_status=False,
+        )
+        # pool_block: oltre pool_maxsize connessioni verso lo stesso host le richieste attendono
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _request(self, method: str, send, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        started = time.perf_counter()
+        status = "error"
+        with span(f"http.{self.name}", method=method, path=urlsplit(url).path) as current:
+            try:
+                response = send(url, **kwargs)
+                status = response.status_code
+                return response
+            finally:
+                record_upstream_request(self.name, status, time.perf_counter() - started)
+                if current is not None:
+                    current.attrs["status"] = status
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self._request("GET", self.session.get, url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self._request("POST", self.session.post, url, **kwargs)
+
+    def async_client(self) -> "AsyncHttpClient":
+        """
+        Client asincrono con la stessa configurazione (timeout, retry, verify, header),
+        per i metodi aget_* dei provider: uno per event loop. Per i client condivisi di
+        processo è quello di get_async_http_client, così il pool resta unico per upstream.
+        """
+        if _clients.get(self.name) is self:
+            return get_async_http_client(self.name)
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = AsyncHttpClient(**self._options)
+        return client
+
+    def close(self):
+        self.session.close()
+
+_clients: dict[str, HttpClient] = {}
+_clients_lock = threading.Lock()
+
+# Configurazione per upstream: Ryanair usa verify=False come in origine
+_CLIENT_OPTIONS = {
+    "ryanair": {"verify": False},
+    "duffel": {},
+}
+
+def get_http_client(name: str) -> HttpClient:
+    """Client condiviso di processo per upstream (`ryanair`, `duffel`, ...)."""
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = HttpClient(name=name, **_CLIENT_OPTIONS.get(name, {}))
+    return client
+
+class AsyncHttpClient:
+    """
+    Variante asincrona di HttpClient su httpx.AsyncClient: stesso pool keep-alive
+    limitato, timeout di default e retry sugli errori di connessione. Un solo event
+    loop può servire migliaia di richieste concorrenti senza un thread per chiamata.
+    """
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT, pool_maxsize: int = DEFAULT_ASYNC_POOL_MAXSIZE,
+                 retries: int = DEFAULT_RETRIES, verify: bool = True, headers: dict = None, name: str = "default"):
+        self.name = name
+        limits = httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize)
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            headers=headers,
+            transport=httpx.AsyncHTTPTransport(verify=verify, limits=limits, retries=retries),
+        )
+
+    async def _request(self, method: str, send, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        status = "error"
+        with span(f"http.{self.name}", method=method, path=urlsplit(url).path) as current:
+            try:
+                response = await send(url, **kwargs)
+                status = response.status_code
+                return response
+            finally:
+                record_upstream_request(self.name, status, time.perf_counter() - started)
+                if current is not None:
+                    current.attrs["status"] = status
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self._request("GET", self.client.get, url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self._request("POST", self.client.post, url, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+def get_async_http_client(name: str) -> AsyncHttpClient:
+    """
+    Client asincrono condiviso per upstream. Le connessioni httpx appartengono all'event
+    loop che le ha aperte, quindi c'è un client per (upstream, loop corrente).
+    """
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(name)
+    if client is None:
+        client = clients[name] = AsyncHttpClient(name=name, **_CLIENT_OPTIONS.get(name, {}))
+    return client
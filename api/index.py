@@ -1,11 +1,12 @@
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional
+import asyncio
+import json
 import os
-import pandas as pd
 
 # Caricamento variabili d'ambiente per sviluppo locale
 from dotenv import load_dotenv
@@ -13,16 +14,34 @@ load_dotenv()
 
 # Import robusti per supportare sia l'esecuzione locale che Vercel Serverless
 try:
-    from api.providers.ryanair import RyanairProvider, get_airports
+    from api.providers.ryanair import RyanairProvider
+    from api.airport_catalog import get_airport_catalog
     from api.providers.duffel import DuffelProvider
-    from api.router import find_connections
-    from api.utils import save_to_excel_in_memory
+    from api.router import RoutingSession
+    from api.ndjson import encode_results, DeltaEncoder, COMPACT_MEDIA_TYPE
+    from api.compression import negotiate_encoding, compress_stream
+    from api.cache import get_shared_cache
+    from api.search_cache import get_search_cache, search_key, search_id, STALE
+    from api.http_client import get_http_client
+    from api.health import get_health_monitor
+    from api import metrics
+    from api.tracing import Trace, span, detach_trace, TRACE_LOG_PATH
+    from api.export import stream_export, export_row, connection_row, filter_connections, parquet_available, EXPORT_FORMATS
     from api.city_groups import CITY_GROUPS, METRO_GROUPS, AIRPORT_TO_METRO
 except ImportError:
-    from providers.ryanair import RyanairProvider, get_airports
+    from providers.ryanair import RyanairProvider
+    from airport_catalog import get_airport_catalog
     from providers.duffel import DuffelProvider
-    from router import find_connections
-    from utils import save_to_excel_in_memory
+    from router import RoutingSession
+    from ndjson import encode_results, DeltaEncoder, COMPACT_MEDIA_TYPE
+    from compression import negotiate_encoding, compress_stream
+    from cache import get_shared_cache
+    from search_cache import get_search_cache, search_key, search_id, STALE
+    from http_client import get_http_client
+    from health import get_health_monitor
+    import metrics
+    from tracing import Trace, span, detach_trace, TRACE_LOG_PATH
+    from export import stream_export, export_row, connection_row, filter_connections, parquet_available, EXPORT_FORMATS
     from city_groups import CITY_GROUPS, METRO_GROUPS, AIRPORT_TO_METRO
 
 app = FastAPI(title="Flight Connection API", description="API per la ricerca di voli e connessioni Ryanair e Duffel")
@@ -38,102 +57,35 @@ app.add_middleware(
 
 # ----------------- ENDPOINTS API -----------------
 
-import requests as http_requests
-
 @app.get("/api/status")
-def get_status():
-    status_ryanair = {"status": "unknown", "message": ""}
-    status_duffel = {"status": "unknown", "message": "", "mode": "none"}
-    
-    # 1. Check Ryanair
-    try:
-        airports = get_airports()
-        if airports:
-            status_ryanair["status"] = "active"
-            status_ryanair["message"] = f"Connesso con successo ({len(airports)} aeroporti attivi)"
-        else:
-            status_ryanair["status"] = "error"
-            status_ryanair["message"] = "Nessun dato restituito dall'API Ryanair"
-    except Exception as e:
-        status_ryanair["status"] = "error"
-        status_ryanair["message"] = f"Errore di connessione: {str(e)}"
-
-    # 2. Check Duffel
-    duffel_token = os.getenv("DUFFEL_ACCESS_TOKEN")
-    if not duffel_token:
-        status_duffel["status"] = "inactive"
-        status_duffel["message"] = "Nessun token Duffel configurato nel file .env"
-    else:
-        if duffel_token.startswith("duffel_live_"):
-            status_duffel["mode"] = "live"
-        elif duffel_token.startswith("duffel_test_"):
-            status_duffel["mode"] = "sandbox"
-        else:
-            status_duffel["mode"] = "custom"
-            
-        try:
-            url = "https://api.duffel.com/air/airlines"
-            headers = {
-                "Authorization": f"Bearer {duffel_token}",
-                "Duffel-Version": "v2",
-                "Accept": "application/json"
-            }
-            res = http_requests.get(url, params={"limit": 1}, headers=headers)
-            
-            if res.status_code == 200:
-                status_duffel["status"] = "active"
-                status_duffel["message"] = "Token valido e connessione a Duffel attiva"
-            elif res.status_code == 401:
-                status_duffel["status"] = "error"
-                status_duffel["message"] = "Token non valido o scaduto (401 Unauthorized)"
-            elif res.status_code == 403:
-                status_duffel["status"] = "error"
-                status_duffel["message"] = "Permessi insufficienti (403 Forbidden). Verifica che sia Read-Write"
-            else:
-                status_duffel["status"] = "error"
-                status_duffel["message"] = f"Errore API Duffel (Stato {res.status_code})"
-        except Exception as e:
-            status_duffel["status"] = "error"
-            status_duffel["message"] = f"Errore di connettività: {str(e)}"
-            
+async def get_status():
+    """Stato di Ryanair e Duffel con latenza dei probe; servito dal monitor senza attendere gli upstream."""
+    status = await get_health_monitor().status()
     return {
-        "ryanair": status_ryanair,
-        "duffel": status_duffel
+        "ryanair": status["ryanair"],
+        "duffel": status["duffel"]
     }
 
+@app.get("/api/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Metriche di processo in formato Prometheus: upstream, cache e router."""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/api/airports")
 def read_airports(q: Optional[str] = Query(None, description="Query di ricerca aeroporto/città/codice IATA")):
     """Recupera aeroporti con ricerca dinamica. Senza query restituisce i 30 più popolari da Ryanair.
     Con query filtra Ryanair localmente e interroga Duffel Places API per risultati globali."""
 
-    # --- 1. Carica e formatta gli aeroporti Ryanair ---
-    ryanair_raw = get_airports()
-    ryanair_all = []
-    for a in (ryanair_raw or []):
-        if "iataCode" in a and "name" in a:
-            ryanair_all.append({
-                "code": a["iataCode"],
-                "name": a["name"],
-                "city": a.get("city", {}).get("name", a["name"]),
-                "country": a.get("country", {}).get("name", "")
-            })
+    catalog = get_airport_catalog()
 
-    # --- 2. Nessuna query: restituisce i primi 30 aeroporti Ryanair ("popolari") ---
+    # --- 1. Nessuna query: restituisce i primi 30 aeroporti Ryanair ("popolari") ---
     if not q or not q.strip():
-        ryanair_all.sort(key=lambda x: x["name"])
-        return ryanair_all[:30]
-
-    # --- 3. Con query: filtra Ryanair localmente ---
-    query_lower = q.strip().lower()
-    ryanair_filtered = [
-        a for a in ryanair_all
-        if query_lower in a["name"].lower()
-        or query_lower in a["city"].lower()
-        or query_lower in a["code"].lower()
-        or query_lower in a["country"].lower()
-    ]
-
-    # --- 4. Interroga Duffel Places API ---
+        return catalog.popular(30)
+
+    # --- 2. Con query: ricerca sull'indice del catalogo (ordinata per rilevanza) ---
+    ryanair_filtered = catalog.search(q)
+
+    # --- 3. Interroga Duffel Places API ---
     duffel_results = []
     duffel_token = os.getenv("DUFFEL_ACCESS_TOKEN")
     if duffel_token:
@@ -144,7 +96,7 @@ def read_airports(q: Optional[str] = Query(None, description="Query di ricerca a
                 "Duffel-Version": "v2",
                 "Accept": "application/json"
             }
-            res = http_requests.get(url, params={"query": q.strip()}, headers=headers, timeout=5)
+            res = get_http_client("duffel").get(url, params={"query": q.strip()}, headers=headers, timeout=5)
             if res.status_code == 200:
                 data = res.json().get("data", [])
                 for place in data:
@@ -160,7 +112,7 @@ def read_airports(q: Optional[str] = Query(None, description="Query di ricerca a
         except Exception:
             pass  # Fallback silenzioso: usiamo solo i risultati Ryanair
 
-    # --- 5. Unione con deduplicazione per codice IATA ---
+    # --- 4. Unione con deduplicazione per codice IATA ---
     seen_codes = set()
     flat = []
     for a in ryanair_filtered:
@@ -172,7 +124,7 @@ def read_airports(q: Optional[str] = Query(None, description="Query di ricerca a
             seen_codes.add(a["code"])
             flat.append(a)
 
-    # --- 6. Raggruppa aeroporti dello stesso metro in sottoalbero ---
+    # --- 5. Raggruppa aeroporti dello stesso metro in sottoalbero ---
     result = []
     added_codes = set()
     added_metros = set()
@@ -237,108 +189,240 @@ def _generate_daily_dates(start_date: str, end_date: str) -> list[str]:
         curr += timedelta(days=1)
     return dates
 
-@app.get("/api/search")
-def search_flights(
-    start: str = Query(..., description="Codice IATA aeroporto di partenza"),
-    end: str = Query(..., description="Codice IATA aeroporto di arrivo"),
-    start_date: str = Query(..., description="Data di partenza iniziale (YYYY-MM-DD)"),
-    end_date: str = Query(..., description="Data di partenza finale (YYYY-MM-DD)"),
-    max_layover_days: int = Query(3, ge=1, le=5, description="Tempo massimo di scalo in giorni")
-):
-    """Cerca le migliori rotte dirette e con 1 scalo per il range di date specificato (Ryanair + Duffel) con aggiornamenti di progresso in tempo reale."""
-    import json
-    import queue
-    import threading
+async def _search_stream(start: str, end: str, start_date: str, end_date: str, max_layover_days: int,
+                         max_stops: int, limit: Optional[int], pareto: bool, cache_key: str, protocol: int = 1,
+                         compact: bool = False):
+    """Pipeline completa Ryanair + Duffel: eventi NDJSON di progresso e risultati, salvati poi nel cache risultati."""
+    # Protocollo v2: eventi delta con i soli cambiamenti invece di partial_results/results completi
+    delta = DeltaEncoder(compact) if protocol == 2 else None
+    try:
+        print(f"\n[Search Stream] Richiesta ricevuta: {start} -> {end} dal {start_date} al {end_date} (Max scalo: {max_layover_days}gg)")
+        
+        yield json.dumps({"type": "progress", "percent": 5, "message": "Inizializzazione ricerca..."}) + "\n"
+        yield json.dumps({"type": "progress", "percent": 10, "message": "Ricerca connessioni Ryanair e Duffel in corso..."}) + "\n"
+
+        # Le due fasi partono insieme e scrivono eventi su un'unica coda: progresso e risultati
+        # parziali arrivano nello stream man mano che ciascun provider produce dati
+        events = asyncio.Queue()
+        dates_ryanair = _generate_monthly_dates(start_date, end_date)
+        dates_duffel = _generate_daily_dates(start_date, end_date)
+        persistent_cache = get_shared_cache()
+        # Istanze uniche: i dati in cache servono alla chiamata combinata finale
+        ryanair_provider = RyanairProvider(cache=persistent_cache)
+        providers = [ryanair_provider]
+        # Fasi terminate con errore: i risultati sono parziali e non vanno nel cache risultati
+        failed_phases = []
+
+        # Sessione di routing unica: ogni provider aggiunge solo le connessioni nuove (anche cross-provider)
+        session = RoutingSession(
+            start, end, max_layover_days * 24,
+            filter_start=start_date, filter_end=end_date,
+            max_stops=max_stops, limit=limit, pareto=pareto
+        )
+
+        # 1. Ricerca Ryanair — i risultati vengono inviati subito come partial_results
+        async def run_ryanair():
+            try:
+                with span("phase.ryanair"):
+                    added = await session.add_provider(ryanair_provider, dates_ryanair)
+                print(f"[Search Stream] Ryanair ha completato con {len(added)} combinazioni.")
+                events.put_nowait({"type": "progress", "percent": 20, "message": f"Ryanair completato. Trovate {len(added)} rotte."})
+                if added:
+                    with span("serialize", event="partial_results"):
+                        if delta is not None:
+                            events.put_nowait(delta.encode(session.results()))
+                        else:
+                            events.put_nowait(encode_results("partial_results", session.results(), compact))
+            finally:
+                events.put_nowait(None)
+
+        # 2. Ricerca Duffel — il progresso arriva tramite la stessa coda
+        def duffel_progress_callback(percent, message):
+            events.put_nowait({"type": "progress", "percent": percent, "message": message})
+
+        async def run_duffel():
+            try:
+                provider = DuffelProvider(start, end, dates_duffel, progress_callback=duffel_progress_callback)
+                providers.append(provider)
+                with span("phase.duffel"):
+                    added = await session.add_provider(provider, dates_duffel)
+                print(f"[Search Stream] Duffel ha aggiunto {len(added)} combinazioni (incluse cross-provider).")
+                events.put_nowait({"type": "progress", "percent": 95, "message": f"Duffel completato. Aggiunte {len(added)} rotte."})
+                if added:
+                    with span("serialize", event="partial_results"):
+                        if delta is not None:
+                            events.put_nowait(delta.encode(session.results()))
+                        else:
+                            events.put_nowait(encode_results("partial_results", session.results(), compact))
+            except Exception as ex:
+                print(f"[Search Stream] Errore Duffel: {ex}")
+                failed_phases.append("duffel")
+                events.put_nowait({"type": "error", "message": str(ex)})
+            finally:
+                events.put_nowait(None)
+
+        ryanair_task = asyncio.create_task(run_ryanair())
+        duffel_task = asyncio.create_task(run_duffel())
+        tasks = (ryanair_task, duffel_task)
 
-    def generate():
         try:
-            print(f"\n[Search Stream] Richiesta ricevuta: {start} -> {end} dal {start_date} al {end_date} (Max scalo: {max_layover_days}gg)")
-            
-            # 1. Ricerca Ryanair (istanza unica — dati cached per la chiamata combinata finale)
-            yield json.dumps({"type": "progress", "percent": 5, "message": "Inizializzazione ricerca..."}) + "\n"
-            yield json.dumps({"type": "progress", "percent": 10, "message": "Ricerca connessioni Ryanair in corso..."}) + "\n"
-
-            dates_ryanair = _generate_monthly_dates(start_date, end_date)
-            ryanair_provider = RyanairProvider()
-            connections_ryanair = find_connections(
-                [(ryanair_provider, dates_ryanair)],
-                start, end, max_layover_days * 24,
-                filter_start=start_date, filter_end=end_date
-            )
-            print(f"[Search Stream] Ryanair ha completato con {len(connections_ryanair)} combinazioni.")
-            yield json.dumps({"type": "progress", "percent": 20, "message": f"Ryanair completato. Trovate {len(connections_ryanair)} rotte."}) + "\n"
-
-            # Invia subito i risultati Ryanair mentre Duffel parte
-            if connections_ryanair:
-                partial_records = [c.to_dict() for c in connections_ryanair]
-                yield json.dumps({"type": "partial_results", "data": partial_records}) + "\n"
-
-            # 2. Ricerca Duffel con coda sincronizzata — salva riferimento al provider per la chiamata combinata
-            q = queue.Queue()
-            dates_duffel = _generate_daily_dates(start_date, end_date)
-            duffel_provider_ref = []
-
-            def duffel_progress_callback(percent, message):
-                q.put({"type": "progress", "percent": percent, "message": message})
-
-            def run_duffel_thread():
-                try:
-                    provider = DuffelProvider(start, end, dates_duffel, progress_callback=duffel_progress_callback)
-                    # Esegue la ricerca Duffel-only per popolare il cache interno del provider
-                    find_connections(
-                        [(provider, dates_duffel)],
-                        start, end, max_layover_days * 24,
-                        filter_start=start_date, filter_end=end_date
-                    )
-                    duffel_provider_ref.append(provider)
-                except Exception as ex:
-                    print(f"[Search Stream] Errore Duffel thread: {ex}")
-                    q.put({"type": "error", "message": str(ex)})
-                finally:
-                    q.put(None)
-
-            t = threading.Thread(target=run_duffel_thread)
-            t.start()
-
-            while True:
-                item = q.get()
+            running = 2
+            last_percent = 10
+            while running:
+                item = await events.get()
                 if item is None:
-                    break
-                if item.get("type") == "error":
-                    yield json.dumps({"type": "progress", "percent": 90, "message": f"Duffel non disponibile: {item['message']}"}) + "\n"
+                    running -= 1
+                elif isinstance(item, bytes):
+                    if item:
+                        yield item
+                elif item.get("type") == "error":
+                    yield json.dumps({"type": "progress", "percent": max(last_percent, 90), "message": f"Duffel non disponibile: {item['message']}"}) + "\n"
                 else:
+                    # Le fasi avanzano in parallelo: la percentuale mostrata non torna mai indietro
+                    item["percent"] = last_percent = max(last_percent, item["percent"])
                     yield json.dumps(item) + "\n"
 
-            t.join()
+            # Un errore Ryanair interrompe la ricerca come in precedenza
+            await ryanair_task
+            await duffel_task
+        finally:
+            # Client disconnesso o stream chiuso: le fasi ancora in corso (e le richieste
+            # a pagamento di Duffel) non devono proseguire senza nessuno che le legga
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        # 3. Le connessioni cross-provider sono già state aggiunte in modo incrementale dalla sessione
+        combined_connections = session.results()
+
+        failed_phases += [type(p).__name__ for p in providers if getattr(p, "failed_requests", 0)]
+        if failed_phases:
+            # Risultati degradati: niente cache, la prossima ricerca riprova i provider falliti
+            print(f"[Search Stream] Risultati parziali ({', '.join(failed_phases)}): non salvati nel cache")
+        else:
+            # Serializzazione delle righe per il cache persistente fuori dall'event loop
+            with span("store_results"):
+                await asyncio.to_thread(get_search_cache().set, cache_key, combined_connections)
+        yield json.dumps({"type": "progress", "percent": 100, "message": "Fatto!"}) + "\n"
+        with span("serialize", event="results"):
+            if delta is not None:
+                final = delta.encode(combined_connections) + delta.complete()
+            else:
+                final = encode_results("results", combined_connections, compact)
+        yield final
+        if persistent_cache is not None:
+            print(f"[Search Stream] Cache persistente (hit/miss cumulativi): {persistent_cache.stats()}")
+        print(f"[Search Stream] Risultati totali inviati: {len(combined_connections)}\n")
+        
+    except Exception as e:
+        print(f"[Search Stream ERROR] Errore: {str(e)}")
+        yield json.dumps({"type": "error", "message": f"Errore ricerca: {str(e)}"}) + "\n"
 
-            # 3. Ricerca combinata cross-provider (entrambi i provider usano il proprio cache — nessuna nuova HTTP)
-            yield json.dumps({"type": "progress", "percent": 96, "message": "Ricerca connessioni cross-provider..."}) + "\n"
+# Task di refresh stale-while-revalidate in corso (riferimenti forti finché non terminano)
+_background_refreshes: set = set()
 
-            providers_for_combined = [(ryanair_provider, dates_ryanair)]
-            if duffel_provider_ref:
-                providers_for_combined.append((duffel_provider_ref[0], dates_duffel))
-                print(f"[Search Stream] Avvio ricerca combinata con {len(providers_for_combined)} provider.")
+async def _refresh_search(params: dict, cache_key: str):
+    # Il task eredita il contesto della richiesta: il refresh non fa parte del suo trace
+    detach_trace()
+    try:
+        async for _ in _search_stream(**params, cache_key=cache_key):
+            pass
+        print(f"[Search Cache] Refresh in background completato per {cache_key}")
+    finally:
+        get_search_cache().end_refresh(cache_key)
+
+@app.get("/api/search")
+async def search_flights(
+    request: Request,
+    start: str = Query(..., description="Codice IATA aeroporto di partenza"),
+    end: str = Query(..., description="Codice IATA aeroporto di arrivo"),
+    start_date: str = Query(..., description="Data di partenza iniziale (YYYY-MM-DD)"),
+    end_date: str = Query(..., description="Data di partenza finale (YYYY-MM-DD)"),
+    max_layover_days: int = Query(3, ge=1, le=5, description="Tempo massimo di scalo in giorni"),
+    max_stops: int = Query(1, ge=0, le=2, description="Numero massimo di scali (0 = solo diretti, 2 = anche itinerari con 2 scali)"),
+    limit: Optional[int] = Query(None, ge=1, le=10000, description="Numero massimo di connessioni restituite (le più economiche)"),
+    pareto: bool = Query(False, description="Restituisce solo le connessioni non dominate su prezzo, durata e scalo"),
+    protocol: int = Query(1, ge=1, le=2, description="Versione dello stream: 2 = eventi delta con id stabili e marker finale complete"),
+    response_format: str = Query("json", alias="format", pattern="^(json|compact)$", description="compact = colonne con dizionario di stringhe e orari in minuti epoch"),
+    trace: bool = Query(False, description="Aggiunge in coda un evento timing con l'albero degli span della ricerca")
+):
+    """Cerca le migliori rotte dirette e con scalo per il range di date specificato (Ryanair + Duffel) con aggiornamenti di progresso in tempo reale."""
+    params = dict(start=start, end=end, start_date=start_date, end_date=end_date, max_layover_days=max_layover_days,
+                  max_stops=max_stops, limit=limit, pareto=pareto)
+    cache_key = search_key(**params)
+    search_cache = get_search_cache()
+    cached = await search_cache.aget(cache_key)
+    # Formato compatto richiesto via ?format=compact o Accept: application/vnd.flights.compact+x-ndjson
+    compact = response_format == "compact" or COMPACT_MEDIA_TYPE in request.headers.get("accept", "")
+
+    # Trace opt-in (?trace=1), oppure di tutte le ricerche se SEARCH_TRACE_LOG è impostata
+    traced = trace or TRACE_LOG_PATH is not None
+
+    async def results():
+        if cached is None:
+            async for line in _search_stream(**params, cache_key=cache_key, protocol=protocol, compact=compact):
+                yield line
+            return
+        # Ricerca già calcolata: risultati immediati, ricalcolati in background se non più freschi
+        connections, state = cached
+        message = "Risultati dalla cache."
+        if state == STALE:
+            message = "Risultati dalla cache, aggiornamento in background..."
+            if search_cache.begin_refresh(cache_key):
+                task = asyncio.create_task(_refresh_search(params, cache_key))
+                _background_refreshes.add(task)
+                task.add_done_callback(_background_refreshes.discard)
+        print(f"[Search Stream] {start} -> {end}: {len(connections)} risultati dalla cache ({state})")
+        yield json.dumps({"type": "progress", "percent": 100, "message": message}) + "\n"
+        with span("serialize", event="results"):
+            if protocol == 2:
+                delta = DeltaEncoder(compact)
+                final = delta.encode(connections) + delta.complete()
             else:
-                print("[Search Stream] Duffel non disponibile — risultati solo Ryanair.")
-
-            combined_connections = find_connections(
-                providers_for_combined,
-                start, end, max_layover_days * 24,
-                filter_start=start_date, filter_end=end_date
-            )
-            records = [c.to_dict() for c in combined_connections]
-
-            yield json.dumps({"type": "progress", "percent": 100, "message": "Fatto!"}) + "\n"
-            yield json.dumps({"type": "results", "data": records}) + "\n"
-            print(f"[Search Stream] Risultati totali inviati: {len(records)}\n")
-            
-        except Exception as e:
-            print(f"[Search Stream ERROR] Errore: {str(e)}")
-            yield json.dumps({"type": "error", "message": f"Errore ricerca: {str(e)}"}) + "\n"
-            
-    return StreamingResponse(generate(), media_type="application/x-ndjson")
-
-# Modello dati per l'esportazione in Excel
+                final = encode_results("results", connections, compact)
+        yield final
+
+    async def generate():
+        # Id con cui il client esporta i risultati da /api/export/{search_id} senza reinviarli
+        yield json.dumps({"type": "search", "id": search_id(cache_key)}) + "\n"
+        if not traced:
+            async for line in results():
+                yield line
+            return
+        tracer = Trace("search", start=start, end=end, cached=cached is not None)
+        with tracer:
+            async for line in results():
+                yield line
+        if trace:
+            yield json.dumps({"type": "timing", **tracer.to_dict()}) + "\n"
+        await asyncio.to_thread(tracer.log)
+
+    # Stream compresso (brotli se disponibile, altrimenti gzip) quando il client lo accetta
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    if encoding is None:
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+    return StreamingResponse(
+        compress_stream(generate(), encoding),
+        media_type="application/x-ndjson",
+        headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+    )
+
+def _export_response(rows, export_format: str) -> StreamingResponse:
+    if export_format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=501, detail="Export Parquet non disponibile: pyarrow non installato")
+    media_type, extension = EXPORT_FORMATS[export_format]
+    return StreamingResponse(
+        stream_export(rows, export_format),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f"attachment; filename=voli_trovati.{extension}",
+            "Access-Control-Expose-Headers": "Content-Disposition"
+        }
+    )
+
+# Modello dati per l'esportazione (Excel, CSV, Parquet)
 class FlightRecord(BaseModel):
     Connection: str
     First_Leg_Departure: Optional[str] = Query(None, alias="First Leg Departure")
@@ -349,6 +433,10 @@ class FlightRecord(BaseModel):
     Second_Leg_Arrival: Optional[str] = Query(None, alias="Second Leg Arrival")
     Second_Leg_Carrier: Optional[str] = Query(None, alias="Second Leg Carrier")
     Second_Leg_Flight_Number: Optional[str] = Query(None, alias="Second Leg Flight Number")
+    Third_Leg_Departure: Optional[str] = Query(None, alias="Third Leg Departure")
+    Third_Leg_Arrival: Optional[str] = Query(None, alias="Third Leg Arrival")
+    Third_Leg_Carrier: Optional[str] = Query(None, alias="Third Leg Carrier")
+    Third_Leg_Flight_Number: Optional[str] = Query(None, alias="Third Leg Flight Number")
     Layover_h: Optional[float] = Query(None, alias="Layover (h)")
     Total_Duration_h: Optional[float] = Query(None, alias="Total Duration (h)")
     Total_Price_EUR: Optional[float] = Query(None, alias="Total Price (€)")
@@ -357,46 +445,35 @@ class FlightRecord(BaseModel):
         populate_by_name = True
 
 @app.post("/api/export")
-def export_to_excel(flights: List[FlightRecord]):
-    """Genera ed esporta un file Excel a partire dai voli passati in formato JSON."""
+def export_flights(
+    flights: List[FlightRecord],
+    export_format: str = Query("xlsx", alias="format", pattern="^(xlsx|csv|parquet)$", description="Formato del file: xlsx, csv o parquet")
+):
+    """Esporta i voli passati in formato JSON come file Excel, CSV o Parquet, generato in streaming."""
     if not flights:
         raise HTTPException(status_code=400, detail="Nessun dato fornito per l'esportazione")
-    
-    try:
-        # Convertiamo la lista di record Pydantic in DataFrame
-        data = []
-        for f in flights:
-            data.append({
-                "Connection": f.Connection,
-                "First Leg Departure": f.First_Leg_Departure or "-",
-                "First Leg Arrival": f.First_Leg_Arrival or "-",
-                "First Leg Carrier": f.First_Leg_Carrier or "-",
-                "First Leg Flight Number": f.First_Leg_Flight_Number or "-",
-                "Second Leg Departure": f.Second_Leg_Departure or "-",
-                "Second Leg Arrival": f.Second_Leg_Arrival or "-",
-                "Second Leg Carrier": f.Second_Leg_Carrier or "-",
-                "Second Leg Flight Number": f.Second_Leg_Flight_Number or "-",
-                "Layover (h)": f.Layover_h if f.Layover_h is not None else 0,
-                "Total Duration (h)": f.Total_Duration_h if f.Total_Duration_h is not None else 0,
-                "Total Price (€)": f.Total_Price_EUR
-            })
-        
-        df = pd.DataFrame(data)
-        
-        # Generiamo il file in memoria
-        excel_buffer = save_to_excel_in_memory(df)
-        
-        # Restituiamo il file Excel come StreamingResponse per il download
-        return StreamingResponse(
-            excel_buffer,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={
-                "Content-Disposition": "attachment; filename=voli_trovati.xlsx",
-                "Access-Control-Expose-Headers": "Content-Disposition"
-            }
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Errore durante la generazione dell'Excel: {str(e)}")
+    # Righe prodotte su richiesta dal writer: nessun DataFrame né workbook completo in memoria
+    rows = (export_row(f.model_dump(by_alias=True)) for f in flights)
+    return _export_response(rows, export_format)
+
+@app.get("/api/export/{search_id}")
+def export_search(
+    search_id: str,
+    export_format: str = Query("xlsx", alias="format", pattern="^(xlsx|csv|parquet)$", description="Formato del file: xlsx, csv o parquet"),
+    carrier: Optional[List[str]] = Query(None, description="Compagnie ammesse (ripetibile): esclude le connessioni con tratte di altri carrier"),
+    max_price: Optional[float] = Query(None, ge=0, description="Prezzo totale massimo"),
+    max_duration_h: Optional[float] = Query(None, ge=0, description="Durata totale massima in ore"),
+    max_stops: Optional[int] = Query(None, ge=0, le=2, description="Numero massimo di scali")
+):
+    """Esporta i risultati di una ricerca già calcolata, letti dal cache risultati lato server."""
+    connections = get_search_cache().lookup(search_id)
+    if connections is None:
+        raise HTTPException(status_code=404, detail="Ricerca non trovata o scaduta: ripetere la ricerca")
+    selected = filter_connections(
+        connections, carriers=set(carrier) if carrier else None,
+        max_price=max_price, max_duration_h=max_duration_h, max_stops=max_stops
+    )
+    return _export_response((connection_row(conn) for conn in selected), export_format)
 
 # ----------------- SERVIZIO FILE STATICI IN LOCALE -----------------
 # Serve il frontend in locale. Su Vercel questa parte viene saltata 
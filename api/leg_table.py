@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta
+import numpy as np
+from api.models import FlightLeg
+
+_EPOCH = datetime(1970, 1, 1)
+_MINUTE = timedelta(minutes=1)
+
+def to_epoch_minutes(dt: datetime) -> int:
+    """Converte un datetime naive in minuti dall'epoch (stessa base per tutti i provider)."""
+    return (dt - _EPOCH) // _MINUTE
+
+class LegTable:
+    """
+    Archivio colonnare di FlightLeg per il join del router.
+    Ogni segmento diventa una riga: aeroporti e carrier sono internati in id interi,
+    partenza/arrivo sono minuti dall'epoch (int64) e il prezzo è float64.
+    I FlightLeg originali restano in `legs` e vengono usati solo per materializzare
+    le Connection effettivamente restituite.
+
+    Le righe duplicate (stessa chiave di deduplica del router) non vengono reinserite:
+    append restituisce l'indice della riga già esistente.
+    """
+
+    def __init__(self):
+        self.airports: dict[str, int] = {}
+        self.carriers: dict[str, int] = {}
+        self.legs: list[FlightLeg] = []
+        self._rows: dict[tuple, int] = {}
+        self._from_id: list[int] = []
+        self._to_id: list[int] = []
+        self._carrier_id: list[int] = []
+        self._departure: list[int] = []
+        self._arrival: list[int] = []
+        self._price: list[float] = []
+        self._columns = None
+
+    def __len__(self) -> int:
+        return len(self.legs)
+
+    def _intern(self, mapping: dict[str, int], value: str) -> int:
+        idx = mapping.get(value)
+        if idx is None:
+            idx = mapping[value] = len(mapping)
+        return idx
+
+    def airport_id(self, code: str) -> int:
+        return self._intern(self.airports, code)
+
+    def append(self, leg: FlightLeg) -> int:
+        """Aggiunge un segmento e restituisce l'indice di riga."""
+        key = (leg.from_code, leg.to_code, leg.departure, leg.arrival, leg.flight_number)
+        row = self._rows.get(key)
+        if row is not None:
+            return row
+        row = self._rows[key] = len(self.legs)
+        self.legs.append(leg)
+        self._from_id.append(self.airport_id(leg.from_code))
+        self._to_id.append(self.airport_id(leg.to_code))
+        self._carrier_id.append(self._intern(self.carriers, leg.carrier))
+        self._departure.append(to_epoch_minutes(leg.departure))
+        self._arrival.append(to_epoch_minutes(leg.arrival))
+        self._price.append(leg.price)
+        self._columns = None
+        return row
+
+    def extend(self, legs) -> list[int]:
+        return [self.append(leg) for leg in legs]
+
+    def _build(self) -> dict:
+        if self._columns is None:
+            self._columns = {
+                "from_id": np.array(self._from_id, dtype=np.int32),
+                "to_id": np.array(self._to_id, dtype=np.int32),
+                "carrier_id": np.array(self._carrier_id, dtype=np.int32),
+                "departure": np.array(self._departure, dtype=np.int64),
+                "arrival": np.array(self._arrival, dtype=np.int64),
+                "price": np.array(self._price, dtype=np.float64),
+            }
+        return self._columns
+
+    @property
+    def from_id(self) -> np.ndarray:
+        return self._build()["from_id"]
+
+    @property
+    def to_id(self) -> np.ndarray:
+        return self._build()["to_id"]
+
+    @property
+    def carrier_id(self) -> np.ndarray:
+        return self._build()["carrier_id"]
+
+    @property
+    def departure(self) -> np.ndarray:
+        return self._build()["departure"]
+
+    @property
+    def arrival(self) -> np.ndarray:
+        return self._build()["arrival"]
+
+    @property
+    def price(self) -> np.ndarray:
+        return self._build()["price"]
+
+def join_layovers(table: LegTable, first_rows: np.ndarray, second_rows: np.ndarray, max_layover_min: int) -> tuple:
+    """
+    Join vettoriale tra primi e secondi segmenti allo stesso scalo.
+    I secondi segmenti vengono ordinati per partenza e, per ogni primo segmento,
+    searchsorted individua la finestra (arrivo, arrivo + max_layover_min]; le coppie
+    valide sono poi espanse con repeat/arange senza cicli Python.
+
+    Restituisce (righe_primo, righe_secondo, prezzo, scalo_min, durata_min) come array allineati.
+    """
+    empty = np.empty(0, dtype=np.int64)
+    if len(first_rows) == 0 or len(second_rows) == 0:
+        return empty, empty, np.empty(0), empty, empty
+
+    second_rows = second_rows[np.argsort(table.departure[second_rows], kind="stable")]
+    second_dep = table.departure[second_rows]
+    first_arr = table.arrival[first_rows]
+
+    lo = np.searchsorted(second_dep, first_arr, side="right")
+    hi = np.searchsorted(second_dep, first_arr + max_layover_min, side="right")
+    counts = hi - lo
+    total = int(counts.sum())
+    if total == 0:
+        return empty, empty, np.empty(0), empty, empty
+
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    i = np.repeat(first_rows, counts)
+    j = second_rows[np.repeat(lo, counts) + (np.arange(total) - offsets)]
+
+    price = table.price[i] + table.price[j]
+    layover = table.departure[j] - table.arrival[i]
+    duration = table.arrival[j] - table.departure[i]
+    return i, j, price, layover, duration
@@ -0,0 +1,190 @@
+import bisect
+import threading
+import time
+
+# Bucket (secondi) degli istogrammi di latenza: dalle risposte in cache ai timeout upstream
+DEFAULT_BUCKETS = (0.005, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, float] = {}
+        self._functions: dict[tuple, callable] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def set_function(self, fn, **labels):
+        """Valore calcolato da fn() a ogni scrape (es. dimensione di una cache o contatori esterni)."""
+        self._functions[self._key(labels)] = fn
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, fn in list(self._functions.items()):
+            try:
+                values[key] = fn()
+            except Exception:
+                continue
+        for key, value in sorted(values.items()):
+            yield self.name, key, value
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}  # chiave → [conteggi per bucket (+Inf incluso), somma]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][idx] += 1
+            series[1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield self.name + "_bucket", key + (("le", _format_value(bound)),), cumulative
+            yield self.name + "_sum", key, total
+            yield self.name + "_count", key, cumulative
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+class Registry:
+    """
+    Registro delle metriche di processo in formato testo Prometheus.
+    Contatori e istogrammi sono aggiornati in memoria sotto un lock (costo di un
+    incremento); le grandezze esterne (cache, singleflight) si leggono solo allo scrape.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    "flights_upstream_requests_total", "Richieste HTTP agli upstream per provider e codice di stato", ("provider", "status"))
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "flights_upstream_request_duration_seconds", "Latenza delle richieste HTTP agli upstream", ("provider",))
+UPSTREAM_RATE_LIMITED = REGISTRY.counter(
+    "flights_upstream_rate_limited_total", "Risposte 429 ricevute dagli upstream", ("provider",))
+UPSTREAM_RATE = REGISTRY.gauge(
+    "flights_upstream_rate_limit", "Richieste/s concesse attualmente dal rate limiter adattivo", ("provider",))
+CACHE_REQUESTS = REGISTRY.counter(
+    "flights_cache_requests_total", "Lookup nelle cache (hit/miss)", ("cache", "result"))
+CACHE_ENTRIES = REGISTRY.gauge(
+    "flights_cache_entries", "Voci presenti nelle cache in memoria", ("cache",))
+SINGLEFLIGHT_CALLS = REGISTRY.counter(
+    "flights_singleflight_calls_total", "Chiamate upstream eseguite e richieste servite da una chiamata in corso", ("flight", "outcome"))
+ROUTER_VIA_CANDIDATES = REGISTRY.counter(
+    "flights_router_via_candidates_total", "Aeroporti di scalo candidati valutati dal router")
+ROUTER_LEGS_JOINED = REGISTRY.counter(
+    "flights_router_legs_joined_total", "Segmenti in ingresso ai join per scalo")
+ROUTER_CONNECTIONS = REGISTRY.counter(
+    "flights_router_connections_total", "Connessioni prodotte dal router", ("kind",))
+ROUTER_JOIN_DURATION = REGISTRY.histogram(
+    "flights_router_join_duration_seconds", "Durata dei join per scalo")
+
+def record_upstream_request(provider: str, status, seconds: float):
+    """Registra una richiesta upstream: `status` è il codice HTTP o "error" per gli errori di connessione."""
+    UPSTREAM_REQUESTS.inc(provider=provider, status=str(status))
+    UPSTREAM_LATENCY.observe(seconds, provider=provider)
+    if status == 429:
+        UPSTREAM_RATE_LIMITED.inc(provider=provider)
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+def track_singleflight(name: str, flight):
+    """Espone le statistiche di un SingleFlight (calls/shared) come contatori."""
+    for outcome in ("calls", "shared"):
+        SINGLEFLIGHT_CALLS.set_function(lambda outcome=outcome: flight.stats()[outcome], flight=name, outcome=outcome)
+
+def render() -> str:
+    return REGISTRY.render()
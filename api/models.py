@@ -1,7 +1,10 @@
-from dataclasses import dataclass
+import sys
+from dataclasses import dataclass, field
 from datetime import datetime
 
-@dataclass
+_TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+@dataclass(frozen=True, slots=True)
 class FlightLeg:
     from_code: str
     to_code: str
@@ -12,33 +15,95 @@ class FlightLeg:
     price: float
     carrier: str
     flight_number: str
+    # Orari già formattati: calcolati una volta per segmento invece che per ogni connessione
+    departure_str: str = field(init=False, repr=False, compare=False)
+    arrival_str: str = field(init=False, repr=False, compare=False)
+    # Frammenti JSON già codificati, popolati al primo uso da api.ndjson
+    _encoded: tuple | None = field(init=False, repr=False, compare=False, default=None)
+
+    def __post_init__(self):
+        # Codici, città e carrier si ripetono su migliaia di segmenti: una sola copia in memoria
+        for name in ("from_code", "to_code", "from_city", "to_city", "carrier"):
+            value = getattr(self, name)
+            if isinstance(value, str):
+                object.__setattr__(self, name, sys.intern(value))
+        object.__setattr__(self, "departure_str", self.departure.strftime(_TIME_FORMAT))
+        object.__setattr__(self, "arrival_str", self.arrival.strftime(_TIME_FORMAT))
+
+    def to_row(self) -> list:
+        """Forma compatta serializzabile in JSON, usata dai cache persistenti."""
+        return [self.from_code, self.to_code, self.from_city, self.to_city,
+                self.departure.isoformat(), self.arrival.isoformat(),
+                self.price, self.carrier, self.flight_number]
+
+    @classmethod
+    def from_row(cls, row: list) -> "FlightLeg":
+        from_code, to_code, from_city, to_city, dep, arr, price, carrier, flight_number = row
+        return cls(from_code, to_code, from_city, to_city,
+                   datetime.fromisoformat(dep), datetime.fromisoformat(arr),
+                   price, carrier, flight_number)
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Connection:
     connection_label: str          # "FCO-AMS | AMS-JFK"
     first_leg: FlightLeg
     second_leg: FlightLeg | None   # None = volo diretto
-    layover_h: float
+    layover_h: float               # somma degli scali per itinerari con più tratte
     total_duration_h: float
     total_price: float
+    extra_legs: tuple[FlightLeg, ...] = ()  # tratte oltre la seconda (2+ scali)
+
+    @property
+    def legs(self) -> list[FlightLeg]:
+        """Tutte le tratte dell'itinerario in ordine di volo."""
+        legs = [self.first_leg]
+        if self.second_leg:
+            legs.append(self.second_leg)
+        legs.extend(self.extra_legs)
+        return legs
+
+    def to_row(self) -> list:
+        """Forma compatta serializzabile in JSON (tratte come FlightLeg.to_row)."""
+        return [self.connection_label, [leg.to_row() for leg in self.legs],
+                self.layover_h, self.total_duration_h, self.total_price]
+
+    @classmethod
+    def from_row(cls, row: list) -> "Connection":
+        label, leg_rows, layover_h, total_duration_h, total_price = row
+        legs = [FlightLeg.from_row(leg) for leg in leg_rows]
+        return cls(label, legs[0], legs[1] if len(legs) > 1 else None,
+                   layover_h, total_duration_h, total_price, tuple(legs[2:]))
 
     def to_dict(self) -> dict:
         """Serializza nel formato colonne atteso dal frontend."""
-        return {
+        first = self.first_leg
+        second = self.second_leg
+        record = {
             "Connection": self.connection_label,
-            "First Leg Departure": self.first_leg.departure.strftime("%Y-%m-%d %H:%M"),
-            "First Leg Arrival": self.first_leg.arrival.strftime("%Y-%m-%d %H:%M"),
-            "First Leg Carrier": self.first_leg.carrier,
-            "First Leg Flight Number": self.first_leg.flight_number,
-            "Second Leg Departure": self.second_leg.departure.strftime("%Y-%m-%d %H:%M") if self.second_leg else None,
-            "Second Leg Arrival": self.second_leg.arrival.strftime("%Y-%m-%d %H:%M") if self.second_leg else None,
-            "Second Leg Carrier": self.second_leg.carrier if self.second_leg else None,
-            "Second Leg Flight Number": self.second_leg.flight_number if self.second_leg else None,
+            "First Leg Departure": first.departure_str,
+            "First Leg Arrival": first.arrival_str,
+            "First Leg Carrier": first.carrier,
+            "First Leg Flight Number": first.flight_number,
+            "Second Leg Departure": second.departure_str if second else None,
+            "Second Leg Arrival": second.arrival_str if second else None,
+            "Second Leg Carrier": second.carrier if second else None,
+            "Second Leg Flight Number": second.flight_number if second else None,
             "Layover (h)": self.layover_h,
             "Total Duration (h)": self.total_duration_h,
             "Total Price (€)": self.total_price,
-            "First Leg Origin City": self.first_leg.from_city,
-            "First Leg Destination City": self.first_leg.to_city,
-            "Second Leg Origin City": self.second_leg.from_city if self.second_leg else None,
-            "Second Leg Destination City": self.second_leg.to_city if self.second_leg else None
+            "First Leg Origin City": first.from_city,
+            "First Leg Destination City": first.to_city,
+            "Second Leg Origin City": second.from_city if second else None,
+            "Second Leg Destination City": second.to_city if second else None
         }
+        if self.extra_legs:
+            third = self.extra_legs[0]
+            record.update({
+                "Third Leg Departure": third.departure_str,
+                "Third Leg Arrival": third.arrival_str,
+                "Third Leg Carrier": third.carrier,
+                "Third Leg Flight Number": third.flight_number,
+                "Third Leg Origin City": third.from_city,
+                "Third Leg Destination City": third.to_city,
+            })
+        return record
@@ -0,0 +1,176 @@
+import json
+from api.models import Connection, FlightLeg
+from api.leg_table import to_epoch_minutes
+
+try:
+    import orjson
+except ImportError:  # orjson è opzionale: fallback sulla libreria standard
+    orjson = None
+
+def dumps(value) -> bytes:
+    """Codifica un valore JSON in bytes (orjson se disponibile)."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value).encode()
+
+def encode_event(event: dict) -> bytes:
+    """Una riga NDJSON per eventi piccoli (progress, error, ...)."""
+    return dumps(event) + b"\n"
+
+_NULL = b"null"
+_NULL_LEG = (_NULL,) * 6
+
+def _key(name: str) -> bytes:
+    return dumps(name) + b":"
+
+# Stesso ordine delle chiavi di Connection.to_dict()
+_K_CONNECTION = b"{" + _key("Connection")
+_LEG_KEYS = {
+    prefix: tuple(b"," + _key(f"{prefix} Leg {name}") for name in ("Departure", "Arrival", "Carrier", "Flight Number", "Origin City", "Destination City"))
+    for prefix in ("First", "Second", "Third")
+}
+_K_LAYOVER = b"," + _key("Layover (h)")
+_K_DURATION = b"," + _key("Total Duration (h)")
+_K_PRICE = b"," + _key("Total Price (€)")
+
+def _leg_values(leg: FlightLeg) -> tuple:
+    """Valori JSON del segmento, codificati una sola volta e memorizzati sul FlightLeg."""
+    encoded = leg._encoded
+    if encoded is None:
+        encoded = (
+            dumps(leg.departure_str),
+            dumps(leg.arrival_str),
+            dumps(leg.carrier),
+            dumps(leg.flight_number),
+            dumps(leg.from_city),
+            dumps(leg.to_city),
+        )
+        object.__setattr__(leg, "_encoded", encoded)
+    return encoded
+
+def connection_id(conn: Connection) -> str:
+    """
+    Id stabile della connessione: tratta, numero volo e partenza di ogni segmento
+    (es. "FCO-AMS:FR1@2606161000"). La tratta serve perché i numeri volo Ryanair
+    ricavati dal prezzo (FR999, FR{prezzo}) possono coincidere su rotte diverse.
+    """
+    return "_".join(
+        f"{leg.from_code}-{leg.to_code}:{leg.flight_number}@{leg.departure:%y%m%d%H%M}" for leg in conn.legs
+    )
+
+def encode_connection(conn: Connection, with_id: bool = False) -> bytes:
+    """Codifica una Connection direttamente in bytes JSON, senza dict intermedio."""
+    first = _leg_values(conn.first_leg)
+    second = _leg_values(conn.second_leg) if conn.second_leg else _NULL_LEG
+    k1 = _LEG_KEYS["First"]
+    k2 = _LEG_KEYS["Second"]
+    head = b'{"id":' + dumps(connection_id(conn)) + b"," + _key("Connection") if with_id else _K_CONNECTION
+    parts = [
+        head, dumps(conn.connection_label),
+        k1[0], first[0], k1[1], first[1], k1[2], first[2], k1[3], first[3],
+        k2[0], second[0], k2[1], second[1], k2[2], second[2], k2[3], second[3],
+        _K_LAYOVER, dumps(conn.layover_h),
+        _K_DURATION, dumps(conn.total_duration_h),
+        _K_PRICE, dumps(conn.total_price),
+        k1[4], first[4], k1[5], first[5],
+        k2[4], second[4], k2[5], second[5],
+    ]
+    if conn.extra_legs:
+        third = _leg_values(conn.extra_legs[0])
+        for key, value in zip(_LEG_KEYS["Third"], third):
+            parts.append(key)
+            parts.append(value)
+    parts.append(b"}")
+    return b"".join(parts)
+
+# Media type con cui un client può chiedere il formato compatto via header Accept
+COMPACT_MEDIA_TYPE = "application/vnd.flights.compact+x-ndjson"
+
+_LEG_COLUMNS = ("from", "to", "from_city", "to_city", "carrier", "flight", "dep", "arr")
+
+def compact_table(connections: list[Connection], with_id: bool = False) -> dict:
+    """
+    Formato compatto a colonne: un array per campo invece di un oggetto per record.
+    Codici, città, carrier, numeri di volo ed etichette sono indici nel dizionario
+    `strings`; gli orari sono minuti dall'epoch. `legs` ha una voce per posizione di
+    tratta (prima, seconda, ...), con null dove l'itinerario ha meno tratte.
+    """
+    strings: dict[str, int] = {}
+
+    def ref(value: str) -> int:
+        idx = strings.get(value)
+        if idx is None:
+            idx = strings[value] = len(strings)
+        return idx
+
+    leg_count = max((len(conn.legs) for conn in connections), default=0)
+    legs = [{name: [] for name in _LEG_COLUMNS} for _ in range(leg_count)]
+    table = {"count": len(connections), "strings": None}
+    if with_id:
+        table["id"] = [connection_id(conn) for conn in connections]
+    table["label"] = [ref(conn.connection_label) for conn in connections]
+    table["layover_h"] = [conn.layover_h for conn in connections]
+    table["duration_h"] = [conn.total_duration_h for conn in connections]
+    table["price"] = [conn.total_price for conn in connections]
+    for conn in connections:
+        conn_legs = conn.legs
+        for pos, columns in enumerate(legs):
+            leg = conn_legs[pos] if pos < len(conn_legs) else None
+            if leg is None:
+                for values in columns.values():
+                    values.append(None)
+                continue
+            columns["from"].append(ref(leg.from_code))
+            columns["to"].append(ref(leg.to_code))
+            columns["from_city"].append(ref(leg.from_city))
+            columns["to_city"].append(ref(leg.to_city))
+            columns["carrier"].append(ref(leg.carrier))
+            columns["flight"].append(ref(leg.flight_number))
+            columns["dep"].append(to_epoch_minutes(leg.departure))
+            columns["arr"].append(to_epoch_minutes(leg.arrival))
+    table["strings"] = list(strings)
+    table["legs"] = legs
+    return table
+
+def encode_results(event_type: str, connections: list[Connection], compact: bool = False) -> bytes:
+    """Riga NDJSON {"type": event_type, "data": [...]} con i record delle connessioni."""
+    if compact:
+        return encode_event({"type": event_type, "format": "compact", "data": compact_table(connections)})
+    return b"".join((
+        b'{"type":', dumps(event_type), b',"data":[',
+        b",".join(encode_connection(c) for c in connections),
+        b"]}\n",
+    ))
+
+class DeltaEncoder:
+    """
+    Protocollo stream v2: invece di reinviare ogni volta tutti i risultati, ogni evento
+    {"type": "delta", "added": [...], "removed": [...]} contiene solo le connessioni nuove
+    (con il loro "id") e gli id usciti dal risultato (limit/pareto); {"type": "complete"}
+    chiude lo stream. Il client mantiene la mappa id → record applicando i delta.
+    """
+
+    def __init__(self, compact: bool = False):
+        self.compact = compact
+        self._sent: set[str] = set()
+
+    def encode(self, connections: list[Connection]) -> bytes:
+        """Delta rispetto a quanto già inviato; b"" se non è cambiato nulla."""
+        current = {}
+        for conn in connections:
+            current.setdefault(connection_id(conn), conn)
+        added = [conn for conn_id, conn in current.items() if conn_id not in self._sent]
+        removed = sorted(self._sent - current.keys())
+        if not added and not removed:
+            return b""
+        self._sent = set(current)
+        if self.compact:
+            return encode_event({"type": "delta", "format": "compact", "added": compact_table(added, with_id=True), "removed": removed})
+        return b"".join((
+            b'{"type":"delta","added":[',
+            b",".join(encode_connection(c, with_id=True) for c in added),
+            b'],"removed":', dumps(removed), b"}\n",
+        ))
+
+    def complete(self) -> bytes:
+        return encode_event({"type": "complete", "count": len(self._sent)})
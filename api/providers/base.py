@@ -13,3 +13,19 @@ class FlightProvider(Protocol):
         Ogni elemento è un singolo segmento di volo, non una connessione composta.
         """
         ...
+
+@runtime_checkable
+class AsyncFlightProvider(Protocol):
+    """
+    Variante asincrona del contratto, per la pipeline di ricerca su event loop.
+    I metodi hanno il prefisso `a` così che un provider possa implementare entrambe
+    le varianti condividendo gli stessi cache.
+    """
+
+    async def aget_destinations(self, airport_code: str) -> list[str]:
+        """Come get_destinations, senza bloccare l'event loop."""
+        ...
+
+    async def aget_flights(self, from_code: str, to_code: str, date_str: str) -> list[FlightLeg]:
+        """Come get_flights, senza bloccare l'event loop."""
+        ...
@@ -1,10 +1,17 @@
+import asyncio
 import os
-import requests
+import threading
 import time
+import weakref
 from datetime import datetime
 from api.models import FlightLeg
-from api.providers.base import FlightProvider
-from api.city_groups import expand_airport
+from api.providers.base import FlightProvider, AsyncFlightProvider
+from api.city_groups import CITY_GROUPS, expand_airport
+from api.http_client import HttpClient, get_http_client
+from api.singleflight import SingleFlight
+from api.rate_limit import AdaptiveRateLimiter, reset_seconds
+from api.metrics import CACHE_ENTRIES, UPSTREAM_RATE, record_cache_lookup, track_singleflight
+from api.tracing import span
 
 GLOBAL_HUBS = [
     "ATL", "PEK", "LAX", "HND", "ORD", "LHR", "PVG", "CDG", "DFW", "AMS",
@@ -23,6 +30,34 @@ GLOBAL_HUBS = [
 ]
 GLOBAL_HUBS = list(dict.fromkeys(GLOBAL_HUBS))
 
+# Codici città IATA accettati da Duffel come origine/destinazione: una sola offer request
+# copre tutti gli aeroporti dell'area (RMA è il codice Ryanair per Roma, in IATA è ROM).
+# Il gruppo "LAX" non compare: LAX è anche il codice dell'aeroporto.
+CITY_QUERY_CODES = {
+    "ROM": "ROM", "RMA": "ROM", "LON": "LON", "MIL": "MIL", "PAR": "PAR",
+    "NYC": "NYC", "CHI": "CHI", "TYO": "TYO", "OSA": "OSA",
+}
+
+def _query_codes(airport: str) -> list[str]:
+    """Codici da interrogare per coprire l'area di `airport`: il codice città se Duffel lo supporta."""
+    expanded = expand_airport(airport)
+    for group, city_code in CITY_QUERY_CODES.items():
+        if CITY_GROUPS.get(group) == expanded:
+            return [city_code]
+    return expanded
+
+# Ricerche concorrenti sulla stessa tratta/data condividono una sola offer_request
+_offer_calls = SingleFlight()
+track_singleflight("duffel_offers", _offer_calls)
+
+# Limite di richieste condiviso da tutte le ricerche del processo, adattato dagli header ratelimit-*
+_rate_limiter = AdaptiveRateLimiter(rate=float(os.getenv("DUFFEL_INITIAL_RATE", 2.0)))
+UPSTREAM_RATE.set_function(lambda: _rate_limiter.rate, provider="duffel")
+
+# Istanze vive, per esporre la dimensione del cache segmenti nelle metriche
+_live_providers = weakref.WeakSet()
+CACHE_ENTRIES.set_function(lambda: sum(len(p._cache) for p in list(_live_providers)), cache="duffel_offers")
+
 def _get_place_name(place: dict) -> str:
     if not place:
         return ""
@@ -36,47 +71,109 @@ def _get_place_name(place: dict) -> str:
             return city_name
     return place.get("name", place.get("iata_code", ""))
 
-class DuffelProvider(FlightProvider):
-    def __init__(self, start_airport: str = None, end_airport: str = None, dates: list[str] = None, progress_callback = None):
+class _AdjacencyIndex:
+    """
+    Segmenti in cache per (origine, destinazione, data) con adiacenze nei due sensi,
+    aggiornate a ogni inserimento: i lookup del router costano O(grado) e non una
+    scansione di tutte le chiavi.
+    """
+
+    def __init__(self, buckets: dict = None):
+        self.buckets: dict[tuple, list[FlightLeg]] = {}
+        self.outbound: dict[str, set[str]] = {}
+        self.inbound: dict[str, set[str]] = {}
+        for key, legs in (buckets or {}).items():
+            self._link(key)
+            self.buckets[key] = legs
+
+    def _link(self, key: tuple):
+        from_code, to_code, _ = key
+        self.outbound.setdefault(from_code, set()).add(to_code)
+        self.inbound.setdefault(to_code, set()).add(from_code)
+
+    def add(self, leg: FlightLeg):
+        key = (leg.from_code.upper(), leg.to_code.upper(), leg.departure.strftime("%Y-%m-%d"))
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = []
+            self._link(key)
+        bucket.append(leg)
+
+    def destinations(self, code: str) -> set[str]:
+        return self.outbound.get(code, set())
+
+    def origins(self, code: str) -> set[str]:
+        return self.inbound.get(code, set())
+
+class DuffelProvider(FlightProvider, AsyncFlightProvider):
+    def __init__(self, start_airport: str = None, end_airport: str = None, dates: list[str] = None, progress_callback = None, max_concurrency: int = 8, http: HttpClient = None, rate_limiter: AdaptiveRateLimiter = None):
         self.token = os.getenv("DUFFEL_ACCESS_TOKEN")
+        # Sessione HTTP keep-alive condivisa (iniettabile per configurazioni dedicate)
+        self.http = http or get_http_client("duffel")
+        # Richieste in volo per ricerca: il ritmo effettivo è deciso dal rate limiter condiviso
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter or _rate_limiter
         self.start_airport = start_airport
         self.end_airport = end_airport
         self.dates = dates
         self.progress_callback = progress_callback
-        self._cache = {}
+        self._index = _AdjacencyIndex()
+        # Richieste di offerte non andate a buon fine (errori, 429 oltre i retry): cache parziale
+        self.failed_requests = 0
+        _live_providers.add(self)
         self._cache_initialized = False
+        self._cache_lock = threading.Lock()
+        # Creato al primo uso dentro l'event loop della richiesta
+        self._acache_lock = None
+
+    @property
+    def _cache(self) -> dict[tuple, list[FlightLeg]]:
+        """Segmenti per (origine, destinazione, data); assegnarlo ricostruisce l'indice."""
+        return self._index.buckets
+
+    @_cache.setter
+    def _cache(self, buckets: dict):
+        self._index = _AdjacencyIndex(buckets)
 
     def _initialize_cache(self):
         if self._cache_initialized:
             return
-        self._cache_initialized = True
-        
+        # Il router può chiamare get_flights da più thread: il primo popola il cache, gli altri attendono
+        with self._cache_lock:
+            if self._cache_initialized:
+                return
+            self._populate_cache()
+            self._cache_initialized = True
+
+    def _cache_queries(self) -> list[tuple]:
+        """Combinazioni (origine, destinazione, data) da interrogare per popolare il cache."""
         if not self.token or not self.start_airport or not self.end_airport or not self.dates:
+            return []
+        # Aree metropolitane interrogate con il codice città (LON→NYC: 1 richiesta per data invece di 15);
+        # i segmenti restituiti hanno gli aeroporti reali e finiscono nei bucket per aeroporto
+        start_codes = _query_codes(self.start_airport)
+        end_codes = _query_codes(self.end_airport)
+        return [(s, e, d) for d in self.dates for s in start_codes for e in end_codes]
+
+    def _store_legs(self, legs: list[FlightLeg]):
+        for leg in legs:
+            self._index.add(leg)
+
+    def _report_progress(self, completed: int, total: int):
+        if self.progress_callback:
+            percent = 20 + int((completed / total) * 75)
+            self.progress_callback(percent, f"Ricerca Duffel: volo {completed}/{total} completato")
+
+    def _populate_cache(self):
+        queries = self._cache_queries()
+        if not queries:
             return
 
         from concurrent.futures import ThreadPoolExecutor, as_completed
-        
-        total_days = len(self.dates)
-        if total_days == 0:
-            return
-            
-        max_workers = min(total_days, 3)
+
+        max_workers = min(len(queries), self.max_concurrency)
         completed_days = 0
-        
-        # Duffel gestisce la ricerca globale tra le coppie di aeroporti espansi
-        start_expanded = expand_airport(self.start_airport)
-        end_expanded = expand_airport(self.end_airport)
-        
-        # Generiamo le combinazioni di origini e destinazioni espanse da interrogare per ciascuna data
-        queries = []
-        for d in self.dates:
-            for s in start_expanded:
-                for e in end_expanded:
-                    queries.append((s, e, d))
-                    
-        if not queries:
-            return
-            
+
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             futures = {
                 executor.submit(self._fetch_and_decompose, s, e, d): (s, e, d)
@@ -87,22 +184,47 @@ class DuffelProvider(FlightProvider):
                 completed_days += 1
                 s, e, d = futures[future]
                 try:
-                    legs = future.result()
-                    for leg in legs:
-                        date_key = leg.departure.strftime("%Y-%m-%d")
-                        key = (leg.from_code.upper(), leg.to_code.upper(), date_key)
-                        if key not in self._cache:
-                            self._cache[key] = []
-                        self._cache[key].append(leg)
+                    self._store_legs(future.result())
                 except Exception as ex:
                     print(f"Errore cache Duffel per {s}->{e} in data {d}: {ex}")
-                    
-                if self.progress_callback:
-                    percent = 20 + int((completed_days / len(queries)) * 75)
-                    self.progress_callback(percent, f"Ricerca Duffel: volo {completed_days}/{len(queries)} completato")
+                    self.failed_requests += 1
+                self._report_progress(completed_days, len(queries))
 
-    def get_destinations(self, airport_code: str) -> list[str]:
-        self._initialize_cache()
+    async def _ainitialize_cache(self):
+        if self._cache_initialized:
+            return
+        if self._acache_lock is None:
+            self._acache_lock = asyncio.Lock()
+        async with self._acache_lock:
+            if self._cache_initialized:
+                return
+            await self._apopulate_cache()
+            self._cache_initialized = True
+
+    async def _apopulate_cache(self):
+        queries = self._cache_queries()
+        if not queries:
+            return
+        # Stesso limite di concorrenza della versione a thread, senza occupare thread
+        semaphore = asyncio.Semaphore(min(len(queries), self.max_concurrency))
+
+        async def fetch(s, e, d):
+            async with semaphore:
+                try:
+                    return await self._afetch_and_decompose(s, e, d)
+                except Exception as ex:
+                    print(f"Errore cache Duffel per {s}->{e} in data {d}: {ex}")
+                    self.failed_requests += 1
+                    return []
+
+        with span("duffel.populate_cache", queries=len(queries)):
+            completed_days = 0
+            for next_done in asyncio.as_completed([fetch(s, e, d) for s, e, d in queries]):
+                self._store_legs(await next_done)
+                completed_days += 1
+                self._report_progress(completed_days, len(queries))
+
+    def _destinations_from_cache(self, airport_code: str) -> list[str]:
         if self._cache:
             # Restituisce aeroporti connessi in entrambe le direzioni: FROM e TO.
             # Necessario perché i segmenti decomposit da offerte 2-leg (es. CAG→BCN→MUC)
@@ -110,28 +232,55 @@ class DuffelProvider(FlightProvider):
             # get_destinations("MUC") per trovare via_candidates, deve trovare BCN
             # cercando chi arriva a MUC, non solo chi parte da MUC.
             code = airport_code.upper()
-            connected = set()
-            for (f_code, t_code, _) in self._cache.keys():
-                if f_code == code:
-                    connected.add(t_code)
-                elif t_code == code:
-                    connected.add(f_code)
-            return list(connected)
+            return list(self._index.destinations(code) | self._index.origins(code))
         return [hub for hub in GLOBAL_HUBS if hub.upper() != airport_code.upper()]
 
+    def _origins_from_cache(self, airport_code: str) -> list[str]:
+        if self._cache:
+            return list(self._index.origins(airport_code.upper()))
+        return [hub for hub in GLOBAL_HUBS if hub.upper() != airport_code.upper()]
+
+    def _cached_flights(self, from_code: str, to_code: str, date_str: str) -> list[FlightLeg]:
+        legs = self._cache.get((from_code.upper(), to_code.upper(), date_str))
+        record_cache_lookup("duffel_offers", legs is not None)
+        return legs or []
+
+    def get_destinations(self, airport_code: str) -> list[str]:
+        self._initialize_cache()
+        return self._destinations_from_cache(airport_code)
+
+    def get_origins(self, airport_code: str) -> list[str]:
+        """Aeroporti con almeno un segmento in cache diretto verso airport_code."""
+        self._initialize_cache()
+        return self._origins_from_cache(airport_code)
+
     def get_flights(self, from_code: str, to_code: str, date_str: str) -> list[FlightLeg]:
         if not self.dates:
             return self._fetch_and_decompose(from_code, to_code, date_str)
             
         self._initialize_cache()
-        key = (from_code.upper(), to_code.upper(), date_str)
-        return self._cache.get(key, [])
+        return self._cached_flights(from_code, to_code, date_str)
 
-    def _fetch_and_decompose(self, from_code: str, to_code: str, date_str: str) -> list[FlightLeg]:
-        if not self.token:
-            print("Duffel API non configurata. Manca DUFFEL_ACCESS_TOKEN.")
-            return []
+    async def aget_destinations(self, airport_code: str) -> list[str]:
+        await self._ainitialize_cache()
+        return self._destinations_from_cache(airport_code)
+
+    async def aget_origins(self, airport_code: str) -> list[str]:
+        await self._ainitialize_cache()
+        return self._origins_from_cache(airport_code)
+
+    async def aget_flights(self, from_code: str, to_code: str, date_str: str) -> list[FlightLeg]:
+        if not self.dates:
+            return await self._afetch_and_decompose(from_code, to_code, date_str)
+        await self._ainitialize_cache()
+        return self._cached_flights(from_code, to_code, date_str)
+
+    def iter_cached_legs(self):
+        """Itera su tutti i segmenti (anche decomposti) presenti nel cache, senza HTTP."""
+        for legs in self._cache.values():
+            yield from legs
 
+    def _offer_request(self, from_code: str, to_code: str, date_str: str) -> tuple[str, dict, dict]:
         url = "https://api.duffel.com/air/offer_requests"
         headers = {
             "Authorization": f"Bearer {self.token}",
@@ -155,109 +304,181 @@ class DuffelProvider(FlightProvider):
                 "cabin_class": "economy"
             }
         }
+        return url, payload, headers
+
+    def _decompose_offers(self, data: dict) -> list[FlightLeg]:
+        """Scompone le offerte Duffel (1 o 2 segmenti) in FlightLeg."""
+        offers = data.get("data", {}).get("offers", [])
+
+        results = []
+        for offer in offers:
+            total_price = float(offer.get("total_amount", 0.0))
+            for slice_item in offer.get("slices", []):
+                segments = slice_item.get("segments", [])
+
+                if len(segments) == 1:
+                    seg = segments[0]
+                    dep_dt = datetime.fromisoformat(seg.get("departing_at", "").replace("Z", ""))
+                    arr_dt = datetime.fromisoformat(seg.get("arriving_at", "").replace("Z", ""))
+
+                    results.append(
+                        FlightLeg(
+                            from_code=seg.get("origin", {}).get("iata_code", ""),
+                            to_code=seg.get("destination", {}).get("iata_code", ""),
+                            from_city=_get_place_name(seg.get("origin")),
+                            to_city=_get_place_name(seg.get("destination")),
+                            departure=dep_dt,
+                            arrival=arr_dt,
+                            price=total_price,
+                            carrier=seg.get("operating_carrier", {}).get("name", "Unknown"),
+                            flight_number=f"{seg.get('operating_carrier', {}).get('iata_code', 'ZZ')}{seg.get('flight_number', '999')}"
+                        )
+                    )
+
+                elif len(segments) == 2:
+                    seg1 = segments[0]
+                    seg2 = segments[1]
+
+                    dep_dt1 = datetime.fromisoformat(seg1.get("departing_at", "").replace("Z", ""))
+                    arr_dt1 = datetime.fromisoformat(seg1.get("arriving_at", "").replace("Z", ""))
+                    dep_dt2 = datetime.fromisoformat(seg2.get("departing_at", "").replace("Z", ""))
+                    arr_dt2 = datetime.fromisoformat(seg2.get("arriving_at", "").replace("Z", ""))
+
+                    dur1 = (arr_dt1 - dep_dt1).total_seconds()
+                    dur2 = (arr_dt2 - dep_dt2).total_seconds()
+                    total_dur = dur1 + dur2
+
+                    if total_dur > 0:
+                        price1 = total_price * (dur1 / total_dur)
+                        price2 = total_price * (dur2 / total_dur)
+                    else:
+                        price1 = total_price / 2.0
+                        price2 = total_price / 2.0
+
+                    results.append(
+                        FlightLeg(
+                            from_code=seg1.get("origin", {}).get("iata_code", ""),
+                            to_code=seg1.get("destination", {}).get("iata_code", ""),
+                            from_city=_get_place_name(seg1.get("origin")),
+                            to_city=_get_place_name(seg1.get("destination")),
+                            departure=dep_dt1,
+                            arrival=arr_dt1,
+                            price=price1,
+                            carrier=seg1.get("operating_carrier", {}).get("name", "Unknown"),
+                            flight_number=f"{seg1.get('operating_carrier', {}).get('iata_code', 'ZZ')}{seg1.get('flight_number', '999')}"
+                        )
+                    )
+
+                    results.append(
+                        FlightLeg(
+                            from_code=seg2.get("origin", {}).get("iata_code", ""),
+                            to_code=seg2.get("destination", {}).get("iata_code", ""),
+                            from_city=_get_place_name(seg2.get("origin")),
+                            to_city=_get_place_name(seg2.get("destination")),
+                            departure=dep_dt2,
+                            arrival=arr_dt2,
+                            price=price2,
+                            carrier=seg2.get("operating_carrier", {}).get("name", "Unknown"),
+                            flight_number=f"{seg2.get('operating_carrier', {}).get('iata_code', 'ZZ')}{seg2.get('flight_number', '999')}"
+                        )
+                    )
+        return results
+
+    def _fetch_and_decompose(self, from_code: str, to_code: str, date_str: str) -> list[FlightLeg]:
+        key = (from_code, to_code, date_str)
+        legs, failed = _offer_calls.do(key, lambda: self._request_offers(from_code, to_code, date_str))
+        # Anche chi ha atteso la richiesta di un'altra istanza registra l'errore: i suoi risultati sono parziali
+        self.failed_requests += failed
+        return legs
+
+    async def _afetch_and_decompose(self, from_code: str, to_code: str, date_str: str) -> list[FlightLeg]:
+        key = (from_code, to_code, date_str)
+        legs, failed = await _offer_calls.ado(key, lambda: self._arequest_offers(from_code, to_code, date_str))
+        self.failed_requests += failed
+        return legs
+
+    def _pause_after_429(self, response, backoff_time: float, date_str: str, attempt: int, max_retries: int) -> float:
+        """Sospende il rate limiter condiviso fino al reset; l'attesa avviene al prossimo acquire."""
+        wait_time = reset_seconds(response.headers.get("ratelimit-reset"))
+        if wait_time is None:
+            wait_time = backoff_time
+        print(f"[Duffel Rate Limit 429] Rilevato per la data {date_str}. Tentativo {attempt + 1}/{max_retries}. Attesa di {wait_time:.1f} secondi prima del retry...")
+        self.rate_limiter.pause(wait_time)
+        return backoff_time * 2.0
+
+    def _request_offers(self, from_code: str, to_code: str, date_str: str) -> tuple[list[FlightLeg], bool]:
+        """Restituisce (segmenti, fallita); fallita solo per errori di rete, 429 oltre i retry e 5xx."""
+        if not self.token:
+            print("Duffel API non configurata. Manca DUFFEL_ACCESS_TOKEN.")
+            return [], False
 
+        url, payload, headers = self._offer_request(from_code, to_code, date_str)
         max_retries = 4
         backoff_time = 2.0
 
         for attempt in range(max_retries):
             try:
-                response = requests.post(url, json=payload, headers=headers, timeout=15)
+                self.rate_limiter.acquire()
+                response = self.http.post(url, json=payload, headers=headers)
+                self.rate_limiter.update_from_headers(response.headers)
                 
                 if response.status_code == 201:
-                    data = response.json()
-                    offers = data.get("data", {}).get("offers", [])
-                    
-                    results = []
-                    for offer in offers:
-                        total_price = float(offer.get("total_amount", 0.0))
-                        for slice_item in offer.get("slices", []):
-                            segments = slice_item.get("segments", [])
-                            
-                            if len(segments) == 1:
-                                seg = segments[0]
-                                dep_dt = datetime.fromisoformat(seg.get("departing_at", "").replace("Z", ""))
-                                arr_dt = datetime.fromisoformat(seg.get("arriving_at", "").replace("Z", ""))
-                                
-                                results.append(
-                                    FlightLeg(
-                                        from_code=seg.get("origin", {}).get("iata_code", ""),
-                                        to_code=seg.get("destination", {}).get("iata_code", ""),
-                                        from_city=_get_place_name(seg.get("origin")),
-                                        to_city=_get_place_name(seg.get("destination")),
-                                        departure=dep_dt,
-                                        arrival=arr_dt,
-                                        price=total_price,
-                                        carrier=seg.get("operating_carrier", {}).get("name", "Unknown"),
-                                        flight_number=f"{seg.get('operating_carrier', {}).get('iata_code', 'ZZ')}{seg.get('flight_number', '999')}"
-                                    )
-                                )
-                                
-                            elif len(segments) == 2:
-                                seg1 = segments[0]
-                                seg2 = segments[1]
-                                
-                                dep_dt1 = datetime.fromisoformat(seg1.get("departing_at", "").replace("Z", ""))
-                                arr_dt1 = datetime.fromisoformat(seg1.get("arriving_at", "").replace("Z", ""))
-                                dep_dt2 = datetime.fromisoformat(seg2.get("departing_at", "").replace("Z", ""))
-                                arr_dt2 = datetime.fromisoformat(seg2.get("arriving_at", "").replace("Z", ""))
-                                
-                                dur1 = (arr_dt1 - dep_dt1).total_seconds()
-                                dur2 = (arr_dt2 - dep_dt2).total_seconds()
-                                total_dur = dur1 + dur2
-                                
-                                if total_dur > 0:
-                                    price1 = total_price * (dur1 / total_dur)
-                                    price2 = total_price * (dur2 / total_dur)
-                                else:
-                                    price1 = total_price / 2.0
-                                    price2 = total_price / 2.0
-                                    
-                                results.append(
-                                    FlightLeg(
-                                        from_code=seg1.get("origin", {}).get("iata_code", ""),
-                                        to_code=seg1.get("destination", {}).get("iata_code", ""),
-                                        from_city=_get_place_name(seg1.get("origin")),
-                                        to_city=_get_place_name(seg1.get("destination")),
-                                        departure=dep_dt1,
-                                        arrival=arr_dt1,
-                                        price=price1,
-                                        carrier=seg1.get("operating_carrier", {}).get("name", "Unknown"),
-                                        flight_number=f"{seg1.get('operating_carrier', {}).get('iata_code', 'ZZ')}{seg1.get('flight_number', '999')}"
-                                    )
-                                )
-                                
-                                results.append(
-                                    FlightLeg(
-                                        from_code=seg2.get("origin", {}).get("iata_code", ""),
-                                        to_code=seg2.get("destination", {}).get("iata_code", ""),
-                                        from_city=_get_place_name(seg2.get("origin")),
-                                        to_city=_get_place_name(seg2.get("destination")),
-                                        departure=dep_dt2,
-                                        arrival=arr_dt2,
-                                        price=price2,
-                                        carrier=seg2.get("operating_carrier", {}).get("name", "Unknown"),
-                                        flight_number=f"{seg2.get('operating_carrier', {}).get('iata_code', 'ZZ')}{seg2.get('flight_number', '999')}"
-                                    )
-                                )
-                    return results
+                    return self._decompose_offers(response.json()), False
 
                 elif response.status_code == 429:
-                    reset_after = response.headers.get("ratelimit-reset")
-                    wait_time = float(reset_after) if reset_after else backoff_time
-                    print(f"[Duffel Rate Limit 429] Rilevato per la data {date_str}. Tentativo {attempt + 1}/{max_retries}. Attesa di {wait_time:.1f} secondi prima del retry...")
-                    time.sleep(wait_time)
-                    backoff_time *= 2.0
+                    backoff_time = self._pause_after_429(response, backoff_time, date_str, attempt, max_retries)
                     continue
                 
                 else:
                     print(f"Duffel API Error (Status {response.status_code}) per la data {date_str}: {response.text}")
-                    return []
+                    # Una richiesta rifiutata (400, 422) non rende parziale la ricerca
+                    return [], response.status_code >= 500
 
             except Exception as e:
                 print(f"Errore di connessione a Duffel per la data {date_str} (Tentativo {attempt + 1}/{max_retries}): {e}")
                 if attempt == max_retries - 1:
-                    return []
+                    return [], True
                 time.sleep(backoff_time)
                 backoff_time *= 2.0
 
-        return []
+        return [], True
+
+    async def _arequest_offers(self, from_code: str, to_code: str, date_str: str) -> tuple[list[FlightLeg], bool]:
+        """Come _request_offers, ma con httpx e attese non bloccanti sull'event loop."""
+        if not self.token:
+            print("Duffel API non configurata. Manca DUFFEL_ACCESS_TOKEN.")
+            return [], False
+
+        url, payload, headers = self._offer_request(from_code, to_code, date_str)
+        http = self.http.async_client()
+        max_retries = 4
+        backoff_time = 2.0
+
+        with span("duffel.offers", route=f"{from_code}-{to_code}", date=date_str):
+            for attempt in range(max_retries):
+                try:
+                    with span("duffel.rate_limit_wait"):
+                        await self.rate_limiter.aacquire()
+                    response = await http.post(url, json=payload, headers=headers)
+                    self.rate_limiter.update_from_headers(response.headers)
+
+                    if response.status_code == 201:
+                        with span("duffel.decompose"):
+                            return self._decompose_offers(response.json()), False
+
+                    elif response.status_code == 429:
+                        backoff_time = self._pause_after_429(response, backoff_time, date_str, attempt, max_retries)
+                        continue
+
+                    else:
+                        print(f"Duffel API Error (Status {response.status_code}) per la data {date_str}: {response.text}")
+                        return [], response.status_code >= 500
+
+                except Exception as e:
+                    print(f"Errore di connessione a Duffel per la data {date_str} (Tentativo {attempt + 1}/{max_retries}): {e}")
+                    if attempt == max_retries - 1:
+                        return [], True
+                    await asyncio.sleep(backoff_time)
+                    backoff_time *= 2.0
+
+            return [], True
@@ -1,16 +1,34 @@
-import requests
+import asyncio
+import weakref
 import urllib3
 from datetime import datetime
 from api.models import FlightLeg
-from api.providers.base import FlightProvider
+from api.providers.base import FlightProvider, AsyncFlightProvider
+from api.cache import SQLiteCache, ROUTES_TTL, FARES_TTL
+from api.airport_catalog import get_airport_catalog
+from api.http_client import HttpClient, get_http_client
+from api.singleflight import SingleFlight
+from api.metrics import CACHE_ENTRIES, record_cache_lookup, track_singleflight
+from api.tracing import span
 
 # Disable warnings for unverified HTTPS requests
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Richieste identiche concorrenti (anche da ricerche diverse) condividono una sola chiamata upstream
+_routes_calls = SingleFlight()
+_fares_calls = SingleFlight()
+track_singleflight("ryanair_routes", _routes_calls)
+track_singleflight("ryanair_fares", _fares_calls)
+
+# Istanze vive, per esporre la dimensione dei cache in memoria nelle metriche
+_live_providers = weakref.WeakSet()
+CACHE_ENTRIES.set_function(lambda: sum(len(p._destinations_cache) for p in list(_live_providers)), cache="ryanair_destinations")
+CACHE_ENTRIES.set_function(lambda: sum(len(p._flights_cache) for p in list(_live_providers)), cache="ryanair_flights")
+
 def get_airports():
     url = "https://www.ryanair.com/api/views/locate/3/airports/en/active"
     try:
-        response = requests.get(url, verify=False, timeout=15)
+        response = get_http_client("ryanair").get(url)
         if response.status_code == 200:
             return response.json()
     except Exception:
@@ -25,71 +43,210 @@ def parse_datetime(date_str):
             continue
     raise ValueError(f"Formato data non riconosciuto: {date_str}")
 
-class RyanairProvider(FlightProvider):
-    def __init__(self):
-        self._airport_lookup = None
+class RyanairProvider(FlightProvider, AsyncFlightProvider):
+    def __init__(self, max_concurrency: int = 8, cache: SQLiteCache = None,
+                 routes_ttl: float = ROUTES_TTL, fares_ttl: float = FARES_TTL, http: HttpClient = None):
+        # Sessione HTTP keep-alive condivisa (iniettabile per configurazioni dedicate)
+        self.http = http or get_http_client("ryanair")
+        # Numero massimo di chiamate get_flights parallele pianificate dal router
+        self.max_concurrency = max_concurrency
+        # Cache persistente opzionale (read-through / write-behind) condivisa tra richieste
+        self.cache = cache
+        self.routes_ttl = routes_ttl
+        self.fares_ttl = fares_ttl
+        self._airport_lookup = None  # override opzionale del catalogo condiviso
         self._destinations_cache: dict[str, list[str]] = {}
         self._flights_cache: dict[tuple, list[FlightLeg]] = {}
+        # Chiamate upstream fallite (errori di rete, 429, 5xx): i risultati della ricerca sono parziali
+        self.failed_requests = 0
+        _live_providers.add(self)
 
     @property
     def airport_lookup(self) -> dict[str, str]:
-        if self._airport_lookup is None:
+        if self._airport_lookup is not None:
+            return self._airport_lookup
+        # Catalogo di processo: scaricato una volta e condiviso da tutte le istanze
+        return get_airport_catalog().city_lookup()
+
+    def _memory_destinations(self, airport_code: str) -> list[str] | None:
+        hit = airport_code in self._destinations_cache
+        record_cache_lookup("ryanair_destinations", hit)
+        return self._destinations_cache[airport_code] if hit else None
+
+    def _stored_destinations(self, airport_code: str) -> list[str] | None:
+        """Lettura dal cache persistente (SQLite): nei metodi asincroni gira in un thread."""
+        if self.cache is None:
+            return None
+        cached = self.cache.get("routes", airport_code)
+        if cached is not None:
+            self._destinations_cache[airport_code] = cached
+        return cached
+
+    def _cached_destinations(self, airport_code: str) -> list[str] | None:
+        cached = self._memory_destinations(airport_code)
+        if cached is None:
+            cached = self._stored_destinations(airport_code)
+        return cached
+
+    async def _acached_destinations(self, airport_code: str) -> list[str] | None:
+        cached = self._memory_destinations(airport_code)
+        if cached is None and self.cache is not None:
+            cached = await asyncio.to_thread(self._stored_destinations, airport_code)
+        return cached
+
+    @staticmethod
+    def _is_failure(response) -> bool:
+        return response is None or response.status_code == 429 or response.status_code >= 500
+
+    def _store_destinations(self, airport_code: str, response) -> tuple[list[str], bool]:
+        """Restituisce (destinazioni, fallita): il flag viaggia col risultato condiviso dal SingleFlight."""
+        if response is not None and response.status_code == 200:
+            result = [route["arrivalAirport"]["code"] for route in response.json()]
+            self._destinations_cache[airport_code] = result
+            if self.cache is not None:
+                self.cache.set("routes", airport_code, result, self.routes_ttl)
+            return result, False
+        self._destinations_cache[airport_code] = []
+        return [], self._is_failure(response)
+
+    def _memory_flights(self, key: tuple) -> list[FlightLeg] | None:
+        hit = key in self._flights_cache
+        record_cache_lookup("ryanair_flights", hit)
+        return self._flights_cache[key] if hit else None
+
+    def _stored_flights(self, key: tuple) -> list[FlightLeg] | None:
+        """Tariffe dal cache persistente (SQLite): nei metodi asincroni gira in un thread."""
+        if self.cache is None:
+            return None
+        cached = self.cache.get("fares", "|".join(key))
+        if cached is None:
+            return None
+        results = [FlightLeg.from_row(row) for row in cached]
+        self._flights_cache[key] = results
+        return results
+
+    def _cached_flights(self, key: tuple) -> list[FlightLeg] | None:
+        cached = self._memory_flights(key)
+        if cached is None:
+            cached = self._stored_flights(key)
+        return cached
+
+    async def _acached_flights(self, key: tuple) -> list[FlightLeg] | None:
+        cached = self._memory_flights(key)
+        if cached is None and self.cache is not None:
+            cached = await asyncio.to_thread(self._stored_flights, key)
+        return cached
+
+    def _store_flights(self, key: tuple, response) -> tuple[list[FlightLeg], bool]:
+        if response is None or response.status_code != 200:
+            self._flights_cache[key] = []
+            return [], self._is_failure(response)
+        from_code, to_code, _ = key
+        airport_lookup = self.airport_lookup
+        flights = response.json().get("outbound", {}).get("fares", [])
+        results = []
+        for f in flights:
+            if f.get("unavailable", False):
+                continue
+            price_val = f["price"]["value"] if f.get("price") else 0.0
+            flight_num = f.get("flightNumber", f"FR{price_val*100:.0f}" if price_val else "FR999")
+            results.append(
+                FlightLeg(
+                    from_code=from_code,
+                    to_code=to_code,
+                    from_city=airport_lookup.get(from_code, from_code),
+                    to_city=airport_lookup.get(to_code, to_code),
+                    departure=parse_datetime(f["departureDate"]),
+                    arrival=parse_datetime(f["arrivalDate"]),
+                    price=float(price_val),
+                    carrier="Ryanair",
+                    flight_number=flight_num
+                )
+            )
+        self._flights_cache[key] = results
+        if self.cache is not None:
+            self.cache.set("fares", "|".join(key), [leg.to_row() for leg in results], self.fares_ttl)
+        return results, False
+
+    @staticmethod
+    def _destinations_url(airport_code: str) -> str:
+        return f"https://www.ryanair.com/api/views/locate/searchWidget/routes/en/airport/{airport_code}"
+
+    @staticmethod
+    def _fares_url(from_code: str, to_code: str, date_str: str) -> str:
+        return f"https://www.ryanair.com/api/farfnd/v4/oneWayFares/{from_code}/{to_code}/cheapestPerDay?outboundMonthOfDate={date_str}&currency=EUR"
+
+    def _download_destinations(self, airport_code: str) -> tuple[list[str], bool]:
+        try:
+            return self._store_destinations(airport_code, self.http.get(self._destinations_url(airport_code)))
+        except Exception:
+            return self._store_destinations(airport_code, None)
+
+    def _download_flights(self, key: tuple) -> tuple[list[FlightLeg], bool]:
+        try:
+            return self._store_flights(key, self.http.get(self._fares_url(*key)))
+        except Exception:
+            return self._store_flights(key, None)
+
+    async def _adownload_destinations(self, airport_code: str) -> tuple[list[str], bool]:
+        with span("ryanair.routes", airport=airport_code):
             try:
-                airports = get_airports()
-                self._airport_lookup = {
-                    a["iataCode"]: a.get("city", {}).get("name", a["name"])
-                    for a in airports if "iataCode" in a
-                }
+                response = await self.http.async_client().get(self._destinations_url(airport_code))
+                return self._store_destinations(airport_code, response)
             except Exception:
-                self._airport_lookup = {}
-        return self._airport_lookup
+                return self._store_destinations(airport_code, None)
+
+    async def _adownload_flights(self, key: tuple) -> tuple[list[FlightLeg], bool]:
+        with span("ryanair.fares", route=f"{key[0]}-{key[1]}", month=key[2]):
+            try:
+                response = await self.http.async_client().get(self._fares_url(*key))
+                if response.status_code == 200 and self._airport_lookup is None:
+                    # Il primo caricamento del catalogo è un download sincrono: fuori dall'event loop
+                    await asyncio.to_thread(get_airport_catalog().ensure_loaded)
+                return self._store_flights(key, response)
+            except Exception:
+                return self._store_flights(key, None)
 
     def get_destinations(self, airport_code: str) -> list[str]:
-        if airport_code in self._destinations_cache:
-            return self._destinations_cache[airport_code]
-        url = f"https://www.ryanair.com/api/views/locate/searchWidget/routes/en/airport/{airport_code}"
-        try:
-            response = requests.get(url, verify=False, timeout=15)
-            if response.status_code == 200:
-                result = [route["arrivalAirport"]["code"] for route in response.json()]
-                self._destinations_cache[airport_code] = result
-                return result
-        except Exception:
-            pass
-        self._destinations_cache[airport_code] = []
-        return []
+        cached = self._cached_destinations(airport_code)
+        if cached is not None:
+            return cached
+        result, failed = _routes_calls.do(airport_code, lambda: self._download_destinations(airport_code))
+        # Chi ha atteso la chiamata di un'altra istanza memorizza comunque il risultato e l'eventuale errore
+        self._destinations_cache[airport_code] = result
+        self.failed_requests += failed
+        return result
 
     def get_flights(self, from_code: str, to_code: str, date_str: str) -> list[FlightLeg]:
         key = (from_code, to_code, date_str)
-        if key in self._flights_cache:
-            return self._flights_cache[key]
-        url = f"https://www.ryanair.com/api/farfnd/v4/oneWayFares/{from_code}/{to_code}/cheapestPerDay?outboundMonthOfDate={date_str}&currency=EUR"
-        try:
-            response = requests.get(url, verify=False, timeout=15)
-            if response.status_code == 200:
-                flights = response.json().get("outbound", {}).get("fares", [])
-                results = []
-                for f in flights:
-                    if f.get("unavailable", False):
-                        continue
-                    price_val = f["price"]["value"] if f.get("price") else 0.0
-                    flight_num = f.get("flightNumber", f"FR{price_val*100:.0f}" if price_val else "FR999")
-                    results.append(
-                        FlightLeg(
-                            from_code=from_code,
-                            to_code=to_code,
-                            from_city=self.airport_lookup.get(from_code, from_code),
-                            to_city=self.airport_lookup.get(to_code, to_code),
-                            departure=parse_datetime(f["departureDate"]),
-                            arrival=parse_datetime(f["arrivalDate"]),
-                            price=float(price_val),
-                            carrier="Ryanair",
-                            flight_number=flight_num
-                        )
-                    )
-                self._flights_cache[key] = results
-                return results
-        except Exception:
-            pass
-        self._flights_cache[key] = []
-        return []
+        cached = self._cached_flights(key)
+        if cached is not None:
+            return cached
+        results, failed = _fares_calls.do(key, lambda: self._download_flights(key))
+        self._flights_cache[key] = results
+        self.failed_requests += failed
+        return results
+
+    async def aget_destinations(self, airport_code: str) -> list[str]:
+        cached = await self._acached_destinations(airport_code)
+        if cached is not None:
+            return cached
+        result, failed = await _routes_calls.ado(airport_code, lambda: self._adownload_destinations(airport_code))
+        self._destinations_cache[airport_code] = result
+        self.failed_requests += failed
+        return result
+
+    async def aget_flights(self, from_code: str, to_code: str, date_str: str) -> list[FlightLeg]:
+        key = (from_code, to_code, date_str)
+        cached = await self._acached_flights(key)
+        if cached is not None:
+            return cached
+        results, failed = await _fares_calls.ado(key, lambda: self._adownload_flights(key))
+        self._flights_cache[key] = results
+        self.failed_requests += failed
+        return results
+
+    def iter_cached_legs(self):
+        """Itera su tutti i segmenti già presenti nel cache voli, senza HTTP."""
+        for legs in self._flights_cache.values():
+            yield from legs
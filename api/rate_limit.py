@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# Rate minimo (richieste/s) anche con quota esaurita: evita attese infinite se gli header mancano
+MIN_RATE = 0.05
+
+def _header_float(headers, name: str) -> float | None:
+    value = headers.get(name)
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+def reset_seconds(value) -> float | None:
+    """
+    Secondi mancanti al reset della finestra dall'header `ratelimit-reset`, che può essere
+    un numero di secondi, un timestamp epoch o una data HTTP.
+    """
+    if value is None or not isinstance(value, (str, int, float)):
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+    if seconds > 1e9:  # timestamp epoch
+        return max(0.0, seconds - time.time())
+    return max(0.0, seconds)
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket condiviso tra tutte le ricerche del processo verso lo stesso upstream.
+
+    Parte da `rate` richieste/s con burst `capacity`, poi si adatta agli header
+    `ratelimit-limit`/`ratelimit-remaining`/`ratelimit-reset` di ogni risposta: la quota
+    residua viene distribuita sul tempo mancante al reset, così la velocità sale fino a
+    quella realmente concessa e un 429 resta l'eccezione. Su 429 il bucket viene svuotato
+    e tutte le richieste attendono la fine della finestra.
+
+    I token si prenotano in ordine di arrivo: acquire() attende nel thread chiamante,
+    aacquire() sull'event loop senza bloccarlo.
+    """
+
+    def __init__(self, rate: float = 2.0, capacity: float = 5.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()  # nel futuro durante una pausa dopo un 429
+        self._pauses = 0  # pause ricevute: invalidano le prenotazioni ancora in attesa
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def _book(self) -> tuple[float, int]:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = max(0.0, self._updated - now)
+            if self._tokens < 0:
+                wait += -self._tokens / self.rate
+            return wait, self._pauses
+
+    def _reserve(self) -> float:
+        """Prenota un token e restituisce i secondi da attendere prima di usarlo."""
+        return self._book()[0]
+
+    def acquire(self):
+        while True:
+            wait, pauses = self._book()
+            if wait > 0:
+                time.sleep(wait)
+            # Una pausa arrivata durante l'attesa annulla la prenotazione: si riprenota dopo il 429
+            if pauses == self._pauses:
+                return
+
+    async def aacquire(self):
+        while True:
+            wait, pauses = self._book()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if pauses == self._pauses:
+                return
+
+    def update_from_headers(self, headers):
+        """Allinea bucket e velocità alla quota comunicata dall'upstream."""
+        limit = _header_float(headers, "ratelimit-limit")
+        remaining = _header_float(headers, "ratelimit-remaining")
+        reset_in = reset_seconds(headers.get("ratelimit-reset"))
+        with self._lock:
+            self._refill(time.monotonic())
+            if limit:
+                self.capacity = max(1.0, limit)
+            if remaining is not None:
+                # Il contatore del server è autorevole: include le richieste di altri processi
+                self._tokens = min(self._tokens, remaining)
+                if reset_in:
+                    self.rate = max(MIN_RATE, max(remaining, 1.0) / reset_in)
+
+    def pause(self, seconds: float):
+        """
+        Dopo un 429: nessun nuovo token per `seconds`, poi riparte una richiesta alla volta.
+        Le prenotazioni in attesa vengono annullate e rifatte al risveglio, dietro la pausa.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Il debito delle prenotazioni annullate non pesa sulla ripartenza
+            self._tokens = min(max(self._tokens, 0.0), 1.0)
+            self._updated = max(self._updated, now + seconds)
+            self._pauses += 1
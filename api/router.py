@@ -1,8 +1,516 @@
-from itertools import product
-from datetime import datetime
+import asyncio
+import heapq
+import os
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+import numpy as np
 from api.models import FlightLeg, Connection
+from api.leg_table import LegTable, join_layovers
 from api.providers.base import FlightProvider
 from api.city_groups import expand_airport
+from api.metrics import ROUTER_VIA_CANDIDATES, ROUTER_LEGS_JOINED, ROUTER_CONNECTIONS, ROUTER_JOIN_DURATION
+from api.tracing import span
+
+# Coppie di scali intermedi (A → B) per cui la ricerca a 2 scali scarica la tratta centrale,
+# scelte in ordine di prezzo minimo possibile: limita le chiamate upstream per ricerca
+TWO_STOP_MAX_PAIRS = int(os.getenv("TWO_STOP_MAX_PAIRS", 60))
+
+class _TopK:
+    """
+    Raccoglie le connessioni trovate. Senza limite è una semplice lista; con limit
+    mantiene un max-heap dei k prezzi più bassi, così bound() permette al router di
+    scartare in anticipo tratte e interi scali che non possono entrare nel risultato.
+    """
+
+    def __init__(self, limit: int = None):
+        self.limit = limit
+        self._items = []
+        self._seq = 0
+
+    def bound(self) -> float:
+        """Prezzo da battere per entrare nel risultato (inf finché il heap non è pieno)."""
+        if self.limit is None or len(self._items) < self.limit:
+            return float("inf")
+        return -self._items[0][0]
+
+    def add(self, conn: Connection):
+        if self.limit is None:
+            self._items.append(conn)
+            return
+        self._seq += 1
+        entry = (-conn.total_price, -self._seq, conn)
+        if len(self._items) < self.limit:
+            heapq.heappush(self._items, entry)
+        elif conn.total_price < self.bound():
+            heapq.heapreplace(self._items, entry)
+
+    def results(self) -> list[Connection]:
+        """Connessioni ordinate per prezzo (a parità, in ordine di inserimento)."""
+        if self.limit is None:
+            return sorted(self._items, key=lambda c: c.total_price)
+        return [conn for _, _, conn in sorted(self._items, key=lambda e: (-e[0], -e[1]))]
+
+def _pareto_indices(points: list[tuple]) -> list[int]:
+    """
+    Indici dei punti (prezzo, durata, scalo) non dominati, in O(n log n).
+    Ordina per prezzo e mantiene una "scala" dei minimi (durata crescente, scalo decrescente)
+    già accettati: un punto è dominato se un punto della scala ha durata e scalo non peggiori.
+    I punti identici non si dominano a vicenda e vengono tutti conservati.
+    """
+    order = sorted(range(len(points)), key=lambda i: points[i])
+    stair_durations, stair_layovers = [], []
+    kept = []
+    previous = None
+    for i in order:
+        _, duration, layover = points[i]
+        if points[i] == previous:
+            kept.append(i)
+            continue
+        pos = bisect_right(stair_durations, duration)
+        if pos and stair_layovers[pos - 1] <= layover:
+            continue
+        kept.append(i)
+        previous = points[i]
+        start = bisect_left(stair_durations, duration)
+        end = pos
+        while end < len(stair_layovers) and stair_layovers[end] >= layover:
+            end += 1
+        stair_durations[start:end] = [duration]
+        stair_layovers[start:end] = [layover]
+    kept.sort()
+    return kept
+
+def pareto_front(connections: list[Connection]) -> list[Connection]:
+    """Connessioni non dominate su (prezzo totale, durata totale, scalo), nell'ordine originale."""
+    points = [(c.total_price, c.total_duration_h, c.layover_h) for c in connections]
+    return [connections[i] for i in _pareto_indices(points)]
+
+class _ParetoFront:
+    """Raccoglitore in modalità Pareto: stessa interfaccia di _TopK, niente pruning per prezzo."""
+
+    def __init__(self, limit: int = None):
+        self.limit = limit
+        self._items = []
+
+    def bound(self) -> float:
+        return float("inf")
+
+    def add(self, conn: Connection):
+        self._items.append(conn)
+
+    def results(self) -> list[Connection]:
+        front = sorted(pareto_front(self._items), key=lambda c: c.total_price)
+        return front if self.limit is None else front[:self.limit]
+
+def _fetch_all(providers_with_dates: list[tuple], routes: list[tuple]) -> dict:
+    """
+    Pianifica ed esegue in anticipo tutte le chiamate get_flights necessarie al join.
+    Le richieste (provider, from, to, date) vengono deduplicate ed eseguite su un thread
+    pool per provider, limitato da `provider.max_concurrency` (default 1 = sequenziale).
+    Restituisce {(indice_provider, from, to, date): [FlightLeg, ...]}.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    fetched = {}
+    executors = []
+    futures = {}
+    try:
+        for idx, (provider, dates) in enumerate(providers_with_dates):
+            tasks = list(dict.fromkeys(
+                (from_code, to_code, date)
+                for from_code, to_code in routes
+                for date in dates
+            ))
+            workers = max(1, min(getattr(provider, "max_concurrency", 1), len(tasks)))
+            if workers == 1:
+                for from_code, to_code, date in tasks:
+                    fetched[(idx, from_code, to_code, date)] = provider.get_flights(from_code, to_code, date)
+                continue
+            executor = ThreadPoolExecutor(max_workers=workers)
+            executors.append(executor)
+            for from_code, to_code, date in tasks:
+                future = executor.submit(provider.get_flights, from_code, to_code, date)
+                futures[future] = (idx, from_code, to_code, date)
+        for future, key in futures.items():
+            fetched[key] = future.result()
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=True)
+    return fetched
+
+def _leg_key(f: FlightLeg) -> tuple:
+    return (f.from_code, f.to_code, f.departure, f.arrival, f.flight_number)
+
+def _pareto_labels(labels: list[tuple]) -> list[tuple]:
+    """
+    Dominanza prezzo/orario: tra i percorsi parziali che terminano sullo stesso segmento
+    (stesso orario di arrivo) sopravvive solo chi è più economico o parte più tardi.
+    labels: [(prezzo_cumulato, partenza_origine, percorso), ...]
+    """
+    labels.sort(key=lambda l: (l[0], -l[1].timestamp()))
+    front = []
+    latest_departure = None
+    for label in labels:
+        if latest_departure is None or label[1] > latest_departure:
+            front.append(label)
+            latest_departure = label[1]
+    return front
+
+def _extend_labels(segments: list[FlightLeg], labels_by_airport: dict, max_layover: timedelta) -> list[tuple]:
+    """
+    Un passo del label-setting sul grafo time-expanded: per ogni segmento raccoglie le
+    etichette arrivate al suo aeroporto di partenza nella finestra [partenza - max, partenza)
+    e conserva solo il fronte non dominato.
+    labels_by_airport: aeroporto → (arrivi ordinati, etichette allineate agli arrivi)
+    """
+    extended = []
+    for seg in segments:
+        bucket = labels_by_airport.get(seg.from_code)
+        if not bucket:
+            continue
+        arrivals, labels = bucket
+        lo = bisect_left(arrivals, seg.departure - max_layover)
+        hi = bisect_left(arrivals, seg.departure, lo)
+        if lo == hi:
+            continue
+        candidates = [
+            (price + seg.price, origin_dep, path + (seg,))
+            for price, origin_dep, path in labels[lo:hi]
+        ]
+        for label in _pareto_labels(candidates):
+            extended.append((seg, label))
+    return extended
+
+def _index_labels(labels: list[tuple]) -> dict:
+    """Raggruppa [(segmento, etichetta)] per aeroporto di arrivo, ordinati per orario di arrivo."""
+    grouped = {}
+    for seg, label in sorted(labels, key=lambda x: x[0].arrival):
+        arrivals, bucket = grouped.setdefault(seg.to_code, ([], []))
+        arrivals.append(seg.arrival)
+        bucket.append(label)
+    return grouped
+
+def _lookup_each(providers_with_dates: list[tuple], airports: list[str]) -> dict:
+    """
+    Destinazioni di ogni aeroporto per ogni provider, su un thread pool per provider
+    limitato da `provider.max_concurrency`. Restituisce {(indice_provider, aeroporto): set}.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    result = {}
+    for idx, (provider, _) in enumerate(providers_with_dates):
+        workers = max(1, min(getattr(provider, "max_concurrency", 1), len(airports)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for apt, codes in zip(airports, executor.map(provider.get_destinations, airports)):
+                result[(idx, apt)] = set(codes)
+    return result
+
+async def _alookup_each(providers_with_dates: list[tuple], airports: list[str]) -> dict:
+    """Variante asincrona di _lookup_each, limitata per provider da un semaforo."""
+    keys = []
+    calls = []
+    for idx, (provider, _) in enumerate(providers_with_dates):
+        semaphore = asyncio.Semaphore(max(1, getattr(provider, "max_concurrency", 1)))
+
+        async def lookup(provider, semaphore, apt):
+            async with semaphore:
+                return set(await _acall(provider, "get_destinations", apt))
+
+        for apt in airports:
+            keys.append((idx, apt))
+            calls.append(lookup(provider, semaphore, apt))
+    return dict(zip(keys, await asyncio.gather(*calls)))
+
+def _two_stop_vias(start_expanded: list[str], end_expanded: list[str],
+                   reachable_from_start: set, reachable_to_end: set) -> tuple[list[str], list[str]]:
+    endpoints = set(start_expanded) | set(end_expanded)
+    return sorted(reachable_from_start - endpoints), sorted(reachable_to_end - endpoints)
+
+def _two_stop_outer_routes(start_expanded: list[str], end_expanded: list[str],
+                           first_vias: list[str], last_vias: list[str]) -> list[tuple]:
+    """Tratte esterne della ricerca a 2 scali: start → A e B → end."""
+    routes = [(s, via) for via in first_vias for s in start_expanded]
+    return routes + [(via, e) for via in last_vias for e in end_expanded]
+
+def _two_stop_middle_routes(
+    providers_with_dates: list[tuple],
+    outer: dict,
+    destinations: dict,
+    start_expanded: list[str],
+    end_expanded: list[str],
+    in_range,
+    max_pairs: int,
+) -> list[list[tuple]]:
+    """
+    Tratte centrali A → B da scaricare, per provider. Solo scali con segmenti esterni
+    effettivi, ordinati per prezzo minimo del primo + ultimo segmento: le prime
+    `max_pairs` coppie per provider (le più promettenti) vengono scaricate.
+    """
+    start_set, end_set = set(start_expanded), set(end_expanded)
+    first_price = {}
+    last_price = {}
+    for (_, from_code, to_code, _), flights in outer.items():
+        for f in flights:
+            if from_code in start_set and to_code not in end_set:
+                if in_range(f.departure):
+                    first_price[to_code] = min(first_price.get(to_code, float("inf")), f.price)
+            elif to_code in end_set and from_code not in start_set:
+                last_price[from_code] = min(last_price.get(from_code, float("inf")), f.price)
+    routes = []
+    for idx in range(len(providers_with_dates)):
+        pairs = sorted(
+            (first_price[via_a] + last_price[via_b], via_a, via_b)
+            for via_a in first_price
+            for via_b in destinations.get((idx, via_a), ())
+            if via_b != via_a and via_b in last_price
+        )
+        routes.append([(via_a, via_b) for _, via_a, via_b in pairs[:max_pairs]])
+    return routes
+
+def _join_two_stop(
+    pool,
+    start_expanded: list[str],
+    end_expanded: list[str],
+    max_layover_h: float,
+    in_range,
+) -> list[Connection]:
+    """
+    Itinerari con 2 scali (start → A → B → end) tramite label-setting sui segmenti dati,
+    senza chiamate ai provider.
+    """
+    endpoints = set(start_expanded) | set(end_expanded)
+    seen = set()
+    first_segments, middle_segments, last_segments = [], [], []
+    for f in pool:
+        key = _leg_key(f)
+        if key in seen:
+            continue
+        seen.add(key)
+        from_endpoint = f.from_code in endpoints
+        to_endpoint = f.to_code in endpoints
+        if f.from_code in start_expanded and not to_endpoint:
+            if in_range(f.departure):
+                first_segments.append(f)
+        elif f.to_code in end_expanded and not from_endpoint:
+            last_segments.append(f)
+        elif not from_endpoint and not to_endpoint and f.from_code != f.to_code:
+            middle_segments.append(f)
+
+    max_layover = timedelta(hours=max_layover_h)
+    first_labels = _index_labels([(f, (f.price, f.departure, (f,))) for f in first_segments])
+    middle_labels = _index_labels(_extend_labels(middle_segments, first_labels, max_layover))
+    final_labels = _extend_labels(last_segments, middle_labels, max_layover)
+
+    connections = []
+    for _, (price, _, path) in final_labels:
+        f1, f2, f3 = path
+        layover_time = ((f2.departure - f1.arrival) + (f3.departure - f2.arrival)).total_seconds() / 3600
+        total_duration = (f3.arrival - f1.departure).total_seconds() / 3600
+        connections.append(
+            Connection(
+                connection_label=f"{f1.from_code}-{f1.to_code} | {f2.from_code}-{f2.to_code} | {f3.from_code}-{f3.to_code}",
+                first_leg=f1,
+                second_leg=f2,
+                layover_h=round(layover_time, 1),
+                total_duration_h=round(total_duration, 1),
+                total_price=price,
+                extra_legs=(f3,),
+            )
+        )
+    ROUTER_CONNECTIONS.inc(len(connections), kind="two_stop")
+    return connections
+
+def _two_stop_pool(providers_with_dates: list[tuple], fetched: list[dict]) -> list[FlightLeg]:
+    """Segmenti scaricati più quelli già presenti nei cache dei provider (es. decomposti da Duffel)."""
+    pool = [leg for batch in fetched for flights in batch.values() for leg in flights]
+    for provider, _ in providers_with_dates:
+        iter_cached_legs = getattr(provider, "iter_cached_legs", None)
+        if iter_cached_legs:
+            pool.extend(iter_cached_legs())
+    return pool
+
+def _find_two_stop_connections(
+    providers_with_dates: list[tuple],
+    start_expanded: list[str],
+    end_expanded: list[str],
+    reachable_from_start: set,
+    reachable_to_end: set,
+    max_layover_h: float,
+    in_range,
+    max_pairs: int = None,
+) -> list[Connection]:
+    """
+    Ricerca a 2 scali. Le tratte sono pianificate e deduplicate prima del join, come per
+    1 scalo: prima i segmenti esterni (start → A, B → end), poi le destinazioni degli scali
+    A e infine le sole tratte centrali A → B più promettenti (al massimo `max_pairs` per
+    provider, TWO_STOP_MAX_PAIRS). Ogni fase gira sul pool limitato del provider.
+    """
+    max_pairs = TWO_STOP_MAX_PAIRS if max_pairs is None else max_pairs
+    first_vias, last_vias = _two_stop_vias(start_expanded, end_expanded, reachable_from_start, reachable_to_end)
+    outer = _fetch_all(providers_with_dates, _two_stop_outer_routes(start_expanded, end_expanded, first_vias, last_vias))
+    destinations = _lookup_each(providers_with_dates, first_vias)
+    middle_routes = _two_stop_middle_routes(
+        providers_with_dates, outer, destinations, start_expanded, end_expanded, in_range, max_pairs,
+    )
+    middle = [
+        _fetch_all([provider_with_dates], routes)
+        for provider_with_dates, routes in zip(providers_with_dates, middle_routes) if routes
+    ]
+    pool = _two_stop_pool(providers_with_dates, [outer, *middle])
+    return _join_two_stop(pool, start_expanded, end_expanded, max_layover_h, in_range)
+
+async def _afind_two_stop_connections(
+    providers_with_dates: list[tuple],
+    start_expanded: list[str],
+    end_expanded: list[str],
+    reachable_from_start: set,
+    reachable_to_end: set,
+    max_layover_h: float,
+    in_range,
+    max_pairs: int = None,
+) -> list[Connection]:
+    """Variante asincrona di _find_two_stop_connections: download sull'event loop, join in un thread."""
+    max_pairs = TWO_STOP_MAX_PAIRS if max_pairs is None else max_pairs
+    first_vias, last_vias = _two_stop_vias(start_expanded, end_expanded, reachable_from_start, reachable_to_end)
+    outer, destinations = await asyncio.gather(
+        _afetch_all(providers_with_dates, _two_stop_outer_routes(start_expanded, end_expanded, first_vias, last_vias)),
+        _alookup_each(providers_with_dates, first_vias),
+    )
+    middle_routes = _two_stop_middle_routes(
+        providers_with_dates, outer, destinations, start_expanded, end_expanded, in_range, max_pairs,
+    )
+    middle = await asyncio.gather(*(
+        _afetch_all([provider_with_dates], routes)
+        for provider_with_dates, routes in zip(providers_with_dates, middle_routes) if routes
+    ))
+    pool = _two_stop_pool(providers_with_dates, [outer, *middle])
+    return await asyncio.to_thread(_join_two_stop, pool, start_expanded, end_expanded, max_layover_h, in_range)
+
+def _date_filter(all_dates: set, filter_start: str, filter_end: str):
+    """Predicato sulle partenze: range reale richiesto dall'utente o date dei provider (`all_dates`)."""
+    if filter_start and filter_end:
+        _filter_start = datetime.strptime(filter_start, "%Y-%m-%d").date()
+        _filter_end = datetime.strptime(filter_end, "%Y-%m-%d").date()
+        def in_range(dt: datetime) -> bool:
+            return _filter_start <= dt.date() <= _filter_end
+    else:
+        def in_range(dt: datetime) -> bool:
+            return dt.strftime("%Y-%m-%d") in all_dates
+    return in_range
+
+def _via_routes(start_expanded: list[str], end_expanded: list[str], via_list: list[str]) -> list[tuple]:
+    """Tratte start → scalo e scalo → end per gli scali indicati."""
+    routes = [(s, via) for via in via_list for s in start_expanded]
+    routes += [(via, e) for via in via_list for e in end_expanded]
+    return routes
+
+def _plan_routes(start_expanded: list[str], end_expanded: list[str], via_list: list[str]) -> list[tuple]:
+    """Tratte da scaricare prima del join: dirette, start → scalo e scalo → end."""
+    routes = [(s, e) for s in start_expanded for e in end_expanded]
+    return routes + _via_routes(start_expanded, end_expanded, via_list)
+
+def _direct_connection(f: FlightLeg) -> Connection:
+    ROUTER_CONNECTIONS.inc(kind="direct")
+    duration_h = (f.arrival - f.departure).total_seconds() / 3600
+    return Connection(
+        connection_label=f"{f.from_code}-{f.to_code} (Diretto)",
+        first_leg=f,
+        second_leg=None,
+        layover_h=0.0,
+        total_duration_h=round(duration_h, 1),
+        total_price=f.price
+    )
+
+def _join_via(table: LegTable, first_rows: np.ndarray, second_rows: np.ndarray, max_layover_min: int, connections) -> list[Connection]:
+    """Join vettoriale di uno scalo: aggiunge al collector le connessioni valide e le restituisce."""
+    with ROUTER_JOIN_DURATION.time():
+        added = _select_joined(table, first_rows, second_rows, max_layover_min, connections)
+    ROUTER_LEGS_JOINED.inc(len(first_rows) + len(second_rows))
+    ROUTER_CONNECTIONS.inc(len(added), kind="one_stop")
+    return added
+
+def _select_joined(table: LegTable, first_rows: np.ndarray, second_rows: np.ndarray, max_layover_min: int, connections) -> list[Connection]:
+    i, j, price, layover, duration = join_layovers(table, first_rows, second_rows, max_layover_min)
+    layover_h = np.round(layover / 60, 1)
+    duration_h = np.round(duration / 60, 1)
+    if isinstance(connections, _ParetoFront):
+        # Fronte locale allo scalo calcolato sulle sole metriche, prima di creare le Connection
+        points = list(zip(price.tolist(), duration_h.tolist(), layover_h.tolist()))
+        selected = _pareto_indices(points)
+    elif connections.limit is not None:
+        selected = np.flatnonzero(price < connections.bound())
+        selected = selected[np.argsort(price[selected], kind="stable")]
+    else:
+        selected = range(len(i))
+    added = []
+    for k in selected:
+        if price[k] >= connections.bound():
+            break
+        f1 = table.legs[i[k]]
+        f2 = table.legs[j[k]]
+        conn = Connection(
+            connection_label=f"{f1.from_code}-{f1.to_code} | {f2.from_code}-{f2.to_code}",
+            first_leg=f1,
+            second_leg=f2,
+            layover_h=float(layover_h[k]),
+            total_duration_h=float(duration_h[k]),
+            total_price=f1.price + f2.price
+        )
+        connections.add(conn)
+        added.append(conn)
+    return added
+
+def _join_fetched(
+    providers_with_dates: list[tuple],
+    fetched: dict,
+    start_expanded: list[str],
+    end_expanded: list[str],
+    via_list: list[str],
+    in_range,
+    max_layover_h: float,
+    connections,
+):
+    """Aggiunge al collector i voli diretti e le connessioni con 1 scalo dei segmenti scaricati."""
+    # Voli diretti da tutti i provider — raccolti per primi così il bound top-k si stringe subito
+    for idx, (provider, dates) in enumerate(providers_with_dates):
+        for date in dates:
+            for start_apt in start_expanded:
+                for end_apt in end_expanded:
+                    flights = fetched[(idx, start_apt, end_apt, date)]
+                    for f in flights:
+                        if in_range(f.departure) and f.price < connections.bound():
+                            connections.add(_direct_connection(f))
+
+    # Connessioni con scalo — segmenti in tabella colonnare, join vettoriale per via_airport
+    table = LegTable()
+    via_rows = []
+    for via_airport in via_list:
+        first_rows = set()
+        second_rows = set()
+        for idx, (_, dates) in enumerate(providers_with_dates):
+            for date in dates:
+                for start_apt in start_expanded:
+                    first_rows.update(
+                        table.append(f) for f in fetched[(idx, start_apt, via_airport, date)]
+                        if in_range(f.departure)
+                    )
+                for end_apt in end_expanded:
+                    second_rows.update(table.extend(fetched[(idx, via_airport, end_apt, date)]))
+        if first_rows and second_rows:
+            via_rows.append((
+                np.fromiter(sorted(first_rows), dtype=np.int64, count=len(first_rows)),
+                np.fromiter(sorted(second_rows), dtype=np.int64, count=len(second_rows)),
+            ))
+
+    # Scali in ordine di prezzo minimo possibile: appena il minimo supera il k-esimo prezzo
+    # nessuno scalo successivo può più migliorare il risultato
+    prices = table.price
+    via_rows.sort(key=lambda v: prices[v[0]].min() + prices[v[1]].min())
+    max_layover_min = int(max_layover_h * 60)
+    for first_rows, second_rows in via_rows:
+        if prices[first_rows].min() + prices[second_rows].min() >= connections.bound():
+            break
+        _join_via(table, first_rows, second_rows, max_layover_min, connections)
 
 def find_connections(
     providers_with_dates: list[tuple],  # [(FlightProvider, list[str]), ...]
@@ -12,6 +520,9 @@ def find_connections(
     use_city_groups: bool = True,
     filter_start: str = None,
     filter_end: str = None,
+    max_stops: int = 1,
+    limit: int = None,
+    pareto: bool = False,
 ) -> list[Connection]:
     """
     Algoritmo di routing multi-provider api-agnostic.
@@ -20,16 +531,11 @@ def find_connections(
 
     providers_with_dates: lista di (provider, dates) — ogni provider usa le proprie date
     filter_start/filter_end: range reale richiesto dall'utente per filtrare i voli
+    max_stops: 0 = solo diretti, 1 = fino a 1 scalo, 2 = anche itinerari con 2 scali
+    limit: se indicato restituisce solo le `limit` connessioni più economiche
+    pareto: restituisce solo le connessioni non dominate su (prezzo, durata, scalo)
     """
-    if filter_start and filter_end:
-        _filter_start = datetime.strptime(filter_start, "%Y-%m-%d").date()
-        _filter_end = datetime.strptime(filter_end, "%Y-%m-%d").date()
-        def in_range(dt: datetime) -> bool:
-            return _filter_start <= dt.date() <= _filter_end
-    else:
-        all_dates = {d for _, dates in providers_with_dates for d in dates}
-        def in_range(dt: datetime) -> bool:
-            return dt.strftime("%Y-%m-%d") in all_dates
+    in_range = _date_filter({d for _, dates in providers_with_dates for d in dates}, filter_start, filter_end)
 
     start_expanded = expand_airport(start_airport) if use_city_groups else [start_airport]
     end_expanded = expand_airport(end_airport) if use_city_groups else [end_airport]
@@ -40,78 +546,229 @@ def find_connections(
         for provider, _ in providers_with_dates:
             reachable_from_start.update(provider.get_destinations(start_apt))
 
+    # Verso la destinazione servono gli aeroporti con voli in arrivo: lookup inverso se il provider lo offre
     reachable_to_end = set()
     for end_apt in end_expanded:
         for provider, _ in providers_with_dates:
-            reachable_to_end.update(provider.get_destinations(end_apt))
+            reachable_to_end.update(getattr(provider, "get_origins", provider.get_destinations)(end_apt))
 
     via_candidates = reachable_from_start & reachable_to_end
 
-    connections = []
+    connections = _ParetoFront(limit) if pareto else _TopK(limit)
 
-    # 2. Connessioni con scalo — voli da tutti i provider per ogni via_airport
-    for via_airport in via_candidates:
-        first_legs = []
-        second_legs = []
-        for provider, dates in providers_with_dates:
-            for date in dates:
-                for start_apt in start_expanded:
-                    first_legs.extend(provider.get_flights(start_apt, via_airport, date))
-                for end_apt in end_expanded:
-                    second_legs.extend(provider.get_flights(via_airport, end_apt, date))
-
-        first_legs = [f for f in first_legs if in_range(f.departure)]
-
-        seen_first = set()
-        dedup_first = []
-        for f in first_legs:
-            key = (f.from_code, f.to_code, f.departure, f.arrival, f.flight_number)
-            if key not in seen_first:
-                seen_first.add(key)
-                dedup_first.append(f)
-
-        seen_second = set()
-        dedup_second = []
-        for f in second_legs:
-            key = (f.from_code, f.to_code, f.departure, f.arrival, f.flight_number)
-            if key not in seen_second:
-                seen_second.add(key)
-                dedup_second.append(f)
-
-        for f1, f2 in product(dedup_first, dedup_second):
-            layover_time = (f2.departure - f1.arrival).total_seconds() / 3600
-            if 0 < layover_time <= max_layover_h:
-                total_duration = (f2.arrival - f1.departure).total_seconds() / 3600
-                connections.append(
-                    Connection(
-                        connection_label=f"{f1.from_code}-{f1.to_code} | {f2.from_code}-{f2.to_code}",
-                        first_leg=f1,
-                        second_leg=f2,
-                        layover_h=round(layover_time, 1),
-                        total_duration_h=round(total_duration, 1),
-                        total_price=f1.price + f2.price
-                    )
-                )
+    # 2. Tutte le tratte dirette e con 1 scalo vengono scaricate in parallelo prima del join
+    via_list = sorted(via_candidates) if max_stops >= 1 else []
+    ROUTER_VIA_CANDIDATES.inc(len(via_list))
+    fetched = _fetch_all(providers_with_dates, _plan_routes(start_expanded, end_expanded, via_list))
 
-    # 3. Voli diretti da tutti i provider
-    for provider, dates in providers_with_dates:
-        for date in dates:
-            for start_apt in start_expanded:
-                for end_apt in end_expanded:
-                    flights = provider.get_flights(start_apt, end_apt, date)
-                    for f in flights:
-                        if in_range(f.departure):
-                            duration_h = (f.arrival - f.departure).total_seconds() / 3600
-                            connections.append(
-                                Connection(
-                                    connection_label=f"{f.from_code}-{f.to_code} (Diretto)",
-                                    first_leg=f,
-                                    second_leg=None,
-                                    layover_h=0.0,
-                                    total_duration_h=round(duration_h, 1),
-                                    total_price=f.price
-                                )
-                            )
-
-    connections.sort(key=lambda c: c.total_price)
-    return connections
+    # 3. Voli diretti e connessioni con 1 scalo
+    _join_fetched(
+        providers_with_dates, fetched, start_expanded, end_expanded,
+        via_list, in_range, max_layover_h, connections,
+    )
+
+    # 4. Connessioni con 2 scali (opzionale)
+    if max_stops >= 2:
+        for conn in _find_two_stop_connections(
+            providers_with_dates, start_expanded, end_expanded,
+            reachable_from_start, reachable_to_end, max_layover_h, in_range,
+        ):
+            connections.add(conn)
+
+    return connections.results()
+
+async def _acall(provider, method: str, *args):
+    """Chiama la variante asincrona `a<method>` se il provider la offre, altrimenti quella sincrona in un thread."""
+    async_method = getattr(provider, f"a{method}", None)
+    if async_method is not None:
+        return await async_method(*args)
+    return await asyncio.to_thread(getattr(provider, method), *args)
+
+async def _afetch_all(providers_with_dates: list[tuple], routes: list[tuple]) -> dict:
+    """
+    Variante asincrona di _fetch_all: tutte le richieste partono insieme sull'event loop,
+    limitate per provider da un semaforo di `provider.max_concurrency` posti.
+    """
+    keys = []
+    calls = []
+    for idx, (provider, dates) in enumerate(providers_with_dates):
+        semaphore = asyncio.Semaphore(max(1, getattr(provider, "max_concurrency", 1)))
+
+        async def fetch(provider, semaphore, from_code, to_code, date):
+            async with semaphore:
+                return await _acall(provider, "get_flights", from_code, to_code, date)
+
+        for from_code, to_code, date in dict.fromkeys(
+            (from_code, to_code, date) for from_code, to_code in routes for date in dates
+        ):
+            keys.append((idx, from_code, to_code, date))
+            calls.append(fetch(provider, semaphore, from_code, to_code, date))
+    return dict(zip(keys, await asyncio.gather(*calls)))
+
+async def _alookup(providers_with_dates: list[tuple], airports: list[str], reverse: bool) -> set:
+    """Unione delle destinazioni (o, con reverse, delle origini) degli aeroporti su tutti i provider."""
+    results = await asyncio.gather(*(
+        _acall(provider, "get_origins" if reverse and hasattr(provider, "get_origins") else "get_destinations", apt)
+        for apt in airports for provider, _ in providers_with_dates
+    ))
+    return {code for codes in results for code in codes}
+
+class RoutingSession:
+    """
+    Routing incrementale per la pipeline di /api/search: i provider vengono aggiunti
+    man mano che completano e ogni aggiunta restituisce solo le connessioni nuove.
+
+    I segmenti sono indicizzati una volta sola in una LegTable, divisi per scalo in primi
+    (start → via) e secondi (via → end) segmenti; un nuovo blocco di segmenti viene unito
+    solo con quelli già presenti (delta join). Quando un provider porta nuovi scali, agli
+    altri provider vengono richieste solo le tratte mancanti per quegli scali: la fase
+    combinata costa il solo delta cross-provider, non un ricalcolo completo.
+    """
+
+    def __init__(
+        self,
+        start_airport: str,
+        end_airport: str,
+        max_layover_h: float,
+        use_city_groups: bool = True,
+        filter_start: str = None,
+        filter_end: str = None,
+        max_stops: int = 1,
+        limit: int = None,
+        pareto: bool = False,
+    ):
+        self.start_expanded = expand_airport(start_airport) if use_city_groups else [start_airport]
+        self.end_expanded = expand_airport(end_airport) if use_city_groups else [end_airport]
+        self._start_set = set(self.start_expanded)
+        self._end_set = set(self.end_expanded)
+        self.max_layover_h = max_layover_h
+        self.max_stops = max_stops
+        self._all_dates: set[str] = set()
+        self.in_range = _date_filter(self._all_dates, filter_start, filter_end)
+        self.connections = _ParetoFront(limit) if pareto else _TopK(limit)
+        self.table = LegTable()
+        self._first_rows: dict[str, list[int]] = {}
+        self._second_rows: dict[str, list[int]] = {}
+        self._reachable_from_start: set[str] = set()
+        self._reachable_to_end: set[str] = set()
+        self._providers: list[tuple] = []  # (provider, dates, scali già scaricati)
+        self._two_stop_seen: set[tuple] = set()
+        self._via_count = 0  # scali già conteggiati nelle metriche
+        self._lock = asyncio.Lock()
+
+    @property
+    def providers_with_dates(self) -> list[tuple]:
+        return [(provider, dates) for provider, dates, _ in self._providers]
+
+    def via_list(self) -> list[str]:
+        if self.max_stops < 1:
+            return []
+        return sorted(self._reachable_from_start & self._reachable_to_end)
+
+    def add_legs(self, legs) -> list[Connection]:
+        """Indicizza i segmenti non ancora noti e restituisce solo le connessioni che generano."""
+        new_first: dict[str, list[int]] = {}
+        new_second: dict[str, list[int]] = {}
+        added = []
+        for leg in legs:
+            known = len(self.table)
+            row = self.table.append(leg)
+            if row < known:
+                continue  # segmento già indicizzato (stessa chiave di deduplica)
+            from_start = leg.from_code in self._start_set
+            to_end = leg.to_code in self._end_set
+            if from_start and to_end:
+                if self.in_range(leg.departure) and leg.price < self.connections.bound():
+                    conn = _direct_connection(leg)
+                    self.connections.add(conn)
+                    added.append(conn)
+            elif from_start:
+                if self.in_range(leg.departure):
+                    new_first.setdefault(leg.to_code, []).append(row)
+            elif to_end:
+                new_second.setdefault(leg.from_code, []).append(row)
+
+        max_layover_min = int(self.max_layover_h * 60)
+        for via in sorted(new_first.keys() | new_second.keys()):
+            old_first = self._first_rows.setdefault(via, [])
+            old_second = self._second_rows.setdefault(via, [])
+            fresh_first = new_first.get(via, [])
+            fresh_second = new_second.get(via, [])
+            # (nuovi primi × tutti i secondi) ∪ (vecchi primi × nuovi secondi): ogni coppia una volta sola
+            if fresh_first:
+                added += _join_via(self.table, np.array(fresh_first, dtype=np.int64),
+                                   np.array(old_second + fresh_second, dtype=np.int64), max_layover_min, self.connections)
+            if old_first and fresh_second:
+                added += _join_via(self.table, np.array(old_first, dtype=np.int64),
+                                   np.array(fresh_second, dtype=np.int64), max_layover_min, self.connections)
+            old_first.extend(fresh_first)
+            old_second.extend(fresh_second)
+        return added
+
+    async def _two_stop_delta(self) -> list[Connection]:
+        added = []
+        for conn in await _afind_two_stop_connections(
+            self.providers_with_dates, self.start_expanded, self.end_expanded,
+            self._reachable_from_start, self._reachable_to_end, self.max_layover_h, self.in_range,
+        ):
+            key = tuple(_leg_key(leg) for leg in conn.legs)
+            if key in self._two_stop_seen:
+                continue
+            self._two_stop_seen.add(key)
+            if conn.total_price < self.connections.bound():
+                self.connections.add(conn)
+                added.append(conn)
+        return added
+
+    async def add_provider(self, provider, dates: list[str]) -> list[Connection]:
+        """
+        Aggiunge un provider: scarica le sue tratte per gli scali noti e restituisce le
+        connessioni nuove, incluse quelle cross-provider con i provider già presenti.
+        """
+        self._all_dates.update(dates)
+        single = [(provider, dates)]
+        name = type(provider).__name__
+        with span("router.lookup", provider=name):
+            from_start, to_end = await asyncio.gather(
+                _alookup(single, self.start_expanded, reverse=False),
+                _alookup(single, self.end_expanded, reverse=True),
+            )
+        self._reachable_from_start |= from_start
+        self._reachable_to_end |= to_end
+
+        # Download fuori dal lock: più provider possono scaricare in parallelo
+        vias = self.via_list()
+        routes = _plan_routes(self.start_expanded, self.end_expanded, vias)
+        with span("router.fetch", provider=name, routes=len(routes)):
+            fetched = await _afetch_all(single, routes)
+
+        async with self._lock:
+            self._providers.append((provider, dates, set(vias)))
+            legs = [leg for flights in fetched.values() for leg in flights]
+            with span("router.join", provider=name, legs=len(legs)):
+                added = await asyncio.to_thread(self.add_legs, legs)
+
+            # Scali emersi con questo provider (o con altri nel frattempo): solo le tratte mancanti
+            vias = self.via_list()
+            ROUTER_VIA_CANDIDATES.inc(len(vias) - self._via_count)
+            self._via_count = len(vias)
+            missing = []
+            for other, other_dates, covered in self._providers:
+                new_vias = [via for via in vias if via not in covered]
+                if new_vias:
+                    covered.update(new_vias)
+                    missing.append(_afetch_all([(other, other_dates)], _via_routes(self.start_expanded, self.end_expanded, new_vias)))
+            if missing:
+                with span("router.fetch_missing", provider=name, providers=len(missing)):
+                    legs = [leg for fetched in await asyncio.gather(*missing) for flights in fetched.values() for leg in flights]
+                with span("router.join", provider=name, legs=len(legs)):
+                    added += await asyncio.to_thread(self.add_legs, legs)
+
+            if self.max_stops >= 2:
+                with span("router.two_stop", provider=name):
+                    added += await self._two_stop_delta()
+        return added
+
+    def results(self) -> list[Connection]:
+        """Connessioni correnti della sessione (con limit/pareto applicati)."""
+        return self.connections.results()
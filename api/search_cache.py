@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from api.models import Connection
+from api.cache import SQLiteCache, get_shared_cache
+from api.metrics import CACHE_ENTRIES, record_cache_lookup
+
+# Età (secondi) entro cui un risultato è servito così com'è, ed entro cui è servito
+# mentre un refresh in background lo ricalcola; oltre è considerato assente
+SEARCH_FRESH_TTL = int(os.getenv("SEARCH_CACHE_FRESH_TTL", 5 * 60))
+SEARCH_STALE_TTL = int(os.getenv("SEARCH_CACHE_STALE_TTL", 30 * 60))
+SEARCH_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 256))
+
+FRESH = "fresh"
+STALE = "stale"
+
+def search_key(start: str, end: str, start_date: str, end_date: str, max_layover_days: int,
+               max_stops: int = 1, limit: int = None, pareto: bool = False) -> str:
+    """Chiave normalizzata dei parametri di ricerca (codici in maiuscolo, opzioni esplicite)."""
+    return "|".join((
+        start.strip().upper(), end.strip().upper(), start_date, end_date,
+        str(max_layover_days), str(max_stops), str(limit or ""), "pareto" if pareto else "",
+    ))
+
+def search_id(key: str) -> str:
+    """Id pubblico e stabile di una ricerca, usato per l'export lato server (/api/export/{search_id})."""
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+class SearchResultCache:
+    """
+    Cache dei risultati di /api/search con semantica stale-while-revalidate.
+
+    - In memoria: LRU limitato a `max_entries` ricerche, con le Connection già pronte.
+    - Persistente (opzionale): le ricerche sono salvate anche nel SQLiteCache condiviso,
+      così un worker appena avviato o un altro processo ritrova le rotte popolari.
+
+    get() restituisce (connessioni, stato) con stato FRESH o STALE, oppure None.
+    begin_refresh() garantisce un solo refresh in background per chiave.
+    lookup() ritrova le connessioni dal search_id restituito al client.
+    """
+
+    def __init__(self, store: SQLiteCache = None, max_entries: int = SEARCH_MAX_ENTRIES,
+                 fresh_ttl: float = SEARCH_FRESH_TTL, stale_ttl: float = SEARCH_STALE_TTL):
+        self.store = store
+        self.max_entries = max_entries
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._refreshing: set[str] = set()
+        self._ids: dict[str, str] = {}  # search_id → chiave, per le sole voci in memoria
+
+    def _remember(self, key: str, connections: list[Connection], created_at: float):
+        with self._lock:
+            self._entries[key] = (connections, created_at)
+            self._entries.move_to_end(key)
+            self._ids[search_id(key)] = key
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._ids.pop(search_id(evicted), None)
+
+    def _memory_entry(self, key: str) -> tuple | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        record_cache_lookup("search_results", entry is not None)
+        return entry
+
+    def _stored_entry(self, key: str) -> tuple | None:
+        """Lettura dal SQLiteCache e decodifica delle Connection: nel path asincrono gira in un thread."""
+        if self.store is None:
+            return None
+        stored = self.store.get("search", key)
+        if stored is None:
+            return None
+        entry = ([Connection.from_row(row) for row in stored["rows"]], stored["created_at"])
+        self._remember(key, *entry)
+        return entry
+
+    def _classify(self, entry: tuple | None) -> tuple[list[Connection], str] | None:
+        if entry is None:
+            return None
+        connections, created_at = entry
+        age = time.time() - created_at
+        if age < self.fresh_ttl:
+            return connections, FRESH
+        if age < self.stale_ttl:
+            return connections, STALE
+        return None
+
+    def get(self, key: str) -> tuple[list[Connection], str] | None:
+        entry = self._memory_entry(key)
+        if entry is None:
+            entry = self._stored_entry(key)
+        return self._classify(entry)
+
+    async def aget(self, key: str) -> tuple[list[Connection], str] | None:
+        """Come get(), per l'event loop: la lettura dal cache persistente avviene in un thread."""
+        entry = self._memory_entry(key)
+        if entry is None and self.store is not None:
+            entry = await asyncio.to_thread(self._stored_entry, key)
+        return self._classify(entry)
+
+    def set(self, key: str, connections: list[Connection]):
+        created_at = time.time()
+        self._remember(key, connections, created_at)
+        if self.store is not None:
+            self.store.set("search", key, {
+                "created_at": created_at,
+                "rows": [conn.to_row() for conn in connections],
+            }, self.stale_ttl)
+            self.store.set("search_id", search_id(key), key, self.stale_ttl)
+
+    def lookup(self, sid: str) -> list[Connection] | None:
+        """Connessioni della ricerca `sid`, anche se non più fresche; None se scaduta o sconosciuta."""
+        with self._lock:
+            key = self._ids.get(sid)
+        if key is None and self.store is not None:
+            key = self.store.get("search_id", sid)
+        if key is None:
+            return None
+        cached = self.get(key)
+        return cached[0] if cached is not None else None
+
+    def begin_refresh(self, key: str) -> bool:
+        """True se il chiamante deve avviare il refresh (nessun altro lo sta già facendo)."""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key: str):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+_search_cache = None
+_search_cache_lock = threading.Lock()
+
+def get_search_cache() -> SearchResultCache:
+    """Cache risultati di processo; persistente se FLIGHT_CACHE_PATH è impostata."""
+    global _search_cache
+    if _search_cache is None:
+        with _search_cache_lock:
+            if _search_cache is None:
+                _search_cache = SearchResultCache(get_shared_cache())
+                CACHE_ENTRIES.set_function(lambda: len(_search_cache), cache="search_results")
+    return _search_cache
@@ -0,0 +1,65 @@
+import asyncio
+import threading
+import weakref
+from concurrent.futures import Future
+
+class SingleFlight:
+    """
+    Coalescenza delle richieste identiche in corso: chi chiede una chiave già in volo
+    attende la stessa chiamata upstream e ne riceve il risultato (o l'eccezione),
+    invece di ripeterla. Terminata la chiamata la chiave viene rilasciata: il risultato
+    non è memorizzato, la cache resta compito dei provider.
+
+    do() coalesce le chiamate sincrone tra thread, ado() le coroutine dello stesso event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict = {}
+        self._acalls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+        self._stats = {"calls": 0, "shared": 0}
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def do(self, key, fn):
+        """Esegue fn() una sola volta per le chiamate concorrenti con la stessa chiave."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            self._count("shared")
+            return future.result()
+        self._count("calls")
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def ado(self, key, fn):
+        """Come do(), per una coroutine factory: le attese concorrenti condividono un unico task."""
+        calls = self._acalls.setdefault(asyncio.get_running_loop(), {})
+        task = calls.get(key)
+        if task is None:
+            self._count("calls")
+            task = calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: calls.pop(key, None))
+        else:
+            self._count("shared")
+        # shield: la cancellazione di un chiamante non interrompe la chiamata degli altri
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        """Chiamate upstream eseguite e richieste servite da una chiamata già in corso."""
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,117 @@
+import contextvars
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# File (JSON lines) in cui registrare il trace di ogni ricerca per analisi offline;
+# se impostato tutte le ricerche sono tracciate, anche senza ?trace=1
+TRACE_LOG_PATH = os.getenv("SEARCH_TRACE_LOG")
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "end", "children")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end = None
+        self.children: list["Span"] = []
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def to_dict(self, origin: float) -> dict:
+        node = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round(self.duration_ms, 2),
+        }
+        if self.attrs:
+            node["attrs"] = self.attrs
+        if self.children:
+            node["children"] = [child.to_dict(origin) for child in sorted(self.children, key=lambda c: c.start)]
+        return node
+
+@contextmanager
+def span(name: str, /, **attrs):
+    """
+    Misura il blocco come figlio dello span corrente. Senza un Trace attivo non fa nulla
+    (costo: una lettura di ContextVar). Lo span segue il contesto: task asyncio e
+    asyncio.to_thread lo ereditano, così fasi concorrenti finiscono sotto lo stesso padre.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    current = Span(name, attrs)
+    parent.children.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+
+def detach_trace():
+    """Scollega il contesto corrente dal trace attivo (per task in background nati da una richiesta)."""
+    _current_span.set(None)
+
+class Trace:
+    """
+    Albero di span di una ricerca. Attivo dentro `with Trace(...)`: tutti gli span()
+    aperti nel contesto (anche nei provider e nel client HTTP) diventano suoi discendenti.
+    """
+
+    def __init__(self, name: str, /, **attrs):
+        self.root = Span(name, attrs)
+        self._token = None
+
+    def __enter__(self) -> "Trace":
+        self.root.start = time.perf_counter()
+        self._token = _current_span.set(self.root)
+        return self
+
+    def __exit__(self, *exc):
+        self.root.end = time.perf_counter()
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Generatore ripreso in un altro contesto: basta disattivare il trace
+            _current_span.set(None)
+        return False
+
+    def totals(self) -> dict:
+        """Numero di span e tempo complessivo per nome (le fasi concorrenti si sovrappongono)."""
+        totals: dict[str, dict] = {}
+        stack = list(self.root.children)
+        while stack:
+            current = stack.pop()
+            entry = totals.setdefault(current.name, {"count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] += current.duration_ms
+            stack.extend(current.children)
+        return {
+            name: {"count": entry["count"], "total_ms": round(entry["total_ms"], 2)}
+            for name, entry in sorted(totals.items(), key=lambda item: -item[1]["total_ms"])
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "total_ms": round(self.root.duration_ms, 2),
+            "spans": self.root.to_dict(self.root.start),
+            "totals": self.totals(),
+        }
+
+    def log(self, path: str = None):
+        """Aggiunge il trace come riga JSON al file di log (SEARCH_TRACE_LOG)."""
+        path = path or TRACE_LOG_PATH
+        if not path:
+            return
+        line = json.dumps({"timestamp": time.time(), **self.to_dict()})
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
@@ -3,6 +3,7 @@ let airportsList = [];
 let selectedDepCode = "";
 let selectedArrCode = "";
 let currentResults = [];
+let currentSearchId = null; // Id server-side della ricerca, per l'export senza reinviare i risultati
 
 // Stato del Filtro Compagnie
 let activeCarriers = new Set(); // Set dei carrier attualmente selezionati
@@ -526,6 +527,7 @@ async function handleSearch() {
     resultsSection.style.display = "none";
     loaderState.style.display = "flex";
     resetCarrierFilter(); // Reset filtro compagnie ad ogni nuova ricerca
+    currentSearchId = null;
     
     // Inizializza progress bar
     const progressBarFill = document.getElementById("progress-bar-fill");
@@ -547,7 +549,9 @@ async function handleSearch() {
             end: selectedArrCode,
             start_date: dateStart,
             end_date: dateEnd,
-            max_layover_days: layover
+            max_layover_days: layover,
+            protocol: 2,
+            format: "compact"
         });
         
         const response = await fetch(`/api/search?${queryParams}`);
@@ -557,6 +561,8 @@ async function handleSearch() {
         const decoder = new TextDecoder("utf-8");
         let buffer = "";
         let results = [];
+        // Protocollo v2: record per id, aggiornati dagli eventi delta
+        const resultsById = new Map();
 
         while (true) {
             const { value, done } = await reader.read();
@@ -570,15 +576,24 @@ async function handleSearch() {
                 if (line.trim()) {
                     try {
                         const parsed = JSON.parse(line);
-                        if (parsed.type === "progress") {
+                        if (parsed.type === "search") {
+                            currentSearchId = parsed.id;
+                        } else if (parsed.type === "progress") {
                             if (progressBarFill) progressBarFill.style.width = parsed.percent + "%";
                             if (loaderProgressText) loaderProgressText.textContent = `${parsed.message} (${parsed.percent}%)`;
                         } else if (parsed.type === "partial_results") {
-                            currentResults = parsed.data;
-                            renderResults(parsed.data, false);
+                            currentResults = recordsOf(parsed, parsed.data);
+                            renderResults(currentResults, false);
                             loaderState.classList.add("loader-compact");
+                        } else if (parsed.type === "delta") {
+                            applyDelta(resultsById, parsed);
+                            currentResults = sortedResults(resultsById);
+                            renderResults(currentResults, false);
+                            loaderState.classList.add("loader-compact");
+                        } else if (parsed.type === "complete") {
+                            results = sortedResults(resultsById);
                         } else if (parsed.type === "results") {
-                            results = parsed.data;
+                            results = recordsOf(parsed, parsed.data);
                         } else if (parsed.type === "error") {
                             throw new Error(parsed.message);
                         }
@@ -609,15 +624,71 @@ async function handleSearch() {
     }
 }
 
+/** Applica un evento delta: rimuove gli id usciti e aggiunge i nuovi record */
+function applyDelta(resultsById, delta) {
+    delta.removed.forEach(id => resultsById.delete(id));
+    recordsOf(delta, delta.added).forEach(record => resultsById.set(record.id, record));
+}
+
+const LEG_PREFIXES = ["First", "Second", "Third"];
+
+/** Minuti dall'epoch → "YYYY-MM-DD HH:MM" (orari locali dell'aeroporto, senza fuso) */
+function formatEpochMinutes(minutes) {
+    return new Date(minutes * 60000).toISOString().slice(0, 16).replace("T", " ");
+}
+
+/** Record nel formato storico, ricostruiti dalle colonne se l'evento è in formato compatto */
+function recordsOf(event, payload) {
+    if (event.format !== "compact") return payload;
+    const strings = payload.strings;
+    const str = idx => (idx === null ? null : strings[idx]);
+    const records = [];
+    for (let i = 0; i < payload.count; i++) {
+        const record = { "Connection": strings[payload.label[i]] };
+        if (payload.id) record.id = payload.id[i];
+        payload.legs.forEach((leg, pos) => {
+            const present = leg.from[i] !== null;
+            // Seconda tratta sempre presente (null per i diretti), terza solo se esiste
+            if (!present && pos > 1) return;
+            const prefix = LEG_PREFIXES[pos];
+            if (!prefix) return;
+            record[`${prefix} Leg Departure`] = present ? formatEpochMinutes(leg.dep[i]) : null;
+            record[`${prefix} Leg Arrival`] = present ? formatEpochMinutes(leg.arr[i]) : null;
+            record[`${prefix} Leg Carrier`] = str(leg.carrier[i]);
+            record[`${prefix} Leg Flight Number`] = str(leg.flight[i]);
+            record[`${prefix} Leg Origin City`] = str(leg.from_city[i]);
+            record[`${prefix} Leg Destination City`] = str(leg.to_city[i]);
+        });
+        if (!("Second Leg Departure" in record)) {
+            ["Departure", "Arrival", "Carrier", "Flight Number", "Origin City", "Destination City"]
+                .forEach(name => { record[`Second Leg ${name}`] = null; });
+        }
+        record["Layover (h)"] = payload.layover_h[i];
+        record["Total Duration (h)"] = payload.duration_h[i];
+        record["Total Price (€)"] = payload.price[i];
+        records.push(record);
+    }
+    return records;
+}
+
+/** Record correnti ordinati per prezzo, come nell'evento results */
+function sortedResults(resultsById) {
+    return Array.from(resultsById.values()).sort((a, b) => a["Total Price (€)"] - b["Total Price (€)"]);
+}
+
 // ─── FILTRO COMPAGNIE ───────────────────────────────────────────────────────
 
+/** Carrier di tutte le tratte del risultato (anche la terza negli itinerari con 2 scali) */
+function routeCarriers(route) {
+    return ["First", "Second", "Third"]
+        .map(position => route[`${position} Leg Carrier`])
+        .filter(carrier => carrier && carrier !== "-");
+}
+
 /** Estrae tutti i carrier unici dalla lista completa dei risultati */
 function getAllCarriers() {
     const carriers = new Set();
-    currentResults.forEach(r => {
-        if (r["First Leg Carrier"] && r["First Leg Carrier"] !== "-") carriers.add(r["First Leg Carrier"]);
-        if (r["Second Leg Carrier"] && r["Second Leg Carrier"] !== "-") carriers.add(r["Second Leg Carrier"]);
-    });
+    currentResults.forEach(r => routeCarriers(r).forEach(carrier => carriers.add(carrier)));
     return [...carriers].sort();
 }
 
@@ -628,16 +699,14 @@ function countFilteredResults() {
 
 /** Ritorna true se tutti i carrier del risultato sono nel set attivo */
 function routeMatchesFilter(route) {
-    const c1 = route["First Leg Carrier"];
-    const c2 = route["Second Leg Carrier"];
-    
-    // Se il primo carrier è presente ma non attivo, escludi la rotta
-    if (c1 && c1 !== "-" && !activeCarriers.has(c1)) return false;
-    
-    // Se il secondo carrier è presente ma non attivo, escludi la rotta
-    if (c2 && c2 !== "-" && !activeCarriers.has(c2)) return false;
-    
-    return true;
+    // Basta una tratta con un carrier non attivo per escludere la rotta (stessa regola dell'export server-side)
+    return routeCarriers(route).every(carrier => activeCarriers.has(carrier));
+}
+
+/** True se il filtro compagnie nasconde almeno un carrier (con una sola compagnia il filtro non c'è) */
+function carrierFilterActive() {
+    const allCarriers = getAllCarriers();
+    return allCarriers.length > 1 && activeCarriers.size < allCarriers.length;
 }
 
 /** Costruisce i chip delle compagnie e mostra il pannello filtro */
@@ -766,11 +835,9 @@ function formatRouteLabel(key) {
         return `${airports.join(" → ")} <small style="opacity:0.6">(Diretto)</small>`;
     }
     if (key.includes("|")) {
-        const [leg1, leg2] = key.split("|").map(s => s.trim());
-        const origin = leg1.split("-")[0].trim();
-        const via = leg1.split("-")[1].trim();
-        const dest = leg2.split("-")[1].trim();
-        return `${origin} → ${via} → ${dest}`;
+        const legs = key.split("|").map(s => s.trim());
+        const airports = [legs[0].split("-")[0].trim(), ...legs.map(l => l.split("-")[1].trim())];
+        return airports.join(" → ");
     }
     return key.split("-").join(" → ");
 }
@@ -1025,6 +1092,20 @@ function showSystemError(title, description) {
 }
 
 // Gestione dell'esportazione Excel
+/** Parametri dell'export server-side: formato e filtro compagnie se attivo */
+function exportQueryParams() {
+    const params = new URLSearchParams({ format: "xlsx" });
+    if (carrierFilterActive()) {
+        activeCarriers.forEach(carrier => params.append("carrier", carrier));
+    }
+    return params;
+}
+
+/** Risultati esportati dal fallback POST: gli stessi che il server esporta con exportQueryParams() */
+function exportedResults() {
+    return carrierFilterActive() ? currentResults.filter(r => routeMatchesFilter(r)) : currentResults;
+}
+
 async function handleExport() {
     if (currentResults.length === 0) return;
 
@@ -1034,13 +1115,19 @@ async function handleExport() {
     exportBtn.innerHTML = `<span>⏳ Generazione...</span>`;
 
     try {
-        const response = await fetch("/api/export", {
-            method: "POST",
-            headers: {
-                "Content-Type": "application/json"
-            },
-            body: JSON.stringify(currentResults)
-        });
+        // Export dai risultati già sul server; il vecchio upload resta come fallback (ricerca scaduta).
+        // Con tutte le compagnie deselezionate il filtro non è esprimibile in query: si usa l'upload
+        const useSearchId = currentSearchId && !(carrierFilterActive() && activeCarriers.size === 0);
+        let response = useSearchId ? await fetch(`/api/export/${currentSearchId}?${exportQueryParams()}`) : null;
+        if (!response || response.status === 404) {
+            response = await fetch("/api/export", {
+                method: "POST",
+                headers: {
+                    "Content-Type": "application/json"
+                },
+                body: JSON.stringify(exportedResults())
+            });
+        }
 
         if (!response.ok) throw new Error("Impossibile generare l'esportazione Excel.");
 
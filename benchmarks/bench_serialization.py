@@ -0,0 +1,79 @@
+"""
+Benchmark serializzazione dei risultati di ricerca (50k connessioni).
+
+Confronta il percorso storico (strftime in to_dict + json.dumps del dict) con
+l'encoder NDJSON diretto in bytes di api.ndjson.
+
+Esecuzione:  python -m benchmarks.bench_serialization [n_connessioni]
+"""
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from api.models import FlightLeg, Connection
+from api.ndjson import encode_results, orjson
+
+def _legacy_to_dict(c: Connection) -> dict:
+    """Replica di Connection.to_dict() prima della cache degli orari (4 strftime per record)."""
+    fmt = "%Y-%m-%d %H:%M"
+    f, s = c.first_leg, c.second_leg
+    return {
+        "Connection": c.connection_label,
+        "First Leg Departure": f.departure.strftime(fmt),
+        "First Leg Arrival": f.arrival.strftime(fmt),
+        "First Leg Carrier": f.carrier,
+        "First Leg Flight Number": f.flight_number,
+        "Second Leg Departure": s.departure.strftime(fmt) if s else None,
+        "Second Leg Arrival": s.arrival.strftime(fmt) if s else None,
+        "Second Leg Carrier": s.carrier if s else None,
+        "Second Leg Flight Number": s.flight_number if s else None,
+        "Layover (h)": c.layover_h,
+        "Total Duration (h)": c.total_duration_h,
+        "Total Price (€)": c.total_price,
+        "First Leg Origin City": f.from_city,
+        "First Leg Destination City": f.to_city,
+        "Second Leg Origin City": s.from_city if s else None,
+        "Second Leg Destination City": s.to_city if s else None,
+    }
+
+def build_connections(n: int) -> list[Connection]:
+    """Genera n connessioni 1-scalo realistiche: pochi segmenti condivisi da molte combinazioni."""
+    base = datetime(2026, 7, 1, 6, 0)
+    firsts = [
+        FlightLeg("OLB", "BCN", "Olbia", "Barcelona", base + timedelta(hours=3 * i), base + timedelta(hours=3 * i + 2), 30.0 + i % 50, "Ryanair", f"FR{1000 + i}")
+        for i in range(250)
+    ]
+    seconds = [
+        FlightLeg("BCN", "CIA", "Barcelona", "Roma Ciampino", base + timedelta(hours=3 * i + 5), base + timedelta(hours=3 * i + 7), 40.0 + i % 70, "Vueling", f"VY{2000 + i}")
+        for i in range(250)
+    ]
+    connections = []
+    for k in range(n):
+        f1 = firsts[k % len(firsts)]
+        f2 = seconds[(k // len(firsts)) % len(seconds)]
+        connections.append(Connection(f"{f1.from_code}-{f1.to_code} | {f2.from_code}-{f2.to_code}", f1, f2, 3.0, 7.0, f1.price + f2.price))
+    return connections
+
+def _timeit(fn) -> float:
+    best = float("inf")
+    for _ in range(3):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main(n: int = 50_000):
+    connections = build_connections(n)
+    before = lambda: (json.dumps({"type": "results", "data": [_legacy_to_dict(c) for c in connections]}) + "\n").encode()
+    after = lambda: encode_results("results", connections)
+
+    assert json.loads(before()) == json.loads(after())
+    t_before = _timeit(before)
+    t_after = _timeit(after)
+    print(f"connessioni: {n}  (orjson: {'sì' if orjson else 'no'})")
+    print(f"prima : {t_before * 1e6 / n:7.2f} µs/record  ({t_before * 1000:.0f} ms totali)")
+    print(f"dopo  : {t_after * 1e6 / n:7.2f} µs/record  ({t_after * 1000:.0f} ms totali)")
+    print(f"speedup: {t_before / t_after:.1f}x")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
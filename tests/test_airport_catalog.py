@@ -0,0 +1,79 @@
+from unittest.mock import MagicMock
+from api.airport_catalog import AirportCatalog
+
+RAW = [
+    {"iataCode": "STN", "name": "London Stansted", "city": {"name": "London"}, "country": {"name": "United Kingdom"}},
+    {"iataCode": "CIA", "name": "Rome Ciampino", "city": {"name": "Rome"}, "country": {"name": "Italy"}},
+    {"iataCode": "FCO", "name": "Rome Fiumicino", "city": {"name": "Rome"}, "country": {"name": "Italy"}},
+    {"iataCode": "ROV", "name": "Rostov", "city": {"name": "Rostov"}, "country": {"name": "Russia"}},
+    {"iataCode": "BRS", "name": "Bristol", "city": {"name": "Bristol"}, "country": {"name": "United Kingdom"}},
+]
+
+def test_loads_once_and_shares_city_lookup():
+    loader = MagicMock(return_value=RAW)
+    catalog = AirportCatalog(loader)
+    assert catalog.city_lookup()["FCO"] == "Rome"
+    assert len(catalog.raw()) == 5
+    catalog.search("rom")
+    catalog.popular()
+    assert loader.call_count == 1
+
+def test_search_matches_substrings_like_linear_scan():
+    catalog = AirportCatalog(lambda: RAW)
+    for q in ["r", "ro", "rom", "ome", "kingdom", "STN", "italy", "zzz"]:
+        expected = {
+            a["iataCode"] for a in RAW
+            if q.lower() in a["name"].lower() or q.lower() in a["city"]["name"].lower()
+            or q.lower() in a["iataCode"].lower() or q.lower() in a["country"]["name"].lower()
+        }
+        assert {a["code"] for a in catalog.search(q)} == expected, q
+
+def test_search_ranking():
+    catalog = AirportCatalog(lambda: RAW)
+    assert catalog.search("rov")[0]["code"] == "ROV"
+    assert [a["code"] for a in catalog.search("ro")] == ["CIA", "FCO", "ROV"]
+    # Parola che inizia con la query (Stansted) prima dei match a metà parola
+    assert [a["code"] for a in catalog.search("st")] == ["STN", "BRS", "ROV"]
+
+def test_popular_sorted_by_name():
+    catalog = AirportCatalog(lambda: RAW)
+    assert [a["code"] for a in catalog.popular(2)] == ["BRS", "STN"]
+
+def test_failed_load_is_not_retried_immediately():
+    loader = MagicMock(return_value=[])
+    catalog = AirportCatalog(loader)
+    assert catalog.search("rom") == []
+    assert catalog.airports() == []
+    assert loader.call_count == 1
+
+def test_concurrent_first_load_waits_for_download():
+    import threading
+    started = threading.Event()
+    release = threading.Event()
+
+    def loader():
+        started.set()
+        release.wait(5)
+        return RAW
+
+    catalog = AirportCatalog(loader)
+    first = threading.Thread(target=catalog.ensure_loaded)
+    first.start()
+    assert started.wait(5)
+    results = {}
+    second = threading.Thread(target=lambda: results.update(popular=catalog.popular(), lookup=catalog.city_lookup()))
+    second.start()
+    second.join(0.2)
+    assert second.is_alive()  # attende il download in corso
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert len(results["popular"]) == 5
+    assert results["lookup"]["FCO"] == "Rome"
+
+def test_stale_catalog_refreshes_in_background():
+    loader = MagicMock(return_value=RAW)
+    catalog = AirportCatalog(loader, ttl=0)
+    catalog.ensure_loaded()
+    assert catalog.airports()  # dati correnti serviti mentre il refresh gira
+    assert loader.call_count >= 1
@@ -0,0 +1,55 @@
+from unittest.mock import patch, MagicMock
+from datetime import datetime
+from api.cache import SQLiteCache
+from api.providers.ryanair import RyanairProvider
+
+def test_set_get_and_stats(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"))
+    assert cache.get("routes", "FCO") is None
+    cache.set("routes", "FCO", ["AMS", "BCN"], ttl=60)
+    # Letta dalla coda write-behind prima del flush
+    assert cache.get("routes", "FCO") == ["AMS", "BCN"]
+    cache.flush()
+    # Un'altra istanza (altro worker) legge dal file
+    other = SQLiteCache(str(tmp_path / "cache.sqlite"))
+    assert other.get("routes", "FCO") == ["AMS", "BCN"]
+    assert cache.stats() == {"routes": {"hits": 1, "misses": 1}}
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"))
+    cache.set("fares", "k", [1, 2], ttl=-1)
+    cache.flush()
+    assert cache.get("fares", "k") is None
+    assert cache.stats()["fares"] == {"hits": 0, "misses": 1}
+
+@patch("api.http_client.requests.Session.get")
+def test_ryanair_reads_through_persistent_cache(mock_get, tmp_path):
+    mock_response = MagicMock()
+    mock_response.status_code = 200
+    mock_response.json.return_value = {
+        "outbound": {
+            "fares": [
+                {
+                    "departureDate": "2026-06-16T10:00:00",
+                    "arrivalDate": "2026-06-16T12:30:00",
+                    "price": {"value": 50.0},
+                    "flightNumber": "FR1234",
+                    "unavailable": False
+                }
+            ]
+        }
+    }
+    mock_get.return_value = mock_response
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"))
+
+    first = RyanairProvider(cache=cache)
+    first._airport_lookup = {"FCO": "Rome", "AMS": "Amsterdam"}
+    legs = first.get_flights("FCO", "AMS", "2026-06-01")
+    cache.flush()
+
+    # Nuova istanza (nuova richiesta): nessuna chiamata HTTP, stessi segmenti
+    second = RyanairProvider(cache=cache)
+    assert second.get_flights("FCO", "AMS", "2026-06-01") == legs
+    assert mock_get.call_count == 1
+    assert legs[0].departure == datetime(2026, 6, 16, 10, 0)
+    assert cache.stats()["fares"] == {"hits": 1, "misses": 1}
@@ -0,0 +1,37 @@
+import asyncio
+import zlib
+from api import compression
+from api.compression import negotiate_encoding, compress_stream, StreamCompressor
+
+def test_negotiate_encoding(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert negotiate_encoding("gzip, deflate, br") == "gzip"
+    assert negotiate_encoding("gzip;q=0, deflate") is None
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("*") == "gzip"
+
+def test_prefers_brotli_when_available(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", object())
+    assert negotiate_encoding("gzip, br") == "br"
+    assert negotiate_encoding("gzip") == "gzip"
+
+def test_each_chunk_is_decodable_immediately():
+    compressor = StreamCompressor("gzip")
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    # Sync flush: il client decodifica ogni evento senza attendere la fine dello stream
+    assert decoder.decompress(compressor.compress(b'{"type":"progress"}\n')) == b'{"type":"progress"}\n'
+    assert decoder.decompress(compressor.compress(b'{"type":"results"}\n')) == b'{"type":"results"}\n'
+    decoder.decompress(compressor.finish())
+    assert decoder.eof
+
+def test_compress_stream_roundtrip():
+    async def chunks():
+        yield '{"type":"progress","percent":5}\n'
+        yield b""
+        yield b'{"type":"results","data":[]}\n' * 50
+
+    async def collect():
+        return b"".join([part async for part in compress_stream(chunks(), "gzip")])
+
+    body = asyncio.run(collect())
+    assert zlib.decompress(body, 16 + zlib.MAX_WBITS) == b'{"type":"progress","percent":5}\n' + b'{"type":"results","data":[]}\n' * 50
@@ -0,0 +1,100 @@
+import csv
+import io
+import pytest
+from datetime import datetime
+from fastapi.testclient import TestClient
+from openpyxl import load_workbook
+from api import export, index
+from api.export import EXPORT_COLUMNS, export_row, connection_row, filter_connections, stream_export
+from api.models import FlightLeg, Connection
+
+RECORDS = [
+    {"Connection": "FCO-AMS (Diretto)", "First Leg Departure": "2026-06-16 10:00", "First Leg Arrival": "2026-06-16 12:00",
+     "First Leg Carrier": "Ryanair", "First Leg Flight Number": "FR1", "Second Leg Departure": None,
+     "Layover (h)": 0.0, "Total Duration (h)": 2.0, "Total Price (€)": 50.0},
+    {"Connection": "FCO-AMS | AMS-JFK", "First Leg Departure": "2026-06-16 10:00", "First Leg Arrival": "2026-06-16 12:00",
+     "First Leg Carrier": "Ryanair", "First Leg Flight Number": "FR1", "Second Leg Departure": "2026-06-16 15:00",
+     "Second Leg Arrival": "2026-06-16 23:00", "Second Leg Carrier": "Duffel", "Second Leg Flight Number": "ZZ2",
+     "Layover (h)": 3.0, "Total Duration (h)": 13.0, "Total Price (€)": 250.5},
+]
+
+def test_export_row_fills_missing_fields():
+    row = export_row(RECORDS[0])
+    assert len(row) == len(EXPORT_COLUMNS)
+    assert row[5:9] == ("-", "-", "-", "-")
+    assert row[-1] == 50.0
+
+def test_xlsx_export_streams_rows():
+    rows = (export_row(r) for r in RECORDS)
+    body = b"".join(stream_export(rows, "xlsx"))
+    sheet = load_workbook(io.BytesIO(body)).active
+    values = list(sheet.values)
+    assert sheet.title == "Connessioni Voli"
+    assert values[0] == EXPORT_COLUMNS
+    assert values[2][0] == "FCO-AMS | AMS-JFK"
+    assert values[2][-1] == 250.5
+
+def test_csv_export_in_batches(monkeypatch):
+    monkeypatch.setattr(export, "BATCH_ROWS", 1)
+    chunks = list(export.iter_csv(export_row(r) for r in RECORDS * 3))
+    assert len(chunks) > 1
+    parsed = list(csv.reader(io.StringIO(b"".join(chunks).decode())))
+    assert tuple(parsed[0]) == EXPORT_COLUMNS
+    assert len(parsed) == 7
+    assert parsed[2][8] == "ZZ2"
+
+def test_parquet_export():
+    pq = pytest.importorskip("pyarrow.parquet")
+    body = b"".join(stream_export((export_row(r) for r in RECORDS), "parquet"))
+    table = pq.read_table(io.BytesIO(body))
+    assert table.column_names == list(EXPORT_COLUMNS)
+    assert table.column("Total Price (€)").to_pylist() == [50.0, 250.5]
+
+def test_parquet_requires_pyarrow(monkeypatch):
+    monkeypatch.setattr(export, "pq", None)
+    assert not export.parquet_available()
+    with pytest.raises(RuntimeError):
+        list(stream_export(iter([]), "parquet"))
+
+LEG1 = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 50.0, "Ryanair", "FR1")
+LEG2 = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 15, 0), datetime(2026, 6, 16, 23, 0), 200.5, "Duffel", "ZZ2")
+CONNECTIONS = [
+    Connection("FCO-AMS (Diretto)", LEG1, None, 0.0, 2.0, 50.0),
+    Connection("FCO-AMS | AMS-JFK", LEG1, LEG2, 3.0, 13.0, 250.5),
+]
+
+def test_connection_row_matches_record_row():
+    for conn, record in zip(CONNECTIONS, RECORDS):
+        assert connection_row(conn) == export_row(record)
+
+def test_two_stop_exports_third_leg():
+    leg3 = FlightLeg("JFK", "MIA", "New York", "Miami", datetime(2026, 6, 17, 2, 0), datetime(2026, 6, 17, 5, 0), 80.0, "Duffel", "ZZ3")
+    conn = Connection("FCO-AMS | AMS-JFK | JFK-MIA", LEG1, LEG2, 6.0, 19.0, 330.5, (leg3,))
+    row = dict(zip(EXPORT_COLUMNS, connection_row(conn)))
+    assert row["Third Leg Flight Number"] == "ZZ3"
+    assert row["Third Leg Departure"] == "2026-06-17 02:00"
+    assert connection_row(conn) == export_row(conn.to_dict())
+    assert dict(zip(EXPORT_COLUMNS, connection_row(CONNECTIONS[1])))["Third Leg Carrier"] == "-"
+
+def test_posted_two_stop_record_keeps_third_leg():
+    leg3 = FlightLeg("JFK", "MIA", "New York", "Miami", datetime(2026, 6, 17, 2, 0), datetime(2026, 6, 17, 5, 0), 80.0, "Duffel", "ZZ3")
+    record = Connection("FCO-AMS | AMS-JFK | JFK-MIA", LEG1, LEG2, 6.0, 19.0, 330.5, (leg3,)).to_dict()
+    with TestClient(index.app) as client:
+        response = client.post("/api/export", params={"format": "csv"}, json=[record])
+    assert response.status_code == 200
+    header, row = list(csv.reader(io.StringIO(response.content.decode())))
+    cells = dict(zip(header, row))
+    assert cells["Third Leg Departure"] == "2026-06-17 02:00"
+    assert cells["Third Leg Arrival"] == "2026-06-17 05:00"
+    assert cells["Third Leg Carrier"] == "Duffel"
+    assert cells["Third Leg Flight Number"] == "ZZ3"
+
+def test_filter_connections():
+    def labels(**filters):
+        return [c.connection_label for c in filter_connections(CONNECTIONS, **filters)]
+
+    assert labels() == ["FCO-AMS (Diretto)", "FCO-AMS | AMS-JFK"]
+    assert labels(carriers={"Ryanair"}) == ["FCO-AMS (Diretto)"]
+    assert labels(max_price=100) == ["FCO-AMS (Diretto)"]
+    assert labels(max_duration_h=13) == ["FCO-AMS (Diretto)", "FCO-AMS | AMS-JFK"]
+    assert labels(max_stops=0) == ["FCO-AMS (Diretto)"]
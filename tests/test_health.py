@@ -0,0 +1,128 @@
+import asyncio
+import time
+from api import health
+from api.health import HealthMonitor
+
+def _probe(result: dict, delay: float = 0.0, calls: list = None):
+    async def probe():
+        if calls is not None:
+            calls.append(1)
+        await asyncio.sleep(delay)
+        return dict(result)
+    return probe
+
+def test_probes_run_concurrently_with_latency():
+    monitor = HealthMonitor({
+        "a": _probe({"status": "active"}, 0.2),
+        "b": _probe({"status": "active"}, 0.2),
+    }, timeout=1)
+    started = time.perf_counter()
+    status = asyncio.run(monitor.status())
+    assert time.perf_counter() - started < 0.35
+    assert status["a"]["status"] == "active"
+    assert status["b"]["latency_ms"] >= 200
+
+def test_probe_deadline_and_errors():
+    async def broken():
+        raise ConnectionError("reset")
+
+    monitor = HealthMonitor({"slow": _probe({"status": "active"}, 5), "broken": broken}, timeout=0.05)
+    status = asyncio.run(monitor.status())
+    assert status["slow"]["status"] == "error"
+    assert "0.05s" in status["slow"]["message"]
+    assert status["slow"]["latency_ms"] < 1000
+    assert status["broken"]["status"] == "error"
+    assert status["broken"]["message"] == "Errore di connessione: reset"
+
+def test_cached_then_refreshed_in_background():
+    calls = []
+    monitor = HealthMonitor({"a": _probe({"status": "active"}, calls=calls)}, ttl=60, timeout=1)
+
+    async def run():
+        await monitor.status()
+        await monitor.status()
+        assert len(calls) == 1
+        # Stato scaduto: risposta immediata dal cache, refresh in background
+        monitor._checked_at -= 61
+        first = await monitor.status()
+        assert first["a"]["status"] == "active"
+        await asyncio.gather(*monitor._tasks)
+        assert len(calls) == 2
+
+    asyncio.run(run())
+
+def test_concurrent_first_requests_share_probes():
+    calls = []
+    monitor = HealthMonitor({"a": _probe({"status": "active"}, 0.02, calls)}, timeout=1)
+
+    async def run():
+        await asyncio.gather(*(monitor.status() for _ in range(5)))
+
+    asyncio.run(run())
+    assert len(calls) == 1
+
+def test_duffel_probe_without_token(monkeypatch):
+    monkeypatch.delenv("DUFFEL_ACCESS_TOKEN", raising=False)
+    assert asyncio.run(health.probe_duffel()) == {
+        "status": "inactive", "message": "Nessun token Duffel configurato nel file .env", "mode": "none"
+    }
+
+def test_duffel_probe_timeout_keeps_mode(monkeypatch):
+    class HangingClient:
+        async def get(self, *args, **kwargs):
+            await asyncio.sleep(5)
+
+    monkeypatch.setenv("DUFFEL_ACCESS_TOKEN", "duffel_test_abc")
+    monkeypatch.setattr(health, "get_async_http_client", lambda name: HangingClient())
+    monkeypatch.setattr(health, "_monitor", None)
+    monitor = health.get_health_monitor()
+    monitor.probes = {"duffel": health.probe_duffel}
+    monitor.timeout = 0.05
+    status = asyncio.run(monitor.status())
+    assert status["duffel"]["status"] == "error"
+    assert "0.05s" in status["duffel"]["message"]
+    assert status["duffel"]["mode"] == "sandbox"
+
+def test_ryanair_probe_does_not_wait_for_catalog(monkeypatch):
+    import threading
+    from unittest.mock import AsyncMock, MagicMock
+    from api.airport_catalog import AirportCatalog
+    release = threading.Event()
+    loaded = threading.Event()
+
+    def slow_loader():
+        release.wait(5)
+        loaded.set()
+        return [{"iataCode": "DUB", "name": "Dublin"}]
+
+    catalog = AirportCatalog(slow_loader)
+    response = MagicMock(status_code=200)
+    client = MagicMock(get=AsyncMock(return_value=response))
+    monkeypatch.setattr(health, "get_airport_catalog", lambda: catalog)
+    monkeypatch.setattr(health, "get_async_http_client", lambda name: client)
+
+    monitor = HealthMonitor({"ryanair": health.probe_ryanair}, timeout=1)
+    status = asyncio.run(monitor.refresh())
+    # Catalogo in caricamento: il probe risponde subito, il download continua in background
+    assert status["ryanair"]["status"] == "active"
+    assert "in caricamento" in status["ryanair"]["message"]
+    assert status["ryanair"]["latency_ms"] < 500
+    release.set()
+    assert loaded.wait(5)
+    for _ in range(100):
+        if catalog.current():
+            break
+        time.sleep(0.01)
+    status = asyncio.run(monitor.refresh())
+    assert status["ryanair"]["message"] == "Connesso con successo (1 aeroporti attivi)"
+
+def test_ryanair_probe_reports_failed_catalog(monkeypatch):
+    from unittest.mock import AsyncMock, MagicMock
+    from api.airport_catalog import AirportCatalog
+    catalog = AirportCatalog(lambda: [])
+    catalog.ensure_loaded()
+    client = MagicMock(get=AsyncMock(return_value=MagicMock(status_code=200)))
+    monkeypatch.setattr(health, "get_airport_catalog", lambda: catalog)
+    monkeypatch.setattr(health, "get_async_http_client", lambda name: client)
+    result = asyncio.run(health.probe_ryanair())
+    assert result["status"] == "error"
@@ -0,0 +1,48 @@
+from unittest.mock import patch
+import asyncio
+from api.http_client import HttpClient, get_http_client, get_async_http_client
+
+def test_shared_clients_are_reused():
+    assert get_http_client("ryanair") is get_http_client("ryanair")
+    assert get_http_client("ryanair") is not get_http_client("duffel")
+    assert get_http_client("ryanair").session.verify is False
+
+@patch("api.http_client.requests.Session.get")
+def test_default_timeout_applied(mock_get):
+    client = HttpClient(timeout=7)
+    client.get("https://example.com")
+    client.get("https://example.com", timeout=2)
+    assert mock_get.call_args_list[0].kwargs["timeout"] == 7
+    assert mock_get.call_args_list[1].kwargs["timeout"] == 2
+
+def test_pool_and_retry_configuration():
+    client = HttpClient(pool_maxsize=5, retries=3)
+    adapter = client.session.get_adapter("https://api.duffel.com")
+    assert adapter._pool_maxsize == 5
+    assert adapter.max_retries.total == 3
+    assert "POST" not in adapter.max_retries.allowed_methods
+
+def test_async_clients_are_per_event_loop():
+    async def clients():
+        return get_async_http_client("duffel"), get_async_http_client("duffel")
+
+    first, same = asyncio.run(clients())
+    other, _ = asyncio.run(clients())
+    assert first is same
+    assert first is not other
+
+def test_async_client_shares_configuration():
+    shared = get_http_client("ryanair")
+    custom = HttpClient(timeout=4, verify=False, headers={"X-Test": "1"}, name="custom")
+
+    async def clients():
+        return shared.async_client(), get_async_http_client("ryanair"), custom.async_client(), custom.async_client()
+
+    from_shared, process_wide, first, same = asyncio.run(clients())
+    # Il client condiviso di processo usa il pool asincrono comune dell'upstream
+    assert from_shared is process_wide
+    # Un client iniettato ne deriva uno proprio, con la stessa configurazione
+    assert first is same and first is not process_wide
+    assert first.name == "custom"
+    assert first.client.timeout.read == 4
+    assert first.client.headers["X-Test"] == "1"
@@ -0,0 +1,44 @@
+from datetime import datetime
+import numpy as np
+from api.models import FlightLeg
+from api.leg_table import LegTable, join_layovers, to_epoch_minutes
+
+def _leg(from_code, to_code, dep, arr, price, fn):
+    return FlightLeg(from_code, to_code, from_code, to_code, dep, arr, price, "Carrier", fn)
+
+def test_append_interns_and_deduplicates():
+    table = LegTable()
+    leg = _leg("FCO", "AMS", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 50.0, "CR1")
+    back = _leg("AMS", "FCO", datetime(2026, 6, 16, 14, 0), datetime(2026, 6, 16, 16, 0), 60.0, "CR2")
+    assert table.append(leg) == 0
+    assert table.append(back) == 1
+    assert table.append(leg) == 0
+    assert len(table) == 2
+    assert table.airports == {"FCO": 0, "AMS": 1}
+    assert table.from_id.tolist() == [0, 1]
+    assert table.to_id.tolist() == [1, 0]
+    assert table.departure[0] == to_epoch_minutes(datetime(2026, 6, 16, 10, 0))
+    assert table.arrival[0] - table.departure[0] == 120
+
+def test_join_layovers_window():
+    table = LegTable()
+    first = table.extend([
+        _leg("FCO", "AMS", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 50.0, "CR1"),
+        _leg("FCO", "AMS", datetime(2026, 6, 16, 20, 0), datetime(2026, 6, 16, 22, 0), 40.0, "CR2"),
+    ])
+    second = table.extend([
+        _leg("AMS", "JFK", datetime(2026, 6, 16, 22, 0), datetime(2026, 6, 17, 6, 0), 100.0, "CR3"),
+        _leg("AMS", "JFK", datetime(2026, 6, 16, 12, 0), datetime(2026, 6, 16, 20, 0), 90.0, "CR4"),
+        _leg("AMS", "JFK", datetime(2026, 6, 16, 23, 0), datetime(2026, 6, 17, 7, 0), 80.0, "CR5"),
+    ])
+    i, j, price, layover, duration = join_layovers(table, np.array(first), np.array(second), 10 * 60)
+    pairs = sorted(zip([table.legs[r].flight_number for r in i], [table.legs[r].flight_number for r in j]))
+    # CR4 parte all'arrivo di CR1 (scalo nullo), CR5 oltre le 10h da CR1
+    assert pairs == [("CR1", "CR3"), ("CR2", "CR5")]
+    assert sorted(price.tolist()) == [120.0, 150.0]
+    assert sorted(layover.tolist()) == [60, 600]
+
+def test_join_layovers_empty():
+    table = LegTable()
+    i, j, price, layover, duration = join_layovers(table, np.array([], dtype=np.int64), np.array([], dtype=np.int64), 600)
+    assert len(i) == len(j) == len(price) == 0
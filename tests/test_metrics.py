@@ -0,0 +1,70 @@
+from unittest.mock import patch, MagicMock
+from datetime import datetime
+from api import metrics
+from api.metrics import Registry, record_upstream_request, UPSTREAM_REQUESTS, UPSTREAM_RATE_LIMITED, ROUTER_CONNECTIONS
+from api.http_client import HttpClient
+from api.models import FlightLeg
+from api.router import RoutingSession
+
+def _value(metric, **labels) -> float:
+    key = metric._key(labels)
+    return dict((k, v) for _, k, v in metric.samples()).get(key, 0.0)
+
+def test_render_text_format():
+    registry = Registry()
+    requests = registry.counter("test_requests_total", "Richieste", ("provider", "status"))
+    latency = registry.histogram("test_latency_seconds", "Latenza", ("provider",), buckets=(0.1, 1.0))
+    size = registry.gauge("test_entries", "Voci", ("cache",))
+    requests.inc(provider="duffel", status="201")
+    requests.inc(2, provider="duffel", status="201")
+    latency.observe(0.05, provider="duffel")
+    latency.observe(0.5, provider="duffel")
+    size.set_function(lambda: 7, cache="x")
+
+    text = registry.render()
+    assert "# TYPE test_requests_total counter" in text
+    assert 'test_requests_total{provider="duffel",status="201"} 3' in text
+    assert 'test_latency_seconds_bucket{provider="duffel",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{provider="duffel",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{provider="duffel",le="+Inf"} 2' in text
+    assert 'test_latency_seconds_count{provider="duffel"} 2' in text
+    assert 'test_entries{cache="x"} 7' in text
+    assert text.endswith("\n")
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter("test_total", "x", ("name",)).inc(name='a"b\\c')
+    assert 'test_total{name="a\\"b\\\\c"} 1' in registry.render()
+
+def test_upstream_429_counted():
+    before = _value(UPSTREAM_RATE_LIMITED, provider="test")
+    record_upstream_request("test", 429, 0.01)
+    record_upstream_request("test", 201, 0.01)
+    assert _value(UPSTREAM_RATE_LIMITED, provider="test") == before + 1
+    assert _value(UPSTREAM_REQUESTS, provider="test", status="201") >= 1
+
+@patch("api.http_client.requests.Session.get")
+def test_http_client_records_status_and_errors(mock_get):
+    client = HttpClient(name="probe_test")
+    mock_get.return_value = MagicMock(status_code=200)
+    client.get("https://example.com")
+    mock_get.side_effect = ConnectionError("reset")
+    try:
+        client.get("https://example.com")
+    except ConnectionError:
+        pass
+    assert _value(UPSTREAM_REQUESTS, provider="probe_test", status="200") == 1
+    assert _value(UPSTREAM_REQUESTS, provider="probe_test", status="error") == 1
+
+def test_router_counts_connections():
+    before_direct = _value(ROUTER_CONNECTIONS, kind="direct")
+    before_one = _value(ROUTER_CONNECTIONS, kind="one_stop")
+    session = RoutingSession("FCO", "JFK", 24, use_city_groups=False, filter_start="2026-06-16", filter_end="2026-06-16")
+    session.add_legs([
+        FlightLeg("FCO", "JFK", "Roma", "New York", datetime(2026, 6, 16, 8), datetime(2026, 6, 16, 16), 400.0, "X", "X1"),
+        FlightLeg("FCO", "AMS", "Roma", "Amsterdam", datetime(2026, 6, 16, 10), datetime(2026, 6, 16, 12), 50.0, "X", "X2"),
+        FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 15), datetime(2026, 6, 16, 23), 200.0, "X", "X3"),
+    ])
+    assert _value(ROUTER_CONNECTIONS, kind="direct") == before_direct + 1
+    assert _value(ROUTER_CONNECTIONS, kind="one_stop") == before_one + 1
+    assert "flights_router_join_duration_seconds_count" in metrics.render()
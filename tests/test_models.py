@@ -85,3 +85,24 @@ def test_to_dict_one_stop():
     assert d["First Leg Destination City"] == "Amsterdam"
     assert d["Second Leg Origin City"] == "Amsterdam"
     assert d["Second Leg Destination City"] == "New York"
+
+def test_models_are_frozen_and_cache_timestamps():
+    import dataclasses
+    import pytest
+    leg = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 30), 50.0, "Ryanair", "FR1234")
+    assert leg.departure_str == "2026-06-16 10:00"
+    assert leg.arrival_str == "2026-06-16 12:30"
+    assert not hasattr(leg, "__dict__")
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        leg.price = 10.0
+    same = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 30), 50.0, "Ryanair", "FR1234")
+    assert leg == same
+
+def test_connection_row_roundtrip():
+    leg1 = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 30), 50.0, "Ryanair", "FR1234")
+    leg2 = FlightLeg("AMS", "BCN", "Amsterdam", "Barcelona", datetime(2026, 6, 16, 15, 0), datetime(2026, 6, 16, 17, 0), 40.0, "Vueling", "VY1")
+    leg3 = FlightLeg("BCN", "JFK", "Barcelona", "New York", datetime(2026, 6, 16, 19, 0), datetime(2026, 6, 17, 3, 0), 200.0, "Duffel Air", "ZZ999")
+    direct = Connection("FCO-AMS (Diretto)", leg1, None, 0.0, 2.5, 50.0)
+    two_stop = Connection("FCO-AMS | AMS-BCN | BCN-JFK", leg1, leg2, 4.5, 17.0, 290.0, (leg3,))
+    for conn in (direct, two_stop):
+        assert Connection.from_row(conn.to_row()) == conn
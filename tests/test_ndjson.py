@@ -0,0 +1,110 @@
+import json
+from datetime import datetime, timedelta
+from api import ndjson
+from api.models import FlightLeg, Connection
+from api.ndjson import encode_connection, encode_results, encode_event
+
+LEG1 = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 50.0, "Ryanair", "FR1")
+LEG2 = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 15, 0), datetime(2026, 6, 16, 23, 0), 200.5, "Duffel \"Air\"", "ZZ2")
+LEG3 = FlightLeg("JFK", "BOS", "New York", "Boston", datetime(2026, 6, 17, 8, 0), datetime(2026, 6, 17, 9, 0), 30.0, "Carrier", "CR3")
+
+CONNECTIONS = [
+    Connection("FCO-AMS (Diretto)", LEG1, None, 0.0, 2.0, 50.0),
+    Connection("FCO-AMS | AMS-JFK", LEG1, LEG2, 3.0, 13.0, 250.5),
+    Connection("FCO-AMS | AMS-JFK | JFK-BOS", LEG1, LEG2, 12.0, 23.0, 280.5, extra_legs=(LEG3,)),
+]
+
+def test_encode_connection_matches_to_dict():
+    for conn in CONNECTIONS:
+        encoded = encode_connection(conn)
+        assert json.loads(encoded) == conn.to_dict()
+        # Stesso ordine delle chiavi del formato storico
+        assert list(json.loads(encoded)) == list(conn.to_dict())
+
+def test_encode_connection_without_orjson(monkeypatch):
+    monkeypatch.setattr(ndjson, "orjson", None)
+    leg = FlightLeg("FCO", "AMS", "Roma", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 50.0, "Ryanair", "FR1")
+    conn = Connection("FCO-AMS (Diretto)", leg, None, 0.0, 2.0, 50.0)
+    assert json.loads(encode_connection(conn)) == conn.to_dict()
+
+def test_encode_results_is_one_ndjson_line():
+    line = encode_results("results", CONNECTIONS)
+    assert line.endswith(b"\n") and line.count(b"\n") == 1
+    event = json.loads(line)
+    assert event["type"] == "results"
+    assert event["data"] == [c.to_dict() for c in CONNECTIONS]
+    assert json.loads(encode_results("partial_results", [])) == {"type": "partial_results", "data": []}
+
+def test_encode_event():
+    assert json.loads(encode_event({"type": "progress", "percent": 5})) == {"type": "progress", "percent": 5}
+
+def test_delta_encoder_sends_only_changes():
+    encoder = ndjson.DeltaEncoder()
+    first = json.loads(encoder.encode(CONNECTIONS[:2]))
+    assert first["type"] == "delta"
+    assert [r["Connection"] for r in first["added"]] == ["FCO-AMS (Diretto)", "FCO-AMS | AMS-JFK"]
+    assert first["added"][0]["id"] == "FCO-AMS:FR1@2606161000"
+    assert first["removed"] == []
+    assert encoder.encode(CONNECTIONS[:2]) == b""
+
+    second = json.loads(encoder.encode(CONNECTIONS[1:]))
+    assert [r["Connection"] for r in second["added"]] == ["FCO-AMS | AMS-JFK | JFK-BOS"]
+    assert second["removed"] == ["FCO-AMS:FR1@2606161000"]
+    assert json.loads(encoder.complete()) == {"type": "complete", "count": 2}
+
+def test_encode_connection_with_id_keeps_record():
+    record = json.loads(encode_connection(CONNECTIONS[1], with_id=True))
+    assert record.pop("id") == "FCO-AMS:FR1@2606161000_AMS-JFK:ZZ2@2606161500"
+    assert record == CONNECTIONS[1].to_dict()
+
+def _decode_compact(table: dict) -> list[dict]:
+    """Ricostruisce i record dal formato compatto (come fa il client)."""
+    strings = table["strings"]
+    records = []
+    for i in range(table["count"]):
+        legs = []
+        for columns in table["legs"]:
+            if columns["from"][i] is None:
+                continue
+            legs.append({name: (strings[values[i]] if name not in ("dep", "arr") else values[i]) for name, values in columns.items()})
+        records.append({"label": strings[table["label"][i]], "price": table["price"][i], "legs": legs})
+    return records
+
+def test_compact_table_uses_string_dictionary_and_epoch_minutes():
+    table = ndjson.compact_table(CONNECTIONS)
+    assert table["count"] == 3
+    assert len(table["legs"]) == 3
+    # Stringhe ripetute (FCO, Rome, Ryanair, FR1, ...) compaiono una sola volta nel dizionario
+    assert len(table["strings"]) == len(set(table["strings"]))
+    assert table["strings"].count("FCO") == 1
+    assert table["legs"][1]["from"][0] is None
+    assert table["legs"][0]["dep"][0] == (datetime(2026, 6, 16, 10, 0) - datetime(1970, 1, 1)) // timedelta(minutes=1)
+
+    records = _decode_compact(table)
+    assert [r["label"] for r in records] == [c.connection_label for c in CONNECTIONS]
+    assert [r["price"] for r in records] == [c.total_price for c in CONNECTIONS]
+    assert [leg["flight"] for leg in records[2]["legs"]] == ["FR1", "ZZ2", "CR3"]
+    assert records[1]["legs"][1]["carrier"] == "Duffel \"Air\""
+
+def test_compact_results_and_delta():
+    event = json.loads(encode_results("results", CONNECTIONS, compact=True))
+    assert event["type"] == "results" and event["format"] == "compact"
+    assert event["data"]["count"] == 3
+    assert len(encode_results("results", CONNECTIONS * 20, compact=True)) < len(encode_results("results", CONNECTIONS * 20))
+
+    encoder = ndjson.DeltaEncoder(compact=True)
+    first = json.loads(encoder.encode(CONNECTIONS[:2]))
+    assert first["format"] == "compact"
+    assert first["added"]["id"] == ["FCO-AMS:FR1@2606161000", "FCO-AMS:FR1@2606161000_AMS-JFK:ZZ2@2606161500"]
+    second = json.loads(encoder.encode(CONNECTIONS[1:]))
+    assert second["added"]["count"] == 1
+    assert second["removed"] == ["FCO-AMS:FR1@2606161000"]
+
+def test_connection_id_distinguishes_routes_with_same_flight_number():
+    # Numero volo ricavato dal prezzo: identico su rotte diverse con la stessa partenza
+    a = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 19.99, "Ryanair", "FR1999")
+    b = FlightLeg("FCO", "BCN", "Rome", "Barcelona", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 11, 45), 19.99, "Ryanair", "FR1999")
+    conns = [Connection("FCO-AMS (Diretto)", a, None, 0.0, 2.0, 19.99), Connection("FCO-BCN (Diretto)", b, None, 0.0, 1.8, 19.99)]
+    assert ndjson.connection_id(conns[0]) != ndjson.connection_id(conns[1])
+    event = json.loads(ndjson.DeltaEncoder().encode(conns))
+    assert len(event["added"]) == 2
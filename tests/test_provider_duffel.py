@@ -1,10 +1,13 @@
+import asyncio
 import os
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from datetime import datetime
 from api.models import FlightLeg
+import pytest
 from api.providers.duffel import DuffelProvider
+from api.rate_limit import AdaptiveRateLimiter
 
-@patch("api.providers.duffel.requests.post")
+@patch("api.http_client.requests.Session.post")
 def test_get_flights_direct(mock_post):
     mock_response = MagicMock()
     mock_response.status_code = 201
@@ -44,7 +47,7 @@ def test_get_flights_direct(mock_post):
     assert res[0].carrier == "Duffel Air"
     assert res[0].flight_number == "ZZ123"
 
-@patch("api.providers.duffel.requests.post")
+@patch("api.http_client.requests.Session.post")
 def test_get_flights_2segment_decomposed(mock_post):
     mock_response = MagicMock()
     mock_response.status_code = 201
@@ -151,8 +154,8 @@ def test_get_flights_empty_on_no_token():
     res = provider.get_flights("FCO", "AMS", "2026-06-16")
     assert res == []
 
-@patch("api.providers.duffel.time.sleep")
-@patch("api.providers.duffel.requests.post")
+@patch("api.rate_limit.time.sleep")
+@patch("api.http_client.requests.Session.post")
 def test_get_flights_retries_on_429(mock_post, mock_sleep):
     mock_429 = MagicMock()
     mock_429.status_code = 429
@@ -187,11 +190,179 @@ def test_get_flights_retries_on_429(mock_post, mock_sleep):
     # First request returns 429, second returns 201
     mock_post.side_effect = [mock_429, mock_201]
     
-    provider = DuffelProvider()
+    provider = DuffelProvider(rate_limiter=AdaptiveRateLimiter(rate=100.0))
     provider.token = "fake_token"
     
     res = provider.get_flights("FCO", "AMS", "2026-06-16")
     assert len(res) == 1
     assert res[0].price == 100.0
     assert mock_post.call_count == 2
-    mock_sleep.assert_called_once_with(0.1)
+    # L'attesa del reset avviene nel rate limiter condiviso, prima del retry
+    mock_sleep.assert_called_once()
+    assert mock_sleep.call_args.args[0] == pytest.approx(0.1, abs=0.02)
+    assert provider.failed_requests == 0
+
+@patch("api.rate_limit.time.sleep")
+@patch("api.http_client.requests.Session.post")
+def test_get_flights_counts_failure_when_429_retries_run_out(mock_post, mock_sleep):
+    mock_429 = MagicMock()
+    mock_429.status_code = 429
+    mock_429.headers = {"ratelimit-reset": "0.1"}
+    mock_post.return_value = mock_429
+
+    provider = DuffelProvider(rate_limiter=AdaptiveRateLimiter(rate=100.0))
+    provider.token = "fake_token"
+
+    assert provider.get_flights("FCO", "AMS", "2026-06-17") == []
+    assert mock_post.call_count == 4
+    assert provider.failed_requests == 1
+
+@patch("api.rate_limit.asyncio.sleep", new_callable=AsyncMock)
+@patch("api.http_client.httpx.AsyncClient.post", new_callable=AsyncMock)
+def test_aget_flights_populates_cache_asynchronously(mock_post, mock_sleep):
+    mock_429 = MagicMock()
+    mock_429.status_code = 429
+    mock_429.headers = {"ratelimit-reset": "0.1"}
+
+    mock_201 = MagicMock()
+    mock_201.status_code = 201
+    mock_201.json.return_value = {
+        "data": {
+            "offers": [
+                {
+                    "total_amount": "100.00",
+                    "slices": [
+                        {
+                            "segments": [
+                                {
+                                    "origin": {"iata_code": "FCO"},
+                                    "destination": {"iata_code": "AMS"},
+                                    "departing_at": "2026-06-16T10:00:00Z",
+                                    "arriving_at": "2026-06-16T12:00:00Z",
+                                    "operating_carrier": {"name": "Carrier"},
+                                    "flight_number": "123"
+                                }
+                            ]
+                        }
+                    ]
+                }
+            ]
+        }
+    }
+    mock_post.side_effect = [mock_429, mock_201]
+    progress = []
+
+    provider = DuffelProvider("FCO", "AMS", ["2026-06-16"], progress_callback=lambda p, m: progress.append(p),
+                              rate_limiter=AdaptiveRateLimiter(rate=100.0))
+    provider.token = "fake_token"
+
+    async def search():
+        legs = await provider.aget_flights("FCO", "AMS", "2026-06-16")
+        return legs, await provider.aget_destinations("AMS")
+
+    with patch("api.providers.duffel.expand_airport", side_effect=lambda code: [code]):
+        res, destinations = asyncio.run(search())
+    assert len(res) == 1
+    assert res[0].price == 100.0
+    assert destinations == ["FCO"]
+    assert mock_post.call_count == 2
+    mock_sleep.assert_awaited_once()
+    assert mock_sleep.call_args.args[0] == pytest.approx(0.1, abs=0.02)
+    assert progress == [95]
+    # I metodi sincroni leggono lo stesso cache senza nuove richieste
+    assert provider.get_flights("FCO", "AMS", "2026-06-16") == res
+    assert mock_post.call_count == 2
+
+def test_adjacency_index_updated_on_insert():
+    provider = DuffelProvider(start_airport="CAG", end_airport="MUC", dates=["2026-06-17", "2026-06-18"])
+    provider._cache_initialized = True
+    leg1 = FlightLeg("CAG", "BCN", "Cagliari", "Barcelona", datetime(2026, 6, 17, 10, 0), datetime(2026, 6, 17, 12, 0), 60.0, "Vueling", "VY100")
+    leg2 = FlightLeg("BCN", "MUC", "Barcelona", "Munich", datetime(2026, 6, 17, 14, 0), datetime(2026, 6, 17, 16, 0), 100.0, "Vueling", "VY200")
+    leg3 = FlightLeg("BCN", "MUC", "Barcelona", "Munich", datetime(2026, 6, 18, 14, 0), datetime(2026, 6, 18, 16, 0), 90.0, "Vueling", "VY200")
+    provider._store_legs([leg1, leg2, leg3])
+
+    assert sorted(provider.get_destinations("BCN")) == ["CAG", "MUC"]
+    assert provider.get_origins("MUC") == ["BCN"]
+    assert provider.get_origins("CAG") == []
+    assert provider.get_flights("BCN", "MUC", "2026-06-18") == [leg3]
+    assert provider._index.destinations("BCN") == {"MUC"}
+
+def _segment(origin, destination, dep, arr, number):
+    return {
+        "origin": {"iata_code": origin},
+        "destination": {"iata_code": destination},
+        "departing_at": dep,
+        "arriving_at": arr,
+        "operating_carrier": {"name": "Carrier", "iata_code": "ZZ"},
+        "flight_number": number,
+    }
+
+@patch("api.http_client.requests.Session.post")
+def test_metro_endpoints_queried_by_city_code(mock_post):
+    mock_response = MagicMock()
+    mock_response.status_code = 201
+    mock_response.json.return_value = {
+        "data": {
+            "offers": [
+                {"total_amount": "300.00", "slices": [{"segments": [
+                    _segment("LHR", "JFK", "2026-06-16T10:00:00Z", "2026-06-16T18:00:00Z", "1"),
+                ]}]},
+                {"total_amount": "280.00", "slices": [{"segments": [
+                    _segment("LGW", "EWR", "2026-06-16T11:00:00Z", "2026-06-16T19:00:00Z", "2"),
+                ]}]},
+            ]
+        }
+    }
+    mock_post.return_value = mock_response
+
+    provider = DuffelProvider("LON", "JFK", ["2026-06-16"], rate_limiter=AdaptiveRateLimiter(rate=100.0))
+    provider.token = "fake_token"
+    assert provider._cache_queries() == [("LON", "NYC", "2026-06-16")]
+
+    assert [leg.flight_number for leg in provider.get_flights("LHR", "JFK", "2026-06-16")] == ["ZZ1"]
+    assert [leg.flight_number for leg in provider.get_flights("LGW", "EWR", "2026-06-16")] == ["ZZ2"]
+    assert mock_post.call_count == 1
+    slice_query = mock_post.call_args.kwargs["json"]["data"]["slices"][0]
+    assert (slice_query["origin"], slice_query["destination"]) == ("LON", "NYC")
+
+def test_non_metro_endpoints_keep_airport_queries():
+    provider = DuffelProvider("FCO", "LAX", ["2026-06-16"])
+    provider.token = "fake_token"
+    # Roma è interrogata come ROM; il gruppo LAX resta per aeroporto
+    assert provider._cache_queries() == [("ROM", apt, "2026-06-16") for apt in ["LAX", "BUR", "LGB", "ONT", "SNA"]]
+
+@patch("api.http_client.requests.Session.post")
+def test_rejected_request_is_not_counted_as_failure(mock_post):
+    mock_422 = MagicMock()
+    mock_422.status_code = 422
+    mock_422.headers = {}
+    mock_post.return_value = mock_422
+
+    provider = DuffelProvider(rate_limiter=AdaptiveRateLimiter(rate=100.0))
+    provider.token = "fake_token"
+
+    assert provider.get_flights("FCO", "AMS", "2026-06-18") == []
+    assert provider.failed_requests == 0
+
+@patch("api.http_client.httpx.AsyncClient.post", new_callable=AsyncMock)
+def test_singleflight_follower_counts_shared_failure(mock_post):
+    mock_503 = MagicMock()
+    mock_503.status_code = 503
+    mock_503.headers = {}
+
+    async def slow_post(*args, **kwargs):
+        await asyncio.sleep(0.05)
+        return mock_503
+
+    mock_post.side_effect = slow_post
+    leader = DuffelProvider(rate_limiter=AdaptiveRateLimiter(rate=100.0))
+    follower = DuffelProvider(rate_limiter=AdaptiveRateLimiter(rate=100.0))
+    leader.token = follower.token = "fake_token"
+
+    async def search():
+        return await asyncio.gather(leader.aget_flights("FCO", "AMS", "2026-06-19"), follower.aget_flights("FCO", "AMS", "2026-06-19"))
+
+    assert asyncio.run(search()) == [[], []]
+    mock_post.assert_awaited_once()
+    assert leader.failed_requests == 1
+    assert follower.failed_requests == 1
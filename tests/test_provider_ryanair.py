@@ -3,7 +3,7 @@ from datetime import datetime
 from api.models import FlightLeg
 from api.providers.ryanair import RyanairProvider
 
-@patch("api.providers.ryanair.requests.get")
+@patch("api.http_client.requests.Session.get")
 def test_get_destinations_returns_list(mock_get):
     mock_response = MagicMock()
     mock_response.status_code = 200
@@ -19,7 +19,7 @@ def test_get_destinations_returns_list(mock_get):
     assert "AMS" in res
     assert "JFK" in res
 
-@patch("api.providers.ryanair.requests.get")
+@patch("api.http_client.requests.Session.get")
 def test_get_flights_returns_flight_legs(mock_get):
     mock_response = MagicMock()
     mock_response.status_code = 200
@@ -53,7 +53,7 @@ def test_get_flights_returns_flight_legs(mock_get):
     assert leg.price == 50.0
     assert leg.flight_number == "FR1234"
 
-@patch("api.providers.ryanair.requests.get")
+@patch("api.http_client.requests.Session.get")
 def test_get_flights_empty_on_404(mock_get):
     mock_response = MagicMock()
     mock_response.status_code = 404
@@ -62,8 +62,20 @@ def test_get_flights_empty_on_404(mock_get):
     provider = RyanairProvider()
     res = provider.get_flights("FCO", "AMS", "2026-06-16")
     assert res == []
+    # Rotta senza tariffe, non un errore upstream
+    assert provider.failed_requests == 0
 
-@patch("api.providers.ryanair.requests.get")
+@patch("api.http_client.requests.Session.get")
+def test_get_flights_counts_upstream_errors(mock_get):
+    mock_response = MagicMock()
+    mock_response.status_code = 503
+    mock_get.return_value = mock_response
+
+    provider = RyanairProvider()
+    assert provider.get_flights("FCO", "AMS", "2026-07-16") == []
+    assert provider.failed_requests == 1
+
+@patch("api.http_client.requests.Session.get")
 def test_get_flights_parses_dates(mock_get):
     mock_response = MagicMock()
     mock_response.status_code = 200
@@ -91,3 +103,62 @@ def test_get_flights_parses_dates(mock_get):
     assert isinstance(res[0].arrival, datetime)
     assert res[0].departure == datetime(2026, 6, 16, 10, 0)
     assert res[0].arrival == datetime(2026, 6, 16, 12, 30)
+
+def test_async_methods_use_injected_http_client():
+    from unittest.mock import AsyncMock
+    import asyncio
+    response = MagicMock()
+    response.status_code = 200
+    response.json.return_value = [{"arrivalAirport": {"code": "BGY"}}]
+    async_http = MagicMock()
+    async_http.get = AsyncMock(return_value=response)
+    http = MagicMock()
+    http.async_client.return_value = async_http
+
+    provider = RyanairProvider(http=http)
+    assert asyncio.run(provider.aget_destinations("ZZA")) == ["BGY"]
+    async_http.get.assert_awaited_once()
+
+def test_async_reads_persistent_cache_off_the_event_loop(tmp_path):
+    import asyncio
+    import threading
+    from api.cache import SQLiteCache
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"))
+    leg = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 50.0, "Ryanair", "FR1")
+    cache.set("fares", "FCO|AMS|2026-06-01", [leg.to_row()], 60)
+    cache.flush()
+    reader_threads = []
+    get = cache.get
+    cache.get = lambda *args: reader_threads.append(threading.current_thread()) or get(*args)
+
+    async def fetch():
+        return await RyanairProvider(cache=cache).aget_flights("FCO", "AMS", "2026-06-01"), threading.current_thread()
+
+    legs, loop_thread = asyncio.run(fetch())
+    assert legs == [leg]
+    assert reader_threads and all(t is not loop_thread for t in reader_threads)
+
+def test_singleflight_follower_counts_shared_failure():
+    from unittest.mock import AsyncMock
+    import asyncio
+    response = MagicMock()
+    response.status_code = 503
+
+    async def slow_get(url):
+        await asyncio.sleep(0.05)
+        return response
+
+    async_http = MagicMock()
+    async_http.get = AsyncMock(side_effect=slow_get)
+    http = MagicMock()
+    http.async_client.return_value = async_http
+    leader, follower = RyanairProvider(http=http), RyanairProvider(http=http)
+
+    async def search():
+        return await asyncio.gather(leader.aget_flights("FCO", "AMS", "2026-08-01"), follower.aget_flights("FCO", "AMS", "2026-08-01"))
+
+    assert asyncio.run(search()) == [[], []]
+    # Una sola chiamata upstream, ma entrambe le ricerche sono parziali
+    async_http.get.assert_awaited_once()
+    assert leader.failed_requests == 1
+    assert follower.failed_requests == 1
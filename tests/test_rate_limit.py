@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import time
+import pytest
+from email.utils import formatdate
+from api.rate_limit import AdaptiveRateLimiter, reset_seconds
+
+def test_burst_then_paced():
+    limiter = AdaptiveRateLimiter(rate=10.0, capacity=3)
+    waits = [limiter._reserve() for _ in range(5)]
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3] == pytest.approx(0.1, abs=0.01)
+    assert waits[4] == pytest.approx(0.2, abs=0.01)
+
+def test_headers_adapt_rate_and_tokens():
+    limiter = AdaptiveRateLimiter(rate=2.0, capacity=5)
+    limiter.update_from_headers({"ratelimit-limit": "120", "ratelimit-remaining": "60", "ratelimit-reset": "30"})
+    assert limiter.capacity == 120
+    assert limiter.rate == pytest.approx(2.0)
+    limiter.update_from_headers({"ratelimit-limit": "120", "ratelimit-remaining": "100", "ratelimit-reset": "10"})
+    # Più quota residua rispetto al tempo mancante: la velocità sale oltre quella iniziale
+    assert limiter.rate == pytest.approx(10.0)
+
+def test_exhausted_quota_waits_for_reset():
+    limiter = AdaptiveRateLimiter(rate=50.0, capacity=10)
+    limiter.update_from_headers({"ratelimit-remaining": "0", "ratelimit-reset": "4"})
+    assert limiter._reserve() == pytest.approx(4.0, abs=0.05)
+
+def test_pause_blocks_all_requests():
+    limiter = AdaptiveRateLimiter(rate=100.0, capacity=10)
+    limiter.pause(1.5)
+    assert limiter._reserve() == pytest.approx(1.5, abs=0.05)
+    assert limiter._reserve() == pytest.approx(1.51, abs=0.05)
+
+def test_queued_acquire_respects_a_later_pause():
+    limiter = AdaptiveRateLimiter(rate=20.0, capacity=1)
+    limiter.acquire()
+    # Il secondo acquire ha già prenotato il suo turno (50 ms) quando arriva il 429
+    threading.Timer(0.01, limiter.pause, args=(0.3,)).start()
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.3
+
+def test_queued_aacquire_respects_a_later_pause():
+    limiter = AdaptiveRateLimiter(rate=20.0, capacity=1)
+
+    async def run():
+        await limiter.aacquire()
+        waiter = asyncio.ensure_future(limiter.aacquire())
+        await asyncio.sleep(0.01)
+        limiter.pause(0.3)
+        paused_at = time.monotonic()
+        await waiter
+        return time.monotonic() - paused_at
+
+    assert asyncio.run(run()) >= 0.29
+
+def test_reset_header_formats():
+    assert reset_seconds("12") == 12.0
+    assert reset_seconds(None) is None
+    assert reset_seconds(str(time.time() + 20)) == pytest.approx(20, abs=1)
+    assert reset_seconds(formatdate(time.time() + 30, usegmt=True)) == pytest.approx(30, abs=2)
+    assert reset_seconds("invalid") is None
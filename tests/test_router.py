@@ -1,7 +1,8 @@
 from datetime import datetime
 from api.models import FlightLeg
 from api.providers.base import FlightProvider
-from api.router import find_connections
+import asyncio
+from api.router import find_connections, RoutingSession
 
 class MockProvider(FlightProvider):
     def __init__(self, destinations=None, flights=None):
@@ -160,3 +161,265 @@ def test_cross_provider_connection():
     assert res[0].first_leg.carrier == "Ryanair"
     assert res[0].second_leg.carrier == "Vueling"
     assert res[0].total_price == 105.0
+
+def test_layover_window_boundaries():
+    # Il join sort-merge deve includere il limite superiore e scartare la partenza contemporanea all'arrivo
+    f1 = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 50.0, "Carrier", "CR1")
+    same_time = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 12, 0), datetime(2026, 6, 16, 20, 0), 100.0, "Carrier", "CR2")
+    at_limit = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 22, 0), datetime(2026, 6, 17, 6, 0), 110.0, "Carrier", "CR3")
+    past_limit = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 22, 1), datetime(2026, 6, 17, 6, 1), 90.0, "Carrier", "CR4")
+    inside = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 14, 0), datetime(2026, 6, 16, 22, 0), 120.0, "Carrier", "CR5")
+    prov = MockProvider(
+        destinations={"FCO": ["AMS"], "JFK": ["AMS"]},
+        flights={
+            ("FCO", "AMS", "2026-06-16"): [f1],
+            ("AMS", "JFK", "2026-06-16"): [past_limit, inside, same_time, at_limit]
+        }
+    )
+    res = find_connections([(prov, ["2026-06-16"])], "FCO", "JFK", max_layover_h=10.0, use_city_groups=False)
+    assert [c.second_leg.flight_number for c in res] == ["CR3", "CR5"]
+    assert res[0].layover_h == 10.0
+
+def _two_stop_provider():
+    f1 = FlightLeg("OLB", "BCN", "Olbia", "Barcelona", datetime(2026, 6, 16, 8, 0), datetime(2026, 6, 16, 10, 0), 40.0, "Carrier", "CR1")
+    f1_late = FlightLeg("OLB", "BCN", "Olbia", "Barcelona", datetime(2026, 6, 16, 9, 0), datetime(2026, 6, 16, 11, 0), 40.0, "Carrier", "CR2")
+    f1_pricey = FlightLeg("OLB", "BCN", "Olbia", "Barcelona", datetime(2026, 6, 16, 7, 0), datetime(2026, 6, 16, 9, 0), 90.0, "Carrier", "CR3")
+    f2 = FlightLeg("BCN", "LIS", "Barcelona", "Lisbon", datetime(2026, 6, 16, 13, 0), datetime(2026, 6, 16, 15, 0), 60.0, "Carrier", "CR4")
+    f3 = FlightLeg("LIS", "JFK", "Lisbon", "New York", datetime(2026, 6, 16, 18, 0), datetime(2026, 6, 17, 2, 0), 300.0, "Carrier", "CR5")
+    return MockProvider(
+        destinations={"OLB": ["BCN"], "JFK": ["LIS"], "BCN": ["LIS", "OLB"], "LIS": ["JFK", "BCN"]},
+        flights={
+            ("OLB", "BCN", "2026-06-16"): [f1, f1_late, f1_pricey],
+            ("BCN", "LIS", "2026-06-16"): [f2],
+            ("LIS", "JFK", "2026-06-16"): [f3],
+        }
+    )
+
+def test_two_stop_connection_found():
+    prov = _two_stop_provider()
+    res = find_connections([(prov, ["2026-06-16"])], "OLB", "JFK", max_layover_h=10.0,
+                           use_city_groups=False, max_stops=2)
+    # CR1 (stesso prezzo, parte prima) e CR3 (più caro, parte prima) sono dominati da CR2
+    assert len(res) == 1
+    c = res[0]
+    assert c.connection_label == "OLB-BCN | BCN-LIS | LIS-JFK"
+    assert [leg.flight_number for leg in c.legs] == ["CR2", "CR4", "CR5"]
+    assert c.total_price == 400.0
+    assert c.layover_h == 5.0
+    assert c.total_duration_h == 17.0
+    d = c.to_dict()
+    assert d["Third Leg Flight Number"] == "CR5"
+    assert d["Third Leg Destination City"] == "New York"
+
+def test_two_stop_disabled_by_default():
+    prov = _two_stop_provider()
+    res = find_connections([(prov, ["2026-06-16"])], "OLB", "JFK", max_layover_h=10.0, use_city_groups=False)
+    assert len(res) == 0
+
+def test_limit_keeps_cheapest_connections():
+    f_direct = FlightLeg("FCO", "JFK", "Rome", "New York", datetime(2026, 6, 16, 9, 0), datetime(2026, 6, 16, 18, 0), 400.0, "Carrier", "CR0")
+    f1 = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 50.0, "Carrier", "CR1")
+    f2a = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 15, 0), datetime(2026, 6, 16, 23, 0), 200.0, "Carrier", "CR2")
+    f2b = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 16, 0), datetime(2026, 6, 17, 0, 0), 100.0, "Carrier", "CR3")
+    f3 = FlightLeg("FCO", "CDG", "Rome", "Paris", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 300.0, "Carrier", "CR4")
+    f4 = FlightLeg("CDG", "JFK", "Paris", "New York", datetime(2026, 6, 16, 15, 0), datetime(2026, 6, 16, 23, 0), 300.0, "Carrier", "CR5")
+    prov = MockProvider(
+        destinations={"FCO": ["AMS", "CDG", "JFK"], "JFK": ["AMS", "CDG", "FCO"]},
+        flights={
+            ("FCO", "JFK", "2026-06-16"): [f_direct],
+            ("FCO", "AMS", "2026-06-16"): [f1],
+            ("AMS", "JFK", "2026-06-16"): [f2a, f2b],
+            ("FCO", "CDG", "2026-06-16"): [f3],
+            ("CDG", "JFK", "2026-06-16"): [f4],
+        }
+    )
+    full = find_connections([(prov, ["2026-06-16"])], "FCO", "JFK", max_layover_h=10.0, use_city_groups=False)
+    assert [c.total_price for c in full] == [150.0, 250.0, 400.0, 600.0]
+
+    top = find_connections([(prov, ["2026-06-16"])], "FCO", "JFK", max_layover_h=10.0, use_city_groups=False, limit=2)
+    assert [c.total_price for c in top] == [150.0, 250.0]
+
+def test_pareto_mode_drops_dominated_connections():
+    f1 = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 50.0, "Carrier", "CR1")
+    fast = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 13, 0), datetime(2026, 6, 16, 21, 0), 300.0, "Carrier", "CR2")
+    cheap = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 20, 0), datetime(2026, 6, 17, 4, 0), 100.0, "Carrier", "CR3")
+    dominated = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 21, 0), datetime(2026, 6, 17, 5, 0), 150.0, "Carrier", "CR4")
+    prov = MockProvider(
+        destinations={"FCO": ["AMS"], "JFK": ["AMS"]},
+        flights={
+            ("FCO", "AMS", "2026-06-16"): [f1],
+            ("AMS", "JFK", "2026-06-16"): [fast, cheap, dominated],
+        }
+    )
+    res = find_connections([(prov, ["2026-06-16"])], "FCO", "JFK", max_layover_h=24.0,
+                           use_city_groups=False, pareto=True)
+    assert [c.second_leg.flight_number for c in res] == ["CR3", "CR2"]
+
+def test_parallel_fetch_requests_each_route_once():
+    import threading
+
+    class CountingProvider(MockProvider):
+        max_concurrency = 4
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.calls = []
+            self.threads = set()
+
+        def get_flights(self, from_code, to_code, date_str):
+            self.calls.append((from_code, to_code, date_str))
+            self.threads.add(threading.get_ident())
+            return super().get_flights(from_code, to_code, date_str)
+
+    f1 = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 50.0, "Carrier", "CR1")
+    f2 = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 15, 0), datetime(2026, 6, 16, 23, 0), 200.0, "Carrier", "CR2")
+    prov = CountingProvider(
+        destinations={"FCO": ["AMS", "CDG"], "CIA": ["AMS"], "JFK": ["AMS", "CDG"]},
+        flights={
+            ("FCO", "AMS", "2026-06-16"): [f1],
+            ("AMS", "JFK", "2026-06-16"): [f2]
+        }
+    )
+    res = find_connections([(prov, ["2026-06-16", "2026-06-17"])], "FCO", "JFK", max_layover_h=10.0, use_city_groups=True)
+    assert len(res) == 1
+    assert len(prov.calls) == len(set(prov.calls))
+    # FCO/CIA → JFK/LGA/EWR diretti, FCO/CIA → AMS/CDG, AMS/CDG → JFK/LGA/EWR, per 2 date
+    assert len(prov.calls) == (6 + 4 + 6) * 2
+    assert threading.get_ident() not in prov.threads
+
+def _session_search(providers_with_dates, start, end, **kwargs):
+    """Pipeline asincrona di /api/search: i provider entrano uno alla volta nella RoutingSession."""
+    session = RoutingSession(start, end, **kwargs)
+
+    async def run():
+        for provider, dates in providers_with_dates:
+            await session.add_provider(provider, dates)
+        return session.results()
+
+    return asyncio.run(run())
+
+def test_async_search_matches_sync():
+    class AsyncMockProvider(MockProvider):
+        max_concurrency = 2
+
+        async def aget_destinations(self, airport_code):
+            return self.get_destinations(airport_code)
+
+        async def aget_flights(self, from_code, to_code, date_str):
+            await asyncio.sleep(0)
+            return self.get_flights(from_code, to_code, date_str)
+
+    direct = FlightLeg("FCO", "JFK", "Rome", "New York", datetime(2026, 6, 16, 9, 0), datetime(2026, 6, 16, 18, 0), 400.0, "Carrier", "CR0")
+    f1 = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 50.0, "Carrier", "CR1")
+    f2 = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 15, 0), datetime(2026, 6, 16, 23, 0), 200.0, "Carrier", "CR2")
+    flights = {
+        ("FCO", "JFK", "2026-06-16"): [direct],
+        ("FCO", "AMS", "2026-06-16"): [f1],
+    }
+    destinations = {"FCO": ["AMS", "JFK"], "JFK": ["AMS", "FCO"]}
+    # Provider asincrono e sincrono insieme: il secondo viene eseguito in un thread
+    async_prov = AsyncMockProvider(destinations=destinations, flights=flights)
+    sync_prov = MockProvider(destinations={"JFK": ["AMS"]}, flights={("AMS", "JFK", "2026-06-16"): [f2]})
+    providers = [(async_prov, ["2026-06-16"]), (sync_prov, ["2026-06-16"])]
+
+    expected = find_connections(providers, "FCO", "JFK", max_layover_h=10.0, use_city_groups=False)
+    res = _session_search(providers, "FCO", "JFK", max_layover_h=10.0, use_city_groups=False)
+    assert [c.connection_label for c in res] == [c.connection_label for c in expected]
+    assert sorted(c.total_price for c in res) == [250.0, 400.0]
+
+def test_reverse_lookup_used_for_destination_side():
+    class ReverseProvider(MockProvider):
+        def get_origins(self, airport_code):
+            return {"JFK": ["AMS"]}.get(airport_code, [])
+
+    f1 = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 50.0, "Carrier", "CR1")
+    f2 = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 15, 0), datetime(2026, 6, 16, 23, 0), 200.0, "Carrier", "CR2")
+    # get_destinations("JFK") non conosce AMS: solo il lookup inverso trova lo scalo
+    prov = ReverseProvider(
+        destinations={"FCO": ["AMS"], "JFK": []},
+        flights={("FCO", "AMS", "2026-06-16"): [f1], ("AMS", "JFK", "2026-06-16"): [f2]}
+    )
+    res = find_connections([(prov, ["2026-06-16"])], "FCO", "JFK", max_layover_h=10.0, use_city_groups=False)
+    assert [c.connection_label for c in res] == ["FCO-AMS | AMS-JFK"]
+    res = _session_search([(prov, ["2026-06-16"])], "FCO", "JFK", max_layover_h=10.0, use_city_groups=False)
+    assert [c.connection_label for c in res] == ["FCO-AMS | AMS-JFK"]
+
+def test_routing_session_matches_combined_search():
+    class CountingProvider(MockProvider):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.calls = []
+
+        def get_flights(self, from_code, to_code, date_str):
+            self.calls.append((from_code, to_code))
+            return super().get_flights(from_code, to_code, date_str)
+
+    date = "2026-07-10"
+    olb_bcn = FlightLeg("OLB", "BCN", "Olbia", "Barcelona", datetime(2026, 7, 10, 7, 0), datetime(2026, 7, 10, 9, 0), 49.0, "Ryanair", "FR1")
+    olb_stn = FlightLeg("OLB", "STN", "Olbia", "London", datetime(2026, 7, 10, 6, 0), datetime(2026, 7, 10, 8, 0), 30.0, "Ryanair", "FR2")
+    stn_cia = FlightLeg("STN", "CIA", "London", "Rome", datetime(2026, 7, 10, 12, 0), datetime(2026, 7, 10, 15, 0), 40.0, "Ryanair", "FR3")
+    bcn_cia = FlightLeg("BCN", "CIA", "Barcelona", "Rome", datetime(2026, 7, 10, 14, 0), datetime(2026, 7, 10, 16, 0), 65.0, "Vueling", "VY1")
+    olb_cia = FlightLeg("OLB", "CIA", "Olbia", "Rome", datetime(2026, 7, 10, 18, 0), datetime(2026, 7, 10, 19, 0), 90.0, "Vueling", "VY2")
+    # Ryanair non vola BCN→CIA: lo scalo BCN emerge solo con il secondo provider
+    ryanair = CountingProvider(
+        destinations={"OLB": ["BCN", "STN"], "CIA": ["STN"]},
+        flights={(f.from_code, f.to_code, date): [f] for f in (olb_bcn, olb_stn, stn_cia)},
+    )
+    duffel = MockProvider(
+        destinations={"OLB": ["CIA"], "CIA": ["BCN", "OLB"]},
+        flights={(f.from_code, f.to_code, date): [f] for f in (bcn_cia, olb_cia)},
+    )
+    providers = [(ryanair, [date]), (duffel, [date])]
+    expected = find_connections(providers, "OLB", "CIA", max_layover_h=10.0, use_city_groups=False)
+    ryanair.calls.clear()
+
+    session = RoutingSession("OLB", "CIA", max_layover_h=10.0, use_city_groups=False)
+
+    async def run():
+        first = await session.add_provider(ryanair, [date])
+        second = await session.add_provider(duffel, [date])
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert [c.connection_label for c in first] == ["OLB-STN | STN-CIA"]
+    # Solo il delta: il diretto e la connessione cross-provider via BCN
+    assert sorted(c.connection_label for c in second) == ["OLB-BCN | BCN-CIA", "OLB-CIA (Diretto)"]
+    assert sorted(c.connection_label for c in session.results()) == sorted(c.connection_label for c in expected)
+    # Per Ryanair una sola richiesta in più: OLB→BCN per il nuovo scalo (BCN→CIA è vuota)
+    assert ryanair.calls.count(("OLB", "BCN")) == 1
+    assert session.add_legs([olb_bcn, bcn_cia]) == []
+
+def test_two_stop_fetches_only_planned_middle_routes():
+    prov = _two_stop_provider()
+    # Scali fittizi senza tratte esterne: non devono generare richieste per tratte centrali
+    prov.destinations_map["OLB"] = ["BCN", "MAD"]
+    prov.destinations_map["JFK"] = ["LIS", "OPO"]
+    prov.destinations_map["MAD"] = ["OPO", "LIS"]
+    calls = []
+    get_flights = prov.get_flights
+    prov.get_flights = lambda *key: calls.append(key) or get_flights(*key)
+    res = find_connections([(prov, ["2026-06-16"])], "OLB", "JFK", max_layover_h=10.0,
+                           use_city_groups=False, max_stops=2)
+    assert [c.connection_label for c in res] == ["OLB-BCN | BCN-LIS | LIS-JFK"]
+    middle = {(f, t) for f, t, _ in calls if f != "OLB" and t != "JFK"}
+    assert middle == {("BCN", "LIS")}
+    assert len(calls) == len(set(calls))
+
+def test_two_stop_middle_routes_capped():
+    from api.router import _find_two_stop_connections
+    prov = _two_stop_provider()
+    calls = []
+    get_flights = prov.get_flights
+    prov.get_flights = lambda *key: calls.append(key) or get_flights(*key)
+    res = _find_two_stop_connections([(prov, ["2026-06-16"])], ["OLB"], ["JFK"], {"BCN"}, {"LIS"},
+                                     10.0, lambda dt: True, max_pairs=0)
+    assert res == []
+    assert ("BCN", "LIS", "2026-06-16") not in calls
+
+def test_two_stop_async_matches_sync():
+    prov = _two_stop_provider()
+    sync = find_connections([(prov, ["2026-06-16"])], "OLB", "JFK", max_layover_h=10.0,
+                            use_city_groups=False, max_stops=2)
+    res = _session_search([(_two_stop_provider(), ["2026-06-16"])], "OLB", "JFK",
+                          max_layover_h=10.0, use_city_groups=False, max_stops=2)
+    assert [c.connection_label for c in res] == [c.connection_label for c in sync]
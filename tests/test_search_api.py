@@ -0,0 +1,176 @@
+import asyncio
+import json
+import time
+from datetime import datetime
+import pytest
+from fastapi.testclient import TestClient
+from api import index
+from api.models import FlightLeg
+from api.search_cache import SearchResultCache, search_key
+
+RYANAIR_DIRECT = FlightLeg("FCO", "JFK", "Rome", "New York", datetime(2026, 6, 16, 9, 0), datetime(2026, 6, 16, 18, 0), 300.0, "Ryanair", "FR1")
+RYANAIR_FIRST = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 0), 40.0, "Ryanair", "FR2")
+DUFFEL_DIRECT = FlightLeg("FCO", "JFK", "Rome", "New York", datetime(2026, 6, 16, 11, 0), datetime(2026, 6, 16, 20, 0), 500.0, "Duffel", "ZZ1")
+DUFFEL_SECOND = FlightLeg("AMS", "JFK", "Amsterdam", "New York", datetime(2026, 6, 16, 15, 0), datetime(2026, 6, 16, 23, 0), 200.0, "Duffel", "ZZ2")
+
+PARAMS = {"start": "FCO", "end": "JFK", "start_date": "2026-06-16", "end_date": "2026-06-16"}
+
+class FakeRyanair:
+    def __init__(self, cache=None):
+        self.failed_requests = 0
+
+    def get_destinations(self, airport_code):
+        return {"FCO": ["AMS", "JFK"], "JFK": ["FCO"]}.get(airport_code, [])
+
+    def get_flights(self, from_code, to_code, date_str):
+        flights = {("FCO", "JFK"): [RYANAIR_DIRECT], ("FCO", "AMS"): [RYANAIR_FIRST]}
+        return flights.get((from_code, to_code), []) if date_str == "2026-06-01" else []
+
+class FakeDuffel:
+    fail = False
+
+    def __init__(self, start, end, dates, progress_callback=None):
+        self.dates = dates
+        self.progress_callback = progress_callback
+        self.failed_requests = 0
+
+    async def aget_destinations(self, airport_code):
+        # Fase Duffel più lenta: i suoi eventi arrivano dopo quelli di Ryanair
+        await asyncio.sleep(0.2)
+        if self.fail:
+            raise RuntimeError("Duffel giù")
+        self.progress_callback(50, "Ricerca Duffel: volo 1/1 completato")
+        return {"FCO": ["JFK", "AMS"], "AMS": ["JFK"]}.get(airport_code, [])
+
+    def get_origins(self, airport_code):
+        return {"JFK": ["FCO", "AMS"]}.get(airport_code, [])
+
+    async def aget_origins(self, airport_code):
+        return self.get_origins(airport_code)
+
+    async def aget_flights(self, from_code, to_code, date_str):
+        flights = {("FCO", "JFK"): [DUFFEL_DIRECT], ("AMS", "JFK"): [DUFFEL_SECOND]}
+        return flights.get((from_code, to_code), []) if date_str == "2026-06-16" else []
+
+@pytest.fixture
+def search_cache(monkeypatch):
+    cache = SearchResultCache()
+    monkeypatch.setattr(index, "RyanairProvider", FakeRyanair)
+    monkeypatch.setattr(index, "DuffelProvider", FakeDuffel)
+    monkeypatch.setattr(index, "get_shared_cache", lambda: None)
+    monkeypatch.setattr(index, "get_search_cache", lambda: cache)
+    monkeypatch.setattr(FakeDuffel, "fail", False)
+    return cache
+
+def _events(client, **params):
+    response = client.get("/api/search", params={**PARAMS, **params})
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.iter_lines() if line]
+
+def _labels(records):
+    return sorted(r["Connection"] for r in records)
+
+ALL_LABELS = ["FCO-AMS | AMS-JFK", "FCO-JFK (Diretto)", "FCO-JFK (Diretto)"]
+
+def test_protocol_1_streams_partials_from_both_phases(search_cache):
+    with TestClient(index.app) as client:
+        events = _events(client)
+    types = [e["type"] for e in events]
+    assert types[0] == "search"
+    assert types[-1] == "results"
+    partials = [e for e in events if e["type"] == "partial_results"]
+    # Prima il risultato Ryanair, poi quello dopo la fase Duffel con le connessioni cross-provider
+    assert len(partials) == 2
+    assert [r["First Leg Flight Number"] for r in partials[0]["data"]] == ["FR1"]
+    assert _labels(partials[1]["data"]) == ALL_LABELS
+    assert _labels(events[-1]["data"]) == ALL_LABELS
+    percents = [e["percent"] for e in events if e["type"] == "progress"]
+    assert percents == sorted(percents) and percents[-1] == 100
+    assert types.index("partial_results") < types.index("results")
+    assert search_cache.get(search_key(**PARAMS, max_layover_days=3))[0]
+
+def test_protocol_2_sends_only_deltas(search_cache):
+    with TestClient(index.app) as client:
+        events = _events(client, protocol=2)
+    deltas = [e for e in events if e["type"] == "delta"]
+    assert [r["First Leg Flight Number"] for r in deltas[0]["added"]] == ["FR1"]
+    # Ogni connessione è inviata una volta sola, con id stabile
+    added = [r for d in deltas for r in d["added"]]
+    assert _labels(added) == ALL_LABELS
+    assert len({r["id"] for r in added}) == len(added)
+    assert all(d["removed"] == [] for d in deltas)
+    assert events[-1] == {"type": "complete", "count": 3}
+
+def test_compact_format(search_cache):
+    with TestClient(index.app) as client:
+        events = _events(client, format="compact")
+    final = events[-1]
+    assert final["type"] == "results" and final["format"] == "compact"
+    assert final["data"]["count"] == 3
+
+def test_trace_event(search_cache):
+    with TestClient(index.app) as client:
+        events = _events(client, trace=1)
+    timing = events[-1]
+    assert timing["type"] == "timing"
+    phases = {child["name"] for child in timing["spans"]["children"]}
+    assert {"phase.ryanair", "phase.duffel", "store_results"} <= phases
+
+def test_cache_hit_serves_results_without_providers(search_cache, monkeypatch):
+    with TestClient(index.app) as client:
+        _events(client)
+        monkeypatch.setattr(index, "RyanairProvider", None)
+        events = _events(client)
+    assert [e["type"] for e in events] == ["search", "progress", "results"]
+    assert events[1]["message"] == "Risultati dalla cache."
+    assert _labels(events[-1]["data"]) == ALL_LABELS
+
+def test_stale_results_are_refreshed_in_background(search_cache):
+    key = search_key(**PARAMS, max_layover_days=3)
+    with TestClient(index.app) as client:
+        _events(client)
+        connections, created_at = search_cache._entries[key]
+        search_cache._entries[key] = (connections, created_at - search_cache.fresh_ttl - 1)
+        events = _events(client)
+        assert events[1]["message"].startswith("Risultati dalla cache, aggiornamento")
+        deadline = time.time() + 5
+        while (search_cache._entries[key][1] <= created_at or search_cache._refreshing) and time.time() < deadline:
+            time.sleep(0.05)
+    assert search_cache._entries[key][1] > created_at
+    assert not search_cache._refreshing
+
+def test_failed_duffel_phase_is_not_cached(search_cache, monkeypatch):
+    monkeypatch.setattr(FakeDuffel, "fail", True)
+    with TestClient(index.app) as client:
+        events = _events(client)
+    assert any("Duffel non disponibile" in e.get("message", "") for e in events)
+    assert [r["First Leg Flight Number"] for r in events[-1]["data"]] == ["FR1"]
+    assert len(search_cache) == 0
+
+def test_closing_the_stream_cancels_provider_phases(search_cache, monkeypatch):
+    cancelled = []
+
+    class HangingDuffel(FakeDuffel):
+        async def aget_destinations(self, airport_code):
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append(airport_code)
+                raise
+
+    monkeypatch.setattr(index, "DuffelProvider", HangingDuffel)
+
+    async def consume_then_close():
+        stream = index._search_stream(**PARAMS, max_layover_days=3, max_stops=1, limit=None, pareto=False, cache_key="k")
+        async for line in stream:
+            if '"partial_results"' in (line.decode() if isinstance(line, bytes) else line):
+                break  # il client se ne va dopo i risultati Ryanair
+        phases = asyncio.all_tasks() - {asyncio.current_task()}
+        await stream.aclose()
+        # Controllo prima che asyncio.run cancelli da sé i task rimasti
+        return phases, [task.done() for task in phases], list(cancelled)
+
+    phases, done, cancelled_on_close = asyncio.run(consume_then_close())
+    assert phases and all(done)
+    assert cancelled_on_close
+    assert len(search_cache) == 0
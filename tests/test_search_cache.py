@@ -0,0 +1,81 @@
+from datetime import datetime
+from api.cache import SQLiteCache
+from api.models import FlightLeg, Connection
+from api.search_cache import SearchResultCache, search_key, search_id, FRESH, STALE
+
+def _connection(price: float) -> Connection:
+    leg = FlightLeg("FCO", "AMS", "Rome", "Amsterdam", datetime(2026, 6, 16, 10, 0), datetime(2026, 6, 16, 12, 30), price, "Ryanair", "FR1")
+    return Connection("FCO-AMS (Diretto)", leg, None, 0.0, 2.5, price)
+
+def test_key_is_normalized():
+    assert search_key(" fco", "ams ", "2026-06-01", "2026-06-10", 3) == search_key("FCO", "AMS", "2026-06-01", "2026-06-10", 3)
+    assert search_key("FCO", "AMS", "2026-06-01", "2026-06-10", 3) != search_key("FCO", "AMS", "2026-06-01", "2026-06-10", 3, limit=10)
+
+def test_fresh_stale_and_expired():
+    cache = SearchResultCache(fresh_ttl=60, stale_ttl=120)
+    assert cache.get("k") is None
+    cache.set("k", [_connection(50.0)])
+    connections, state = cache.get("k")
+    assert state == FRESH and connections[0].total_price == 50.0
+
+    connections, created_at = cache._entries["k"]
+    cache._entries["k"] = (connections, created_at - 90)
+    assert cache.get("k")[1] == STALE
+    cache._entries["k"] = (connections, created_at - 150)
+    assert cache.get("k") is None
+
+def test_lru_eviction():
+    cache = SearchResultCache(max_entries=2)
+    cache.set("a", [])
+    cache.set("b", [])
+    cache.get("a")  # "a" torna la più recente
+    cache.set("c", [])
+    assert set(cache._entries) == {"a", "c"}
+
+def test_single_background_refresh_per_key():
+    cache = SearchResultCache()
+    assert cache.begin_refresh("k")
+    assert not cache.begin_refresh("k")
+    cache.end_refresh("k")
+    assert cache.begin_refresh("k")
+
+def test_results_persisted_across_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    first = SearchResultCache(SQLiteCache(path))
+    first.set("k", [_connection(42.0)])
+    first.store.flush()
+    # Un altro worker con memoria vuota ritrova la ricerca dal file
+    other = SearchResultCache(SQLiteCache(path))
+    connections, state = other.get("k")
+    assert state == FRESH
+    assert connections == [_connection(42.0)]
+
+def test_lookup_by_search_id():
+    cache = SearchResultCache(max_entries=1, fresh_ttl=60, stale_ttl=120)
+    cache.set("a", [_connection(50.0)])
+    assert search_id("a") != search_id("b")
+    assert cache.lookup(search_id("a")) == [_connection(50.0)]
+    # Anche i risultati non più freschi restano esportabili
+    connections, created_at = cache._entries["a"]
+    cache._entries["a"] = (connections, created_at - 90)
+    assert cache.lookup(search_id("a")) == connections
+    cache.set("b", [])
+    assert cache.lookup(search_id("a")) is None
+    assert cache.lookup("sconosciuto") is None
+
+def test_lookup_from_persistent_store(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    first = SearchResultCache(SQLiteCache(path))
+    first.set("k", [_connection(42.0)])
+    first.store.flush()
+    assert SearchResultCache(SQLiteCache(path)).lookup(search_id("k")) == [_connection(42.0)]
+
+def test_aget_reads_persistent_store(tmp_path):
+    import asyncio
+    path = str(tmp_path / "cache.sqlite")
+    first = SearchResultCache(SQLiteCache(path))
+    first.set("k", [_connection(42.0)])
+    first.store.flush()
+    other = SearchResultCache(SQLiteCache(path))
+    assert asyncio.run(other.aget("k")) == ([_connection(42.0)], FRESH)
+    assert asyncio.run(other.aget("missing")) is None
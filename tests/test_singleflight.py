@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import time
+import pytest
+from api.singleflight import SingleFlight
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(timeout=5)
+        return ["FCO", "AMS"]
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("FCO", fetch))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    while flight.stats()["shared"] < 4:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert results == [["FCO", "AMS"]] * 5
+    assert flight.stats() == {"calls": 1, "shared": 4}
+
+def test_key_released_after_call():
+    flight = SingleFlight()
+    assert flight.do("k", lambda: 1) == 1
+    assert flight.do("k", lambda: 2) == 2
+
+def test_exception_propagates_and_releases_key():
+    flight = SingleFlight()
+
+    def fail():
+        raise RuntimeError("upstream")
+
+    with pytest.raises(RuntimeError):
+        flight.do("k", fail)
+    assert flight.do("k", lambda: "ok") == "ok"
+
+def test_async_calls_share_one_task():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 42
+
+    async def run():
+        return await asyncio.gather(*(flight.ado(("FCO", "AMS"), fetch) for _ in range(10)))
+
+    assert asyncio.run(run()) == [42] * 10
+    assert len(calls) == 1
+    assert flight.stats() == {"calls": 1, "shared": 9}
@@ -0,0 +1,67 @@
+import asyncio
+import json
+from api.tracing import Trace, span, detach_trace
+
+def test_span_is_noop_without_trace():
+    with span("orphan") as current:
+        assert current is None
+
+def test_nested_spans_and_totals():
+    with Trace("search", start="FCO") as trace:
+        with span("phase", provider="ryanair"):
+            with span("http.ryanair", path="/routes"):
+                pass
+            with span("http.ryanair", path="/fares"):
+                pass
+    tree = trace.to_dict()
+    assert tree["spans"]["name"] == "search"
+    assert tree["spans"]["attrs"] == {"start": "FCO"}
+    phase = tree["spans"]["children"][0]
+    assert phase["name"] == "phase"
+    assert [c["attrs"]["path"] for c in phase["children"]] == ["/routes", "/fares"]
+    assert tree["totals"]["http.ryanair"]["count"] == 2
+    assert tree["total_ms"] >= phase["duration_ms"]
+    # Fuori dal trace gli span tornano no-op
+    with span("after") as current:
+        assert current is None
+
+def test_tasks_and_threads_inherit_current_span():
+    async def upstream(name):
+        with span("http", name=name):
+            await asyncio.sleep(0.01)
+
+    def join():
+        with span("join"):
+            pass
+
+    async def background():
+        detach_trace()
+        with span("refresh"):
+            pass
+
+    async def run():
+        with Trace("search") as trace:
+            with span("fetch"):
+                await asyncio.gather(upstream("a"), upstream("b"))
+            await asyncio.to_thread(join)
+            await asyncio.create_task(background())
+        return trace
+
+    tree = asyncio.run(run()).to_dict()
+    fetch, join_span = tree["spans"]["children"]
+    assert sorted(c["attrs"]["name"] for c in fetch["children"]) == ["a", "b"]
+    assert join_span["name"] == "join"
+    assert "refresh" not in tree["totals"]
+
+def test_trace_logged_as_json_lines(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    for _ in range(2):
+        with Trace("search") as trace:
+            with span("serialize"):
+                pass
+        trace.log(str(path))
+    lines = path.read_text().splitlines()
+    assert len(lines) == 2
+    record = json.loads(lines[0])
+    assert record["spans"]["children"][0]["name"] == "serialize"
+    assert "timestamp" in record